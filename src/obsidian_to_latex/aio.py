@@ -0,0 +1,272 @@
+import asyncio
+import contextlib
+import dataclasses
+import os
+import signal
+import subprocess
+from asyncio.subprocess import Process
+from concurrent import futures
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+from obsidian_to_latex import build, cache, metrics, process_markdown
+
+# Conversion keeps its state in module globals, so unless given an executor
+# of their own, conversions run one at a time on a thread set aside for them
+EXECUTOR: Optional[futures.Executor] = None
+
+
+@dataclasses.dataclass
+class PreparedBuild:
+    out_pdf: Path
+    wrapper: Optional[Path] = None
+    diagrams: List[Path] = dataclasses.field(default_factory=list)
+    env: Optional[Dict[str, str]] = None
+    cache_key: Optional[str] = None
+
+
+def conversion_executor() -> futures.Executor:
+    global EXECUTOR  # pylint: disable=global-statement
+    if EXECUTOR is None:
+        EXECUTOR = futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="conversion"
+        )
+    return EXECUTOR
+
+
+async def run_subprocess(
+    cmd: Sequence,
+    cwd: Optional[Path] = None,
+    env: Optional[Dict[str, str]] = None,
+    check: bool = False,
+    shell: bool = False,
+) -> int:
+    """Run `cmd` without blocking the event loop and return its exit code.
+
+    Cancelling the call, for example when a build times out, kills the
+    process along with anything it started, such as the LaTeX runs of
+    latexmk.
+    """
+    args = [str(a) for a in cmd]
+    # A session of its own lets the whole process group be killed
+    new_session = os.name != "nt"
+    if shell:  # pragma: no cover
+        process = await asyncio.create_subprocess_shell(
+            subprocess.list2cmdline(args),
+            cwd=cwd,
+            env=env,
+            start_new_session=new_session,
+        )
+    else:
+        process = await asyncio.create_subprocess_exec(
+            *args, cwd=cwd, env=env, start_new_session=new_session
+        )
+    try:
+        returncode = await process.wait()
+    except asyncio.CancelledError:
+        _kill(process)
+        await process.wait()
+        raise
+    if check and returncode != 0:
+        raise subprocess.CalledProcessError(returncode, args)
+    return returncode
+
+
+@contextlib.asynccontextmanager
+async def locked(roots: List[Path]) -> AsyncIterator[None]:
+    """Share the locks on the cache directories in `roots` with other
+    builds, as `cache.locked` does, waiting for `obsidian_to_latex cache`
+    to finish without blocking the event loop."""
+    locks = cache.Locks(roots, shared=True)
+    while not locks.try_acquire():
+        await asyncio.sleep(cache.LOCK_POLL)
+    try:
+        yield
+    finally:
+        locks.release()
+
+
+def _kill(process: Process) -> None:
+    try:
+        if os.name == "nt":  # pragma: no cover
+            process.kill()
+        else:
+            os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:  # pragma: no cover
+        pass
+
+
+async def gather_all(coroutines: Sequence) -> List:
+    """Like `asyncio.gather`, except that when one fails the others are
+    cancelled and finish before its exception is raised."""
+    tasks = [asyncio.ensure_future(c) for c in coroutines]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+async def render_diagram(
+    mmd_file: Path, limit: Optional[asyncio.Semaphore] = None
+) -> Path:
+    async with limit or asyncio.Semaphore():
+        with metrics.timed("mmdc_seconds"):
+            await run_subprocess(
+                process_markdown.mmdc_command(mmd_file),
+                check=True,
+                # mmdc is a batch file on Windows
+                shell=os.name == "nt",
+            )
+    return mmd_file.with_suffix(".pdf")
+
+
+async def render_diagrams(diagrams: List[Path], jobs: int) -> List[Path]:
+    limit = asyncio.Semaphore(jobs)
+    return await gather_all([render_diagram(d, limit) for d in diagrams])
+
+
+async def compile_tex(
+    temp_wrapper: Path, draft: bool, env: Optional[Dict[str, str]] = None
+) -> Path:
+    if draft:
+        cmd = build.pdflatex_command(temp_wrapper)
+    else:
+        cmd = build.latexmk_command(temp_wrapper)
+    with metrics.timed("latex_seconds"):
+        await run_subprocess(cmd, cwd=temp_wrapper.parent, env=env)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, build.compiled_pdf, temp_wrapper)
+
+
+async def convert_document(
+    filename: Path,
+    options: build.BuildOptions,
+    text: Optional[str] = None,
+    timeout: Optional[float] = None,
+    executor: Optional[futures.Executor] = None,
+) -> str:
+    """Convert `filename` to TeX, rendering its diagrams, without blocking
+    the event loop.
+
+    Conversion runs on `executor`; pass a process pool to convert several
+    documents at once.  Once `timeout` seconds pass, the call is cancelled
+    and raises `asyncio.TimeoutError`; a conversion that has already
+    started runs to its end on the executor, but its diagrams are not
+    rendered.
+    """
+    executor = executor or conversion_executor()
+
+    async def convert() -> str:
+        loop = asyncio.get_running_loop()
+        roots = await loop.run_in_executor(
+            executor, _locked_dirs, filename, options
+        )
+        async with locked(roots):
+            latex, diagrams = await loop.run_in_executor(
+                executor, _convert, filename, options, text
+            )
+            await render_diagrams(diagrams, options.jobs)
+        return latex
+
+    return await asyncio.wait_for(convert(), timeout)
+
+
+async def build_pdf(
+    filename: Path,
+    options: build.BuildOptions,
+    timeout: Optional[float] = None,
+    executor: Optional[futures.Executor] = None,
+) -> Path:
+    """Build the PDF of `filename` as `build.build_pdf` does, without
+    blocking the event loop.
+
+    `mmdc` and LaTeX run as asyncio subprocesses, which are killed when
+    the build is cancelled or takes longer than `timeout` seconds.
+    """
+    metrics.inc("builds_total")
+    try:
+        with metrics.timed("build_seconds"):
+            return await asyncio.wait_for(
+                _build_pdf(filename, options, executor), timeout
+            )
+    except Exception:
+        metrics.inc("failures_total")
+        raise
+
+
+async def _build_pdf(
+    filename: Path,
+    options: build.BuildOptions,
+    executor: Optional[futures.Executor],
+) -> Path:
+    loop = asyncio.get_running_loop()
+    executor = executor or conversion_executor()
+    roots = await loop.run_in_executor(
+        executor, _locked_dirs, filename, options
+    )
+    async with locked(roots):
+        prepared = await loop.run_in_executor(
+            executor, _prepare_build, filename, options
+        )
+        if prepared.wrapper is None:
+            return prepared.out_pdf
+        await render_diagrams(prepared.diagrams, options.jobs)
+        pdf = await compile_tex(prepared.wrapper, options.draft, prepared.env)
+        await loop.run_in_executor(None, _finish_build, options, prepared, pdf)
+    return prepared.out_pdf
+
+
+def _locked_dirs(filename: Path, options: build.BuildOptions) -> List[Path]:
+    build.use_vault(filename, options.ignore)
+    return build.locked_dirs(filename, options)
+
+
+def _convert(
+    filename: Path, options: build.BuildOptions, text: Optional[str]
+) -> Tuple[str, List[Path]]:
+    _title, latex = build.convert_file(
+        filename, options, text, defer_diagrams=True
+    )
+    return latex, _pending_diagrams()
+
+
+def _prepare_build(
+    filename: Path, options: build.BuildOptions
+) -> PreparedBuild:
+    """Everything up to rendering diagrams and running LaTeX: the parts
+    that use the conversion's globals."""
+    build.use_vault(filename, options.ignore)
+    out_pdf = build.output_pdf(filename, options)
+    key = None
+    if options.cache_dir is not None:
+        key = build.cache_key(filename, options)
+        if build.copy_cached_pdf(options.cache_dir, key, out_pdf):
+            return PreparedBuild(out_pdf)
+    env = build.build_env(filename, options)
+    title, latex = build.convert_file(filename, options, defer_diagrams=True)
+    wrapper = build.write_tex(
+        options.template,
+        options.draft,
+        build.build_dir(filename, options),
+        title,
+        latex,
+        process_markdown.STATE.converted_map,
+    )
+    return PreparedBuild(out_pdf, wrapper, _pending_diagrams(), env, key)
+
+
+def _finish_build(
+    options: build.BuildOptions, prepared: PreparedBuild, pdf: Path
+) -> None:
+    build.copy_atomic(pdf, prepared.out_pdf)
+    if prepared.cache_key is not None:
+        build.store_pdf(options.cache_dir, prepared.cache_key, pdf)
+    if options.job_id is not None and options.keep_builds is not None:
+        build.prune_builds(pdf.parent.parent, options.keep_builds)
+
+
+def _pending_diagrams() -> List[Path]:
+    return list(dict.fromkeys(process_markdown.STATE.pending_diagrams))
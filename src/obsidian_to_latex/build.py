@@ -0,0 +1,731 @@
+import dataclasses
+import functools
+import hashlib
+import importlib.metadata
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import pydantic
+from pydantic.dataclasses import dataclass
+
+from obsidian_to_latex import (
+    cache,
+    check,
+    chunked,
+    dependencies,
+    memory_profile,
+    metrics,
+    obsidian_path,
+    prefetch,
+    process_markdown,
+    scheduler,
+    section,
+    source_map,
+    storage,
+)
+
+
+@dataclass
+class BuildOptions:
+    # pylint: disable=too-many-instance-attributes
+    template: Optional[Path] = None
+    prefetch_workers: int = 8
+    external_code_lines: Optional[int] = None
+    build_root: Optional[Path] = None
+    scratch_dir: Optional[Path] = None
+    job_id: Optional[str] = None
+    keep_builds: Optional[int] = None
+    line_time_budget: Optional[float] = 1.0
+    cache_dir: Optional[Path] = None
+    ignore: List[str] = dataclasses.field(default_factory=list)
+    jobs: int = os.cpu_count() or 1
+    dedupe_embeds: bool = False
+    draft: bool = False
+    section: Optional[str] = None
+    lines: Optional[str] = None
+    max_embed_depth: Optional[int] = 32
+    max_lines: Optional[int] = 1_000_000
+    max_output_size: Optional[int] = 100_000_000
+    parallel_lines: Optional[int] = 20_000
+    source_date_epoch: Optional[int] = None
+
+
+class LatexError(Exception):
+    """LaTeX failed; the message lists its errors, pointing at the notes
+    and lines they came from."""
+
+
+DEFAULT_TEMPLATE = Path(__file__).parent / "document.tex"
+BODY = "body.tex"
+SOURCE_MAP = "body.map.json"
+# 1980-01-01, the earliest time zip files can hold, for notes no commit
+# dates
+DEFAULT_SOURCE_DATE_EPOCH = 315532800
+# pdfTeX derives the trailer ID of a PDF from where it is written
+EMPTY_TRAILER_ID = R"\ifdefined\pdftrailerid\pdftrailerid{}\fi" "\n"
+# Directories kept alongside the job directories of a document, for all
+# of its jobs
+SHARED_DIRS = {"fragments", "assets"}
+# Options that change where or how quickly a document builds, but not the
+# PDF it produces.  The template is keyed by its content instead.
+UNCACHED_OPTIONS = {
+    "template",
+    "prefetch_workers",
+    "build_root",
+    "scratch_dir",
+    "job_id",
+    "keep_builds",
+    "line_time_budget",
+    "cache_dir",
+    "jobs",
+    "max_embed_depth",
+    "max_lines",
+    "max_output_size",
+    "parallel_lines",
+}
+
+
+@pydantic.validate_arguments
+def document_name(filename: Path, options: BuildOptions) -> str:
+    """The name of the PDF, which tells a section or lines apart from the
+    whole note."""
+    if options.section is not None:
+        part = options.section
+    elif options.lines is not None:
+        part = f"lines {options.lines.replace(':', '-')}"
+    else:
+        return filename.stem
+    return f"{filename.stem} - " + re.sub(r'[\\/:*?"<>|]', "_", part)
+
+
+@pydantic.validate_arguments
+def documents_dir(filename: Path, options: BuildOptions) -> Path:
+    """The directory holding the build directory of each document."""
+    return (
+        options.scratch_dir
+        or options.build_root
+        or obsidian_path.storage_for(filename).local_dir(filename) / "temp"
+    )
+
+
+@pydantic.validate_arguments
+def build_dir(filename: Path, options: BuildOptions) -> Path:
+    root = documents_dir(filename, options)
+    key = obsidian_path.format_path(filename.resolve())
+    name = document_name(filename, options)
+    if name != filename.stem:
+        key = f"{key}#{name}"
+    digest = hashlib.sha1(key.encode("UTF-8")).hexdigest()
+    stem = re.sub(r"[^a-zA-Z0-9_-]", "_", name)
+    document_dir = root / f"{stem}-{digest[:8]}"
+    if options.job_id is None:
+        return document_dir
+    return document_dir / re.sub(r"[^a-zA-Z0-9_.-]", "_", options.job_id)
+
+
+@pydantic.validate_arguments
+def asset_dir(filename: Path, options: BuildOptions) -> Optional[Path]:
+    """Where reusable artifacts such as diagrams go when the build itself
+    runs in a scratch directory."""
+    if options.scratch_dir is None:
+        return None
+    persistent = dataclasses.replace(options, scratch_dir=None)
+    return build_dir(filename, persistent) / "assets"
+
+
+@pydantic.validate_arguments
+def fragment_dir(filename: Path, options: BuildOptions) -> Path:
+    """Where converted embedded notes are kept between builds: with the
+    shared cache when there is one, otherwise alongside every job of the
+    document."""
+    if options.cache_dir is not None:
+        return options.cache_dir / "fragments"
+    persistent = dataclasses.replace(options, scratch_dir=None, job_id=None)
+    return build_dir(filename, persistent) / "fragments"
+
+
+@pydantic.validate_arguments
+def cache_roots(filename: Path, options: BuildOptions) -> List[Path]:
+    """The directories `obsidian_to_latex cache` manages that building
+    `filename` uses."""
+    persistent = dataclasses.replace(options, scratch_dir=None)
+    roots = {
+        documents_dir(filename, options),
+        documents_dir(filename, persistent),
+    }
+    if options.cache_dir is not None:
+        roots.add(options.cache_dir)
+    return sorted(roots)
+
+
+@pydantic.validate_arguments
+def locked_dirs(filename: Path, options: BuildOptions) -> List[Path]:
+    """The directories a build of `filename` holds shared locks on: the
+    cache directories it uses and its own job directory, which
+    `prune_builds` leaves alone while the build runs."""
+    roots = cache_roots(filename, options)
+    if options.job_id is not None:
+        roots.append(build_dir(filename, options))
+    return roots
+
+
+def ram_dir() -> Path:
+    shm = Path("/dev/shm")
+    if shm.is_dir() and os.access(shm, os.W_OK):
+        return shm / "obsidian_to_latex"
+    return Path(tempfile.gettempdir()) / "obsidian_to_latex"
+
+
+@pydantic.validate_arguments
+def prune_builds(document_dir: Path, keep: int) -> List[Path]:
+    """Remove all but the `keep` most recently modified job directories,
+    apart from those of builds still running."""
+    if not document_dir.is_dir():
+        return []
+    jobs = [
+        d
+        for d in document_dir.iterdir()
+        if d.is_dir() and d.name not in SHARED_DIRS
+    ]
+    jobs.sort(key=lambda d: d.stat().st_mtime, reverse=True)
+    removed = []
+    for job in jobs[keep:]:
+        lock = cache.Locks([job], shared=False)
+        if not lock.try_acquire():
+            continue
+        try:
+            shutil.rmtree(job, ignore_errors=True)
+        finally:
+            lock.release()
+        removed.append(job)
+    return removed
+
+
+@pydantic.validate_arguments
+def cache_key(filename: Path, options: BuildOptions) -> str:
+    """Hash everything that goes into the PDF of `filename`: the notes and
+    images it embeds, the template, the options, the date written into it
+    and this tool itself."""
+    found = dependencies.embedded_files(filename)
+    inputs = {
+        "tool": tool_fingerprint(),
+        "source_date_epoch": source_date_epoch(filename, options),
+        "template": file_digest(options.template or DEFAULT_TEMPLATE),
+        "options": {
+            f.name: getattr(options, f.name)
+            for f in dataclasses.fields(options)
+            if f.name not in UNCACHED_OPTIONS
+        },
+        "files": [[vault_path(f), file_digest(f)] for f in found.files],
+        "missing": found.missing,
+    }
+    encoded = json.dumps(inputs, sort_keys=True).encode("UTF-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def vault_path(path: Path) -> str:
+    root = obsidian_path.current_root()
+    if root is not None and root in path.parents:
+        path = path.relative_to(root)
+    return obsidian_path.format_path(path)
+
+
+def file_digest(path: Path) -> str:
+    return hashlib.sha256(obsidian_path.read_bytes(path)).hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def tool_fingerprint() -> str:
+    try:
+        version = importlib.metadata.version("obsidian_to_latex")
+    except importlib.metadata.PackageNotFoundError:  # pragma: no cover
+        version = "unknown"
+    package = Path(__file__).parent
+    sources = sorted([*package.glob("*.py"), *package.glob("*.tex")])
+    digests = [f"{p.name}:{file_digest(p)}" for p in sources]
+    return hashlib.sha256(
+        "\n".join([version, *digests]).encode("UTF-8")
+    ).hexdigest()
+
+
+@pydantic.validate_arguments
+def source_date_epoch(filename: Path, options: BuildOptions) -> int:
+    """The time stamp LaTeX writes into the PDF: `source_date_epoch` when
+    given, otherwise that of the last commit to the note or anything it
+    embeds, so every checkout of the same notes gives the same bytes."""
+    if options.source_date_epoch is not None:
+        return options.source_date_epoch
+    found = dependencies.embedded_files(filename)
+    committed = last_commit_time(found.files)
+    return DEFAULT_SOURCE_DATE_EPOCH if committed is None else committed
+
+
+def last_commit_time(files: List[Path]) -> Optional[int]:
+    """When the last git commit to any of `files` was made, or None if
+    they are not in a git checkout or have never been committed."""
+    on_disk = [f for f in files if obsidian_path.storage_for(f).on_disk]
+    if not on_disk:
+        return None
+    try:
+        result = subprocess.run(
+            ["git", "log", "-1", "--format=%ct", "--", *on_disk],
+            cwd=on_disk[0].parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    output = result.stdout.strip()
+    return int(output) if output else None
+
+
+def latex_env(epoch: int, force: bool = False) -> Dict[str, str]:
+    """The environment LaTeX runs in, dating the PDF at `epoch`.  With
+    `force`, `\\today` and the title date are the epoch too; otherwise
+    they stay the date of the build."""
+    env = {**os.environ, "SOURCE_DATE_EPOCH": str(epoch)}
+    env.pop("FORCE_SOURCE_DATE", None)
+    if force:
+        env["FORCE_SOURCE_DATE"] = "1"
+    return env
+
+
+@pydantic.validate_arguments
+def build_env(filename: Path, options: BuildOptions) -> Dict[str, str]:
+    """The environment LaTeX builds `filename` in, which dates the pages
+    only when `source_date_epoch` is given."""
+    return latex_env(
+        source_date_epoch(filename, options),
+        force=options.source_date_epoch is not None,
+    )
+
+
+def first_difference(first: bytes, second: bytes) -> Optional[int]:
+    """The offset of the first byte that differs, or None if both match."""
+    for i, (a, b) in enumerate(zip(first, second)):
+        if a != b:
+            return i
+    if len(first) != len(second):
+        return min(len(first), len(second))
+    return None
+
+
+def use_vault(filename: Path, ignore: List[str]) -> obsidian_path.Vault:
+    """Make the vault holding `filename` the one conversion looks files up
+    in, reusing it and its index if it is already open.
+
+    Vaults not on disk, such as those in memory, are used once opened with
+    `obsidian_path.VAULTS.open(root, store=...)` and for as long as they
+    stay open.
+    """
+    root = obsidian_path.VAULTS.root_of(filename) or get_vault_root(filename)
+    vault = obsidian_path.VAULTS.open(root, ignore)
+    obsidian_path.VAULT = vault
+    return vault
+
+
+@pydantic.validate_arguments
+def convert_file(
+    filename: Path,
+    options: BuildOptions,
+    text: Optional[str] = None,
+    defer_diagrams: bool = False,
+) -> Tuple[str, str]:
+    """Convert `filename` to TeX.
+
+    With `defer_diagrams`, changed mermaid diagrams are left in
+    `process_markdown.STATE.pending_diagrams` for the caller to render.
+    """
+    use_vault(filename, options.ignore)
+    with cache.locked(locked_dirs(filename, options), shared=True):
+        return _convert_file(filename, options, text, defer_diagrams)
+
+
+def _convert_file(
+    filename: Path,
+    options: BuildOptions,
+    text: Optional[str],
+    defer_diagrams: bool,
+) -> Tuple[str, str]:
+    if text is None:
+        text = obsidian_path.read_text(filename)
+    text = section.select(text, options.section, options.lines)
+    temp_dir = build_dir(filename, options)
+    temp_dir.mkdir(parents=True, exist_ok=True)
+
+    process_markdown.STATE = process_markdown.State.new()
+    process_markdown.STATE.file.append(filename)
+    process_markdown.STATE.temp_dir = temp_dir
+    process_markdown.STATE.asset_dir = asset_dir(filename, options)
+    process_markdown.STATE.code_external_threshold = (
+        options.external_code_lines
+    )
+    process_markdown.STATE.line_time_budget = options.line_time_budget
+    if defer_diagrams:
+        process_markdown.STATE.pending_diagrams = []
+    if options.dedupe_embeds:
+        process_markdown.STATE.embedded = set()
+    process_markdown.STATE.draft = options.draft
+    process_markdown.STATE.max_embed_depth = options.max_embed_depth
+    process_markdown.STATE.max_lines = options.max_lines
+    process_markdown.STATE.max_output_size = options.max_output_size
+    process_markdown.STATE.fragment_dir = fragment_dir(filename, options)
+    process_markdown.STATE.converter_version = tool_fingerprint()
+    process_markdown.STATE.source_map = []
+    with memory_profile.stage("convert"), metrics.timed(
+        "conversion_seconds"
+    ), prefetch.enabled(max_workers=options.prefetch_workers):
+        latex = chunked.convert(text, options.jobs, options.parallel_lines)
+        memory_profile.record_sites(process_markdown.__file__)
+    return get_title(text), latex
+
+
+@pydantic.validate_arguments
+def build_pdf(
+    filename: Path, options: BuildOptions, out_pdf: Optional[Path] = None
+) -> Path:
+    """Build `filename` into `out_pdf`, by default `output/<name>.pdf` next
+    to it, and return where the PDF went."""
+    metrics.inc("builds_total")
+    try:
+        use_vault(filename, options.ignore)
+        with metrics.timed("build_seconds"), cache.locked(
+            locked_dirs(filename, options), shared=True
+        ):
+            return _build_pdf(filename, options, out_pdf)
+    except Exception:
+        metrics.inc("failures_total")
+        raise
+
+
+def _build_pdf(
+    filename: Path, options: BuildOptions, out_pdf: Optional[Path] = None
+) -> Path:
+    use_vault(filename, options.ignore)
+    if out_pdf is None:
+        out_pdf = output_pdf(filename, options)
+    key = None
+    if options.cache_dir is not None:
+        key = cache_key(filename, options)
+        if copy_cached_pdf(options.cache_dir, key, out_pdf):
+            return out_pdf
+
+    temp_dir = build_dir(filename, options)
+    graph = scheduler.TaskGraph()
+    env = build_env(filename, options)
+
+    def convert(_root: Path, text: str) -> Tuple[str, str]:
+        converted = convert_file(filename, options, text, defer_diagrams=True)
+        sources = process_markdown.STATE.converted_map
+        # Everything after conversion depends on the diagrams it found
+        pending = process_markdown.STATE.pending_diagrams
+        diagrams = [
+            graph.add(
+                f"render {d.name}",
+                lambda _converted, d=d: process_markdown.render_diagram(d),
+                ["convert"],
+            )
+            for d in dict.fromkeys(pending)
+        ]
+        graph.add(
+            "write tex",
+            lambda c: write_tex(
+                options.template, options.draft, temp_dir, *c, sources
+            ),
+            ["convert"],
+        )
+        graph.add(
+            "compile",
+            lambda wrapper, *_diagrams: compile_tex(
+                wrapper, options.draft, env
+            ),
+            ["write tex", *diagrams],
+        )
+        graph.add(
+            "copy output", lambda pdf: copy_atomic(pdf, out_pdf), ["compile"]
+        )
+        if key is not None:
+            graph.add(
+                "store in cache",
+                lambda pdf: store_pdf(options.cache_dir, key, pdf),
+                ["compile"],
+            )
+        return converted
+
+    graph.add("index vault", lambda: index_vault(filename, options))
+    graph.add("read note", lambda: obsidian_path.read_text(filename))
+    graph.add("convert", convert, ["index vault", "read note"])
+    graph.run(options.jobs)
+    logging.getLogger(__name__).info(graph.report())
+
+    if options.job_id is not None and options.keep_builds is not None:
+        prune_builds(temp_dir.parent, options.keep_builds)
+    return out_pdf
+
+
+def output_pdf(filename: Path, options: BuildOptions) -> Path:
+    out_dir = (
+        obsidian_path.storage_for(filename).local_dir(filename) / "output"
+    )
+    out_dir.mkdir(parents=True, exist_ok=True)
+    return out_dir / f"{document_name(filename, options)}.pdf"
+
+
+def copy_cached_pdf(cache_dir: Path, key: str, out_pdf: Path) -> bool:
+    """Copy the PDF cached under `key` to `out_pdf`, if there is one."""
+    cached_pdf = cache.ContentCache(cache_dir).get(key, "document.pdf")
+    if cached_pdf is None:
+        metrics.inc("pdf_cache_misses_total")
+        return False
+    metrics.inc("pdf_cache_hits_total")
+    logging.getLogger(__name__).info("Using cached `%s`", cached_pdf)
+    copy_atomic(cached_pdf, out_pdf)
+    return True
+
+
+def store_pdf(cache_dir: Path, key: str, pdf: Path) -> Path:
+    return cache.ContentCache(cache_dir).put(
+        key, {"document.pdf": pdf, BODY: pdf.parent / BODY}
+    )
+
+
+@pydantic.validate_arguments
+def verify_reproducible(
+    filename: Path, options: BuildOptions
+) -> Optional[str]:
+    """Build `filename` twice from scratch, without any cache, and describe
+    how the PDFs differ, if they do."""
+    options = dataclasses.replace(
+        options, scratch_dir=None, job_id=None, cache_dir=None
+    )
+
+    def build_once() -> bytes:
+        with tempfile.TemporaryDirectory(prefix="verify-") as root:
+            scratch = dataclasses.replace(options, build_root=Path(root))
+            return build_pdf(filename, scratch).read_bytes()
+
+    first = build_once()
+    second = build_once()
+    offset = first_difference(first, second)
+    if offset is None:
+        return None
+    name = document_name(filename, options)
+    return (
+        f"`{name}.pdf` differs between builds from byte {offset}"
+        f" ({len(first)} and {len(second)} bytes)"
+    )
+
+
+@pydantic.validate_arguments
+def check_links(filename: Path, options: BuildOptions) -> List[check.Problem]:
+    """Every embed and link in the document that does not name exactly one
+    file, found without converting anything."""
+    vault = use_vault(filename, options.ignore)
+    scan = vault.scan()
+    return check.check_document(filename.resolve(), vault.root, scan.paths)
+
+
+def index_vault(filename: Path, options: BuildOptions) -> Path:
+    vault = use_vault(filename, options.ignore)
+    vault.index()
+    return vault.root
+
+
+def write_tex(  # pylint: disable=too-many-arguments
+    template: Optional[Path],
+    draft: bool,
+    temp_dir: Path,
+    title: str,
+    latex: str,
+    sources: Optional[List[source_map.Source]] = None,
+) -> Path:
+    """Write the TeX of the document and its source map.  An unchanged body
+    is left alone, so LaTeX tools see that it has not changed."""
+    body = temp_dir / BODY
+    try:
+        old = body.read_text(encoding="UTF-8")
+    except FileNotFoundError:
+        old = None
+    if sources is not None:
+        source_map.write(
+            temp_dir / SOURCE_MAP, sources, obsidian_path.current_root()
+        )
+    if old != latex:
+        with open(body, "w", encoding="UTF-8") as f:
+            f.write(latex)
+        if old is not None:
+            log_changed_region(old, latex, temp_dir)
+    return write_wrapper(template, temp_dir, title, draft)
+
+
+def log_changed_region(old: str, new: str, temp_dir: Path) -> None:
+    first, last = source_map.changed_region(old, new)
+    encoded = source_map.load(temp_dir / SOURCE_MAP)
+    where = ""
+    if encoded is not None:
+        start = source_map.lookup(encoded, first)
+        end = source_map.lookup(encoded, last)
+        if start is not None and end is not None:
+            where = f", from {start[0]}:{start[1]} to {end[0]}:{end[1]}"
+    logging.getLogger(__name__).info(
+        "Changed %s lines %s-%s%s", BODY, first, last, where
+    )
+
+
+def compile_tex(
+    temp_wrapper: Path, draft: bool, env: Optional[Dict[str, str]] = None
+) -> Path:
+    with memory_profile.stage("latex"), metrics.timed("latex_seconds"):
+        if draft:
+            run_pdflatex(temp_wrapper, env)
+        else:
+            run_latexmk(temp_wrapper, env)
+    return compiled_pdf(temp_wrapper)
+
+
+def compiled_pdf(temp_wrapper: Path) -> Path:
+    """The PDF LaTeX made of `temp_wrapper`, raising `LatexError` with the
+    errors it logged instead."""
+    errors = latex_errors(temp_wrapper)
+    if errors:
+        raise LatexError("\n".join(errors))
+    temp_pdf = temp_wrapper.with_suffix(".pdf")
+    if not temp_pdf.exists():
+        msg = f"Failed to create PDF: `{temp_pdf}`"
+        logging.getLogger(__name__).error(msg)
+        raise FileNotFoundError(msg)
+    return temp_pdf
+
+
+def latex_errors(temp_wrapper: Path) -> List[str]:
+    """The errors in the log of the last LaTeX run, with those in the body
+    pointing at the notes and lines they came from."""
+    try:
+        log = temp_wrapper.with_suffix(".log").read_text(
+            encoding="UTF-8", errors="replace"
+        )
+    except FileNotFoundError:
+        return []
+    encoded = source_map.load(temp_wrapper.parent / SOURCE_MAP)
+    if encoded is None:
+        encoded = source_map.encode([])
+    return source_map.translate_errors(log, encoded, BODY)
+
+
+def copy_atomic(source: Path, destination: Path) -> None:
+    """Copy so that concurrent readers never see a partially written file."""
+    fd, partial = tempfile.mkstemp(
+        dir=destination.parent, prefix=f".{destination.name}.", suffix=".part"
+    )
+    os.close(fd)
+    try:
+        shutil.copyfile(source, partial)
+        os.replace(partial, destination)
+    except BaseException:
+        os.unlink(partial)
+        raise
+
+
+def latexmk_command(temp_wrapper: Path) -> List:
+    return [
+        "latexmk",
+        "-pdf",
+        "-g",
+        '-latexoption="-shell-escape -file-line-error -halt-on-error"',
+        temp_wrapper,
+    ]
+
+
+def pdflatex_command(temp_wrapper: Path) -> List:
+    """A single pass, for previews that can do without up to date
+    references and contents."""
+    return [
+        "pdflatex",
+        "-shell-escape",
+        "-interaction=nonstopmode",
+        "-file-line-error",
+        "-halt-on-error",
+        temp_wrapper.name,
+    ]
+
+
+def run_latexmk(
+    temp_wrapper: Path, env: Optional[Dict[str, str]] = None
+) -> None:  # pragma: no cover
+    subprocess.run(
+        latexmk_command(temp_wrapper),
+        check=False,
+        capture_output=False,
+        cwd=temp_wrapper.parent,
+        env=env,
+    )
+
+
+def run_pdflatex(
+    temp_wrapper: Path, env: Optional[Dict[str, str]] = None
+) -> None:  # pragma: no cover
+    subprocess.run(
+        pdflatex_command(temp_wrapper),
+        check=False,
+        capture_output=False,
+        cwd=temp_wrapper.parent,
+        env=env,
+    )
+
+
+def write_wrapper(
+    template: Optional[Path], temp_dir: Path, title: str, draft: bool = False
+) -> Path:
+    latex_wrapper = template if template else DEFAULT_TEMPLATE
+    temp_wrapper = temp_dir / latex_wrapper.name
+
+    with open(latex_wrapper, "r", encoding="UTF-8") as f:
+        wrapper_text = f.read()
+    wrapper_text = wrapper_text.replace("TheTitleOfTheDocument", title)
+    if draft:
+        wrapper_text = add_class_option(wrapper_text, "draft")
+    wrapper_text = EMPTY_TRAILER_ID + wrapper_text
+
+    with open(temp_wrapper, "w", encoding="UTF-8") as f:
+        f.write(wrapper_text)
+    return temp_wrapper
+
+
+def add_class_option(wrapper_text: str, option: str) -> str:
+    def add(m: re.Match) -> str:
+        options = [o for o in (m.group(1) or "").split(",") if o.strip()]
+        return f"\\documentclass[{','.join([*options, option])}]{{"
+
+    return re.sub(
+        r"\\documentclass(?:\[([^\]]*)\])?\{", add, wrapper_text, count=1
+    )
+
+
+def get_vault_root(path: Path) -> Path:
+    if storage.is_archive(path):
+        return path
+    if (path / ".obsidian").exists():
+        return path
+    if (path / ".git").exists():
+        logging.getLogger(__name__).info("Using .git for locating vault root")
+        return path
+    if path.parent == path:
+        raise FileNotFoundError("Unable to locate `.obsidian` folder")
+    return get_vault_root(path.parent)
+
+
+def get_title(text: str) -> str:
+    line = text.splitlines()[0]
+    m = re.match(r"(^#*)\s*(.*)", line)
+    if not m:  # pragma: no cover
+        return None
+    title = m.group(2)
+    return title
@@ -0,0 +1,353 @@
+import contextlib
+import dataclasses
+import os
+import re
+import shutil
+import stat
+import tempfile
+import time
+from pathlib import Path
+from typing import IO, Dict, Iterator, List, Optional, Tuple
+
+if os.name != "nt":  # pragma: no branch
+    import fcntl
+
+
+class ContentCache:
+    """Build outputs stored by the hash of their inputs.
+
+    Entries are directories under `root/<2 hex digits>/<rest of key>`. An
+    entry is written to a temporary directory next to its final location
+    and renamed into place, so a cache shared between machines, for example
+    on NFS, never exposes a partial entry and the first writer wins.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+
+    def entry(self, key: str) -> Path:
+        return self.root / key[:2] / key[2:]
+
+    def get(self, key: str, name: str) -> Optional[Path]:
+        path = self.entry(key) / name
+        if not path.is_file():
+            return None
+        # Mark the entry as recently used
+        os.utime(self.entry(key))
+        return path
+
+    def put(self, key: str, files: Dict[str, Path]) -> Path:
+        entry = self.entry(key)
+        if entry.exists():
+            return entry
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        partial = Path(tempfile.mkdtemp(dir=entry.parent, prefix=".partial-"))
+        try:
+            for name, source in files.items():
+                shutil.copyfile(source, partial / name)
+            os.rename(partial, entry)
+        except OSError:
+            shutil.rmtree(partial, ignore_errors=True)
+            if not entry.exists():
+                raise
+        return entry
+
+
+@dataclasses.dataclass
+class Entry:
+    """Something `gc` can remove on its own: a cached PDF, a converted
+    fragment, an asset such as a rendered diagram, or what LaTeX left in a
+    build directory.  Its files were last used at `used`."""
+
+    kind: str
+    paths: List[Path]
+    size: int
+    used: float
+
+    def remove(self) -> None:
+        for path in self.paths:
+            if path.is_dir():
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                path.unlink(missing_ok=True)
+
+
+KINDS = ["pdf", "fragment", "diagram", "listing", "image", "build", "partial"]
+LOCK_NAME = ".lock"
+# Seconds between attempts to take a lock that is held
+LOCK_POLL = 0.1
+SHARD = re.compile(r"^[0-9a-f]{2}$")
+DOCUMENT_DIR = re.compile(r"^.+-[0-9a-f]{8}$")
+ASSET = re.compile(r"^(diagram|listing|image)_[0-9a-f]{16}")
+SIZE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([kmgt]?)i?b?\s*$", re.IGNORECASE)
+DURATION = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([smhdw]?)\s*$", re.IGNORECASE)
+SIZE_UNITS = {"": 1, "k": 2**10, "m": 2**20, "g": 2**30, "t": 2**40}
+DURATION_UNITS = {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+
+def scan(root: Path) -> List[Entry]:
+    """The entries in a cache directory, `--cache-dir`, or in a directory of
+    document build directories, such as `temp` next to notes.
+
+    Builds may add and remove files while it looks, so what is gone by the
+    time it gets to it is left out.
+    """
+    entries: List[Entry] = []
+    for child in _children(root):
+        if not child.is_dir():
+            continue
+        if child.name == "fragments":
+            entries.extend(_scan_fragments(child))
+        elif SHARD.match(child.name):
+            for entry in _children(child):
+                kind = "partial" if _is_partial(entry) else "pdf"
+                entries.append(_entry(kind, [entry]))
+        elif DOCUMENT_DIR.match(child.name):
+            entries.extend(_scan_document(child))
+    return entries
+
+
+def collect(
+    entries: List[Entry],
+    max_size: Optional[int] = None,
+    max_age: Optional[float] = None,
+    now: Optional[float] = None,
+) -> List[Entry]:
+    """The entries to remove: partial writes, those last used more than
+    `max_age` seconds ago, and then the least recently used until the rest
+    fit in `max_size` bytes."""
+    now = time.time() if now is None else now
+    removed = []
+    kept = []
+    for entry in sorted(entries, key=lambda e: e.used):
+        if entry.kind == "partial" or (
+            max_age is not None and now - entry.used > max_age
+        ):
+            removed.append(entry)
+        else:
+            kept.append(entry)
+    if max_size is not None:
+        size = sum(e.size for e in kept)
+        while kept and size > max_size:
+            entry = kept.pop(0)
+            size -= entry.size
+            removed.append(entry)
+    return removed
+
+
+def stats(entries: List[Entry]) -> Dict[str, Tuple[int, int, float]]:
+    """The number, total size and oldest use of the entries of each kind."""
+    summary = {}
+    for kind in KINDS:
+        of_kind = [e for e in entries if e.kind == kind]
+        if of_kind:
+            summary[kind] = (
+                len(of_kind),
+                sum(e.size for e in of_kind),
+                min(e.used for e in of_kind),
+            )
+    return summary
+
+
+def gc(
+    roots: List[Path],
+    max_size: Optional[int] = None,
+    max_age: Optional[float] = None,
+    dry_run: bool = False,
+    timeout: Optional[float] = None,
+) -> List[Entry]:
+    """Evict entries from all of `roots` together, as `collect` picks them,
+    once no build is using them."""
+    with locked(roots, shared=False, timeout=timeout):
+        entries = [e for root in roots for e in scan(root)]
+        removed = collect(entries, max_size, max_age)
+        if not dry_run:
+            _remove(roots, removed)
+    return removed
+
+
+def clear(roots: List[Path], timeout: Optional[float] = None) -> List[Entry]:
+    with locked(roots, shared=False, timeout=timeout):
+        removed = [e for root in roots for e in scan(root)]
+        _remove(roots, removed)
+    return removed
+
+
+class Locks:
+    """Advisory locks on cache directories, one `.lock` file in each.
+
+    Builds share the locks of the directories they use, and `gc` and
+    `clear` take them exclusively, so nothing is removed from under a
+    running build.  Locks are taken without blocking, all or none, and
+    always in the same order.  On Windows they are not taken at all.
+    """
+
+    def __init__(self, roots: List[Path], shared: bool):
+        self.roots = sorted(set(roots))
+        self.shared = shared
+        self._files: List[IO] = []
+
+    def try_acquire(self) -> bool:
+        if os.name == "nt":  # pragma: no cover
+            return True
+        # pylint: disable=possibly-used-before-assignment
+        mode = fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX
+        for root in self.roots:
+            root.mkdir(parents=True, exist_ok=True)
+            # pylint: disable=consider-using-with
+            f = open(root / LOCK_NAME, "a+b")
+            try:
+                fcntl.flock(f, mode | fcntl.LOCK_NB)
+            except BlockingIOError:
+                f.close()
+                self.release()
+                return False
+            self._files.append(f)
+        return True
+
+    def release(self) -> None:
+        for f in self._files:
+            fcntl.flock(f, fcntl.LOCK_UN)
+            f.close()
+        self._files = []
+
+
+@contextlib.contextmanager
+def locked(
+    roots: List[Path], shared: bool, timeout: Optional[float] = None
+) -> Iterator[None]:
+    """Hold the locks on `roots`, waiting up to `timeout` seconds, or for as
+    long as it takes, for them to be free."""
+    locks = Locks(roots, shared)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while not locks.try_acquire():
+        if deadline is not None and time.monotonic() >= deadline:
+            names = ", ".join(f"`{r}`" for r in locks.roots)
+            raise TimeoutError(f"Timed out waiting for builds using {names}")
+        time.sleep(LOCK_POLL)
+    try:
+        yield
+    finally:
+        locks.release()
+
+
+def parse_size(text: str) -> int:
+    """Bytes from sizes such as `500M`, `2G` or `1.5GiB`."""
+    m = SIZE.match(text)
+    if not m:
+        raise ValueError(f"Invalid size `{text}`")
+    return int(float(m.group(1)) * SIZE_UNITS[m.group(2).lower()])
+
+
+def format_size(size: float) -> str:
+    """Sizes such as `512 B` or `1.5 GiB`, the reverse of `parse_size`."""
+    if size < 1024:
+        return f"{size:.0f} B"
+    for unit in ["KiB", "MiB", "GiB"]:
+        size /= 1024
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+    return f"{size / 1024:.1f} TiB"
+
+
+def parse_duration(text: str) -> float:
+    """Seconds from durations such as `90`, `12h` or `30d`."""
+    m = DURATION.match(text)
+    if not m:
+        raise ValueError(f"Invalid duration `{text}`")
+    return float(m.group(1)) * DURATION_UNITS[m.group(2).lower()]
+
+
+def _scan_fragments(fragment_dir: Path) -> List[Entry]:
+    entries = []
+    for shard in _children(fragment_dir):
+        if shard.is_dir():
+            for fragment in _children(shard):
+                kind = "partial" if _is_partial(fragment) else "fragment"
+                entries.append(_entry(kind, [fragment]))
+    return entries
+
+
+def _scan_document(document_dir: Path) -> List[Entry]:
+    """A document's assets and fragments are entries of their own, as are
+    the build directories of its jobs; everything else is its build."""
+    entries = []
+    assets: Dict[Tuple[str, str], List[Path]] = {}
+    build = []
+    for path in _children(document_dir):
+        if path.name == LOCK_NAME:
+            continue
+        if path.is_dir() and path.name == "fragments":
+            entries.extend(_scan_fragments(path))
+        elif path.is_dir() and path.name == "assets":
+            for asset in _children(path):
+                if not _add_asset(assets, asset):
+                    build.append(asset)
+        elif path.is_dir() and (path / "body.tex").exists():
+            entries.extend(_scan_document(path))
+        elif not _add_asset(assets, path):
+            build.append(path)
+    for (kind, _stem), paths in assets.items():
+        entries.append(_entry(kind, paths))
+    if build:
+        entries.append(_entry("build", build))
+    return entries
+
+
+def _add_asset(assets: Dict[Tuple[str, str], List[Path]], path: Path) -> bool:
+    m = ASSET.match(path.name)
+    if m is None or not path.is_file():
+        return False
+    # A diagram's source and its rendering come and go together
+    assets.setdefault((m.group(1), str(path.with_suffix(""))), []).append(path)
+    return True
+
+
+def _remove(roots: List[Path], entries: List[Entry]) -> None:
+    for entry in entries:
+        entry.remove()
+    for root in roots:
+        _remove_empty_dirs(root)
+
+
+def _remove_empty_dirs(root: Path) -> None:
+    """Remove the directories under `root` that removing entries left
+    empty."""
+    for path in sorted(root.rglob("*"), reverse=True):
+        if path.is_dir() and not any(path.iterdir()):
+            path.rmdir()
+
+
+def _entry(kind: str, paths: List[Path]) -> Entry:
+    size = 0
+    used = 0.0
+    for path in paths:
+        for file in _walk(path):
+            try:
+                info = file.stat()
+            except FileNotFoundError:
+                continue
+            used = max(used, info.st_mtime)
+            if not stat.S_ISDIR(info.st_mode):
+                size += info.st_size
+    return Entry(kind, paths, size, used)
+
+
+def _walk(path: Path) -> Iterator[Path]:
+    """`path` and, for a directory, everything under it, skipping
+    directories removed while walking."""
+    yield path
+    for parent, dirs, files in os.walk(path):
+        for name in [*dirs, *files]:
+            yield Path(parent) / name
+
+
+def _children(path: Path) -> List[Path]:
+    try:
+        return sorted(path.iterdir())
+    except (FileNotFoundError, NotADirectoryError):
+        return []
+
+
+def _is_partial(path: Path) -> bool:
+    return path.name.startswith(".partial-") or path.name.endswith(".part")
@@ -0,0 +1,89 @@
+import re
+from collections import deque
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
+from pydantic.dataclasses import dataclass
+
+from obsidian_to_latex import obsidian_path, process_markdown
+
+DOCUMENT_LINK = re.compile(r"(?<!!)\[\[([a-zA-Z0-9-_\s]+)(?:\|[^\]]*)?\]\]")
+INLINE_CODE = re.compile(r"`[^`]*`")
+
+
+@dataclass
+class Problem:
+    file: str
+    line: int
+    target: str
+    message: str
+
+    def __str__(self) -> str:
+        return f"{self.file}:{self.line}: `{self.target}` {self.message}"
+
+
+def targets(text: str) -> Iterator[Tuple[int, str, bool]]:
+    """Yield the line number, file name and whether it is embedded for every
+    embed and `[[link]]` the converter would look up."""
+    in_code = False
+    for lineno, line in enumerate(text.splitlines(), start=1):
+        if process_markdown.is_code_block_toggle(line):
+            in_code = not in_code
+            continue
+        if in_code:
+            continue
+        if process_markdown.is_embedded(line):
+            file_name = line[3:-2].split("|")[0]
+            if Path(file_name).suffix == "":
+                file_name = file_name + ".md"
+            yield lineno, file_name, True
+            continue
+        for m in DOCUMENT_LINK.finditer(INLINE_CODE.sub("", line)):
+            yield lineno, m.group(1) + ".md", False
+
+
+def check_document(
+    filename: Path, vault_root: Path, paths: Dict[str, List[Path]]
+) -> List[Problem]:
+    """Find every embed and link in `filename`, and in the notes it embeds,
+    that does not name exactly one file in the vault.
+
+    `paths` lists the files in the vault by name, as `scan_vault` finds
+    them.  Like the converter, an ambiguous embed is followed into the
+    first of the files it names.
+    """
+    problems = []
+    seen = {filename}
+    pending = deque([filename])
+    while pending:
+        file = pending.popleft()
+        text = obsidian_path.read_text(file)
+        for lineno, file_name, embedded in targets(text):
+            found = paths.get(file_name, [])
+            if not found:
+                message = "was not found"
+            elif len(found) > 1:
+                others = ", ".join(_relative(p, vault_root) for p in found)
+                message = f"is ambiguous, it could be any of {others}"
+            else:
+                message = None
+            if message is not None:
+                problems.append(
+                    Problem(
+                        file=_relative(file, vault_root),
+                        line=lineno,
+                        target=file_name,
+                        message=message,
+                    )
+                )
+            if embedded and found and found[0].suffix == ".md":
+                if found[0] not in seen:
+                    seen.add(found[0])
+                    pending.append(found[0])
+    return problems
+
+
+def _relative(path: Path, vault_root: Path) -> str:
+    if vault_root in path.parents:
+        path = path.relative_to(vault_root)
+    return obsidian_path.format_path(path)
@@ -0,0 +1,182 @@
+import dataclasses
+import math
+import multiprocessing
+import re
+from concurrent import futures
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from obsidian_to_latex import metrics, obsidian_path, process_markdown, storage
+
+# Smaller chunks cost more to hand to a worker than they save
+MIN_CHUNK_LINES = 1000
+# Conversion settings copied into each worker
+SETTINGS = [
+    "file",
+    "temp_dir",
+    "asset_dir",
+    "code_external_threshold",
+    "line_time_budget",
+    "draft",
+    "fragment_dir",
+    "converter_version",
+    "max_embed_depth",
+    "max_lines",
+    "max_output_size",
+]
+
+
+@dataclasses.dataclass
+class Chunk:
+    start: int
+    lines: List[str]
+    depth: int
+
+
+@dataclasses.dataclass
+class ChunkResult:
+    # pylint: disable=too-many-instance-attributes
+    tex: List[str]
+    cleanup: str
+    pending_diagrams: Optional[List[Path]]
+    assets: List[Path]
+    lines_read: int
+    output_size: int
+    metrics: Dict[str, Any]
+    source_map: Optional[List[Tuple[Path, int]]]
+
+
+def split_chunks(
+    lines: List[str], chunk_lines: int, depth: int = 1
+) -> List[Chunk]:
+    """Split `lines` into chunks of at least `chunk_lines` lines that convert
+    independently.
+
+    A chunk ends with a blank line outside any code or mermaid block, where
+    every list has just ended, so the only state a chunk carries over from
+    the ones before it is the heading depth that embedded notes are shifted
+    by.
+    """
+    chunks = []
+    start = 0
+    start_depth = depth
+    in_code = False
+    for i, line in enumerate(lines):
+        if process_markdown.is_code_block_toggle(line):
+            in_code = not in_code
+        elif in_code:
+            continue
+        elif line.startswith("#"):
+            depth = len(re.match(r"#*", line).group())
+        elif not line.strip() and i + 1 - start >= chunk_lines:
+            chunks.append(Chunk(start, lines[start : i + 1], start_depth))
+            start = i + 1
+            start_depth = depth
+    if start < len(lines) or not chunks:
+        chunks.append(Chunk(start, lines[start:], start_depth))
+    return chunks
+
+
+def convert(
+    text: str,
+    workers: int,
+    min_lines: Optional[int],
+    min_chunk_lines: int = MIN_CHUNK_LINES,
+) -> str:
+    """Convert a note as `process_markdown.obsidian_to_tex` does, on up to
+    `workers` processes when it has at least `min_lines` lines.
+
+    The chunks' TeX is joined in order, so the result is the same as
+    converting the note in one go.  With `dedupe_embeds`, an embed depends
+    on every embed before it, so the note is converted in one go.
+    """
+    # pylint: disable=too-many-locals
+    state = process_markdown.STATE
+    lines = text.splitlines()
+    if (
+        min_lines is None
+        or len(lines) < min_lines
+        or workers < 2
+        or state.embedded is not None
+    ):
+        return process_markdown.obsidian_to_tex(text)
+    chunk_lines = max(min_chunk_lines, math.ceil(len(lines) / workers))
+    chunks = split_chunks(lines, chunk_lines, state.depth)
+    if len(chunks) < 2:
+        return process_markdown.obsidian_to_tex(text)
+
+    process_markdown.count_lines(len(lines))
+    settings = {name: getattr(state, name) for name in SETTINGS}
+    settings["pending_diagrams"] = (
+        None if state.pending_diagrams is None else []
+    )
+    settings["source_map"] = None if state.source_map is None else []
+    vault = obsidian_path.VAULT
+    vault_args = (
+        (None, [], {})
+        if vault is None
+        else (vault.store, vault.rules.patterns, vault.index())
+    )
+    with futures.ProcessPoolExecutor(
+        max_workers=min(workers, len(chunks)),
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(settings, *vault_args),
+    ) as executor:
+        results = list(executor.map(_convert_chunk, chunks))
+
+    tex = []
+    for result in results:
+        tex.extend(result.tex)
+        if state.pending_diagrams is not None:
+            state.pending_diagrams.extend(result.pending_diagrams)
+        state.assets.extend(result.assets)
+        metrics.METRICS.merge(result.metrics)
+        process_markdown.count_lines(result.lines_read)
+        process_markdown.add_output(result.output_size)
+    if state.source_map is not None:
+        sources = [s for result in results for s in result.source_map]
+        state.converted_map = process_markdown.finish_map(
+            sources, bool(tex), results[-1].cleanup, len(lines)
+        )
+    return "\n".join(tex) + results[-1].cleanup
+
+
+def _init_worker(
+    settings: Dict[str, Any],
+    store: Optional[storage.Storage],
+    patterns: List[str],
+    index: Dict[str, Path],
+) -> None:  # pragma: no cover
+    process_markdown.STATE = process_markdown.State.new()
+    for name, value in settings.items():
+        setattr(process_markdown.STATE, name, value)
+    if store is not None:
+        rules = obsidian_path.IgnoreRules(patterns)
+        obsidian_path.VAULT = obsidian_path.Vault(
+            store.root, rules, index, store
+        )
+
+
+def _convert_chunk(chunk: Chunk) -> ChunkResult:  # pragma: no cover
+    state = process_markdown.STATE
+    state.depth = chunk.depth
+    state.lines_read = 0
+    state.output_size = 0
+    state.assets = []
+    if state.pending_diagrams is not None:
+        state.pending_diagrams = []
+    if state.source_map is not None:
+        state.source_map = []
+    metrics.METRICS = metrics.Metrics()
+    tex = process_markdown.lines_to_tex(chunk.lines, chunk.start + 1)
+    return ChunkResult(
+        tex=tex,
+        cleanup=process_markdown.cleanup(),
+        pending_diagrams=state.pending_diagrams,
+        assets=state.assets,
+        lines_read=state.lines_read,
+        output_size=state.output_size,
+        metrics=metrics.METRICS.snapshot(),
+        source_map=state.source_map,
+    )
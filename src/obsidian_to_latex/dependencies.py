@@ -0,0 +1,42 @@
+from collections import deque
+from pathlib import Path
+from typing import List, Optional
+
+from pydantic.dataclasses import dataclass
+
+from obsidian_to_latex import obsidian_path, prefetch
+
+
+@dataclass
+class Dependencies:
+    files: List[Path]
+    missing: List[str]
+
+
+def embedded_files(filename: Path, text: Optional[str] = None) -> Dependencies:
+    """Find every file `filename` embeds, directly or through the notes it
+    embeds, in the order they are first seen.
+
+    Embeds that cannot be found in the vault are listed in `missing` rather
+    than raised, so callers can decide whether that matters.
+    """
+    files = [filename]
+    missing = []
+    pending = deque([(filename, text)])
+    while pending:
+        file, text = pending.popleft()
+        if text is None:
+            if file.suffix != ".md":
+                continue
+            text = obsidian_path.read_text(file)
+        for file_name in prefetch.embed_targets(text):
+            try:
+                path = obsidian_path.find_file(file_name)
+            except FileNotFoundError:
+                if file_name not in missing:
+                    missing.append(file_name)
+                continue
+            if path not in files:
+                files.append(path)
+                pending.append((path, None))
+    return Dependencies(files=files, missing=missing)
@@ -0,0 +1,167 @@
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from pydantic.dataclasses import dataclass
+
+from obsidian_to_latex import obsidian_path, prefetch, source_map
+
+
+@dataclass
+class Fragment:
+    """The TeX of an embedded note, the assets and source map that go with
+    it, and how many lines and levels of embeds it took, which count
+    towards the limits of any document reusing it."""
+
+    tex: str
+    assets: List[Path]
+    sources: Optional[List[source_map.Source]] = None
+    lines: int = 0
+    levels: int = 0
+
+
+class FragmentCache:
+    """Converted TeX of embedded notes, stored by the hash of what went into
+    it.
+
+    A fragment depends on the note, the notes and images it embeds, the
+    heading depth it is embedded at, the conversion settings and the
+    version of the converter, so a fragment is only reused when converting
+    again would give the same TeX.  The assets a fragment refers to, such as
+    rendered diagrams, are recorded with it; a fragment whose assets are
+    gone is converted again.  So is the source map of a fragment's lines,
+    when one was made.
+    """
+
+    def __init__(self, root: Path, version: str):
+        self.root = root
+        self.version = version
+
+    def key(  # pylint: disable=too-many-arguments
+        self,
+        file: Path,
+        text: str,
+        depth: int,
+        settings: Dict[str, Any],
+        digests: Optional[Dict[Path, str]] = None,
+    ) -> str:
+        """The key of `file` converted from `text`.  `digests` keeps what
+        each embedded file and its own embeds hash to, so that one build
+        reads each of them once however many fragments embed it."""
+        digests = {} if digests is None else digests
+        files, missing = _embeds(text)
+        inputs = {
+            "version": self.version,
+            "file": obsidian_path.format_path(file),
+            "text": hashlib.sha256(text.encode("UTF-8")).hexdigest(),
+            "depth": depth,
+            "settings": settings,
+            "files": [tree_digest(f, digests) for f in files],
+            "missing": missing,
+        }
+        encoded = json.dumps(inputs, sort_keys=True).encode("UTF-8")
+        return hashlib.sha256(encoded).hexdigest()
+
+    def entry(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key[2:]}.json"
+
+    def get(self, key: str) -> Optional[Fragment]:
+        try:
+            with open(self.entry(key), "r", encoding="UTF-8") as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return None
+        assets = [Path(a) for a in stored["assets"]]
+        if not all(_is_available(a) for a in assets):
+            return None
+        # Mark the fragment and its assets as recently used
+        for path in [self.entry(key), *assets]:
+            os.utime(path)
+        sources = stored.get("sources")
+        if sources is not None:
+            sources = source_map.decode(sources)
+        return Fragment(
+            stored["tex"],
+            assets,
+            sources,
+            stored.get("lines", 0),
+            stored.get("levels", 0),
+        )
+
+    def put(self, key: str, fragment: Fragment) -> None:
+        entry = self.entry(key)
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        stored = {
+            "tex": fragment.tex,
+            "assets": [str(a) for a in fragment.assets],
+            "lines": fragment.lines,
+            "levels": fragment.levels,
+        }
+        if fragment.sources is not None:
+            stored["sources"] = source_map.encode(fragment.sources)
+        fd, partial = tempfile.mkstemp(
+            dir=entry.parent, prefix=".partial-", suffix=".json"
+        )
+        try:
+            with os.fdopen(fd, "w", encoding="UTF-8") as f:
+                json.dump(stored, f)
+            os.replace(partial, entry)
+        except BaseException:
+            os.unlink(partial)
+            raise
+
+
+def tree_digest(path: Path, digests: Dict[Path, str]) -> str:
+    """Hash `path` and, for notes, everything they embed, remembering the
+    hash of each file in `digests`."""
+    if path in digests:
+        return digests[path]
+    # A note embedding itself fails to convert, whatever it hashes to
+    digests[path] = obsidian_path.format_path(path)
+    inputs: List[Any]
+    if path.suffix == ".md":
+        text = obsidian_path.read_text(path)
+        files, missing = _embeds(text)
+        inputs = [
+            obsidian_path.format_path(path),
+            hashlib.sha256(text.encode("UTF-8")).hexdigest(),
+            [tree_digest(f, digests) for f in files],
+            missing,
+        ]
+    else:
+        inputs = _fingerprint(path)
+    encoded = json.dumps(inputs).encode("UTF-8")
+    digests[path] = hashlib.sha256(encoded).hexdigest()
+    return digests[path]
+
+
+def _embeds(text: str) -> Tuple[List[Path], List[str]]:
+    """The files `text` embeds that are in the vault, and the names of
+    those that are not."""
+    files, missing = [], []
+    for file_name in prefetch.embed_targets(text):
+        try:
+            files.append(obsidian_path.find_file(file_name))
+        except FileNotFoundError:
+            missing.append(file_name)
+    return files, missing
+
+
+def _fingerprint(path: Path) -> List[str]:
+    # Only the location of an image on disk ends up in the TeX, not its
+    # content; images in archives and memory are copied under their digest
+    if obsidian_path.storage_for(path).on_disk:
+        return [obsidian_path.format_path(path), ""]
+    digest = hashlib.sha256(obsidian_path.read_bytes(path)).hexdigest()
+    return [obsidian_path.format_path(path), digest]
+
+
+def _is_available(asset: Path) -> bool:
+    if not asset.exists():
+        return False
+    if asset.suffix == ".mmd":
+        return asset.with_suffix(".pdf").exists()
+    return True
@@ -0,0 +1,299 @@
+import contextlib
+import json
+import logging
+import os
+import re
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from obsidian_to_latex import build, process_markdown
+
+STATES = ["pending", "running", "done", "failed"]
+# Running jobs are named `<job>~<worker>.json`, and `.finishing` or
+# `.reaped-<token>` while a worker moves them on
+WORKER_SEPARATOR = "~"
+# Errors in the notes or options, which trying again would only repeat.
+# Files may be missing only for now, such as on a share another host is
+# still writing to, so those are retried.
+PERMANENT_ERRORS = (
+    process_markdown.EmbedError,
+    build.LatexError,
+    ValueError,
+)
+# Options each worker sets for itself rather than taking from the host the
+# job was submitted on
+HOST_OPTIONS = {"jobs", "prefetch_workers", "scratch_dir", "job_id"}
+
+
+class DirectoryQueue:
+    """Build jobs shared through a directory, for example on NFS, by any
+    number of workers on any number of hosts.
+
+    A job is a JSON file that moves from `pending/` to `running/` when a
+    worker claims it, and on to `done/` or `failed/`.  Every move is a
+    rename, which only one worker can win.  While it builds, a worker
+    touches its job every `heartbeat` seconds; a job left untouched for
+    `stale_after` seconds, as its worker stopped, goes back to `pending/`
+    until it has been tried `max_attempts` times.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        heartbeat: float = 10.0,
+        stale_after: float = 60.0,
+        max_attempts: int = 3,
+    ):
+        self.root = root
+        self.heartbeat = heartbeat
+        self.stale_after = stale_after
+        self.max_attempts = max_attempts
+        for state in STATES:
+            (root / state).mkdir(parents=True, exist_ok=True)
+
+    def submit(self, file: Path, options: Dict[str, Any]) -> str:
+        # Names sort in the order jobs were submitted
+        job_id = f"{time.time_ns():020d}-{uuid.uuid4().hex[:8]}"
+        job = {
+            "id": job_id,
+            "file": str(file),
+            "options": options,
+            "attempts": 0,
+            "errors": [],
+        }
+        _write_json(self.root / "pending" / f"{job_id}.json", job)
+        return job_id
+
+    def state(self, job_id: str) -> Optional[str]:
+        for state in ["done", "failed", "pending"]:
+            if (self.root / state / f"{job_id}.json").exists():
+                return state
+        if any((self.root / "running").glob(f"{job_id}{WORKER_SEPARATOR}*")):
+            return "running"
+        return None
+
+    def result(self, job_id: str) -> Dict[str, Any]:
+        for state in ["done", "failed"]:
+            path = self.root / state / f"{job_id}.json"
+            if path.exists():
+                return _read_json(path)
+        raise FileNotFoundError(f"Job `{job_id}` has not finished")
+
+    def is_idle(self) -> bool:
+        return not any(
+            p
+            for state in ["pending", "running"]
+            for p in (self.root / state).iterdir()
+            if not p.name.startswith(".")
+        )
+
+    def claim(self, worker: str) -> Optional[Path]:
+        """Move the oldest pending job to `running/` for `worker`."""
+        for path in sorted((self.root / "pending").glob("*.json")):
+            running = (
+                self.root
+                / "running"
+                / (f"{path.stem}{WORKER_SEPARATOR}{worker}.json")
+            )
+            if _move(path, running):
+                return running
+        return None
+
+    def requeue_stale(self) -> List[str]:
+        """Return jobs whose workers stopped to `pending/`, or fail them
+        once they have been tried `max_attempts` times."""
+        now = self._now()
+        requeued = []
+        for path in sorted((self.root / "running").iterdir()):
+            if path.name.startswith("."):
+                continue
+            try:
+                age = now - path.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            if age <= self.stale_after:
+                continue
+            # Including a job another reaper stopped while moving on
+            name = path.name.split(".")[0]
+            reaped = path.with_name(f"{name}.reaped-{uuid.uuid4().hex[:8]}")
+            if not _move(path, reaped):
+                continue
+            job = _read_json(reaped)
+            worker = name.split(WORKER_SEPARATOR, 1)[1]
+            logging.getLogger(__name__).warning(
+                "Worker `%s` stopped responding to job `%s`", worker, job["id"]
+            )
+            self._retry(reaped, job, f"Worker `{worker}` stopped responding")
+            requeued.append(job["id"])
+        return requeued
+
+    def run(
+        self, running: Path, build_job: Callable[[Path, Dict, str], Path]
+    ) -> Optional[str]:
+        """Build the claimed job `running` with `build_job`, and return the
+        state it ended in, or None if another worker took it back.
+
+        `build_job` is given an ID for the build, which differs between
+        jobs and between attempts at one job.
+        """
+        job = _read_json(running)
+        start = time.time()
+        error = None
+        build_id = f"{job['id']}-{job['attempts']}"
+        with self._heartbeat(running):
+            try:
+                pdf = build_job(Path(job["file"]), job["options"], build_id)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                logging.getLogger(__name__).exception(
+                    "Job `%s` failed", job["id"]
+                )
+                error = e
+        finishing = running.with_suffix(".finishing")
+        if not _move(running, finishing):
+            logging.getLogger(__name__).warning(
+                "Job `%s` was given to another worker", job["id"]
+            )
+            return None
+        if error is not None:
+            return self._retry(
+                finishing,
+                job,
+                f"{type(error).__name__}: {error}",
+                retry=not isinstance(error, PERMANENT_ERRORS),
+            )
+        job["worker"] = running.stem.split(WORKER_SEPARATOR, 1)[1]
+        job["pdf"] = str(pdf)
+        job["seconds"] = time.time() - start
+        return self._finish(finishing, job, "done")
+
+    def work(
+        self,
+        build_job: Optional[Callable[[Path, Dict, str], Path]] = None,
+        worker: Optional[str] = None,
+        poll: float = 1.0,
+        max_jobs: Optional[int] = None,
+        until_idle: bool = False,
+    ) -> int:
+        """Claim and build jobs until `max_jobs` are built or, with
+        `until_idle`, until no job is pending or running.  Returns the
+        number of jobs built."""
+        build_job = build_job or build_pdf
+        worker = worker or worker_id()
+        built = 0
+        while max_jobs is None or built < max_jobs:
+            self.requeue_stale()
+            running = self.claim(worker)
+            if running is None:
+                if until_idle and self.is_idle():
+                    break
+                time.sleep(poll)
+                continue
+            if self.run(running, build_job) == "done":
+                built += 1
+        return built
+
+    def wait(
+        self, job_ids: List[str], poll: float = 1.0
+    ) -> Dict[str, Dict[str, Any]]:
+        """The result of each job, once all of them finish."""
+        results: Dict[str, Dict[str, Any]] = {}
+        while True:
+            for job_id in job_ids:
+                if job_id not in results:
+                    with contextlib.suppress(FileNotFoundError):
+                        results[job_id] = self.result(job_id)
+            if len(results) == len(job_ids):
+                return results
+            time.sleep(poll)
+
+    def _retry(
+        self, path: Path, job: Dict, error: str, retry: bool = True
+    ) -> str:
+        job["attempts"] += 1
+        job["errors"].append(error)
+        if retry and job["attempts"] < self.max_attempts:
+            return self._finish(path, job, "pending")
+        return self._finish(path, job, "failed")
+
+    def _finish(self, path: Path, job: Dict, state: str) -> str:
+        _write_json(self.root / state / f"{job['id']}.json", job)
+        path.unlink()
+        return state
+
+    @contextlib.contextmanager
+    def _heartbeat(self, running: Path) -> Iterator[None]:
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(self.heartbeat):
+                try:
+                    os.utime(running)
+                except FileNotFoundError:
+                    return
+
+        thread = threading.Thread(target=beat, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def _now(self) -> float:
+        """The time on the file server, which file times are set by, so
+        clocks that differ between hosts do not matter."""
+        clock = self.root / ".clock"
+        clock.touch()
+        return clock.stat().st_mtime
+
+
+def worker_id() -> str:
+    name = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+    return re.sub(r"[^a-zA-Z0-9_-]", "_", name)
+
+
+def build_pdf(file: Path, options: Dict[str, Any], build_id: str) -> Path:
+    """Build in a directory of the job's own, so that attempts at one job,
+    and jobs for one note, do not build over each other."""
+    return build.build_pdf(
+        file, build.BuildOptions(**{**options, "job_id": build_id})
+    )
+
+
+def job_options(options: Dict[str, Any]) -> Dict[str, Any]:
+    """The encoded build `options` a job carries, leaving out those of the
+    submitting host."""
+    return {k: v for k, v in options.items() if k not in HOST_OPTIONS}
+
+
+def _move(source: Path, destination: Path) -> bool:
+    """Rename `source` unless another worker moved it first.  It is touched
+    first, since renaming keeps its time and the time tells workers how
+    long ago it was last looked after."""
+    try:
+        os.utime(source)
+        os.rename(source, destination)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def _read_json(path: Path) -> Dict[str, Any]:
+    with open(path, "r", encoding="UTF-8") as f:
+        return json.load(f)
+
+
+def _write_json(path: Path, data: Dict[str, Any]) -> None:
+    fd, partial = tempfile.mkstemp(dir=path.parent, prefix=".partial-")
+    try:
+        with os.fdopen(fd, "w", encoding="UTF-8") as f:
+            json.dump(data, f, indent=2)
+        os.replace(partial, path)
+    except BaseException:
+        os.unlink(partial)
+        raise
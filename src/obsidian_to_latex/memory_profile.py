@@ -0,0 +1,125 @@
+import contextlib
+import tracemalloc
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from obsidian_to_latex import cache, obsidian_path
+
+PROFILE = None
+# Deep enough to reach back from the allocating call to the converter
+TRACEBACK_FRAMES = 32
+
+
+class MemoryProfile:
+    """Peak memory of conversion stages and embedded files.
+
+    Peaks are measured above the memory in use when the stage or embed
+    started, and an embedded file's peak includes the files it embeds.
+    """
+
+    def __init__(self, top_sites: int = 10):
+        self.top_sites = top_sites
+        self.stages: Dict[str, int] = {}
+        self.embeds: Dict[str, int] = {}
+        self.sites: List[Tuple[str, int, int]] = []
+        self._open: List[int] = []
+
+    @contextlib.contextmanager
+    def track(self, table: Dict[str, int], name: str) -> Iterator[None]:
+        start, peak = tracemalloc.get_traced_memory()
+        # Resetting the peak loses it for the enclosing section, so the
+        # enclosing section keeps its own running peak
+        if self._open:
+            self._open[-1] = max(self._open[-1], peak)
+        tracemalloc.reset_peak()
+        self._open.append(start)
+        try:
+            yield
+        finally:
+            _, peak = tracemalloc.get_traced_memory()
+            peak = max(self._open.pop(), peak)
+            table[name] = max(table.get(name, 0), peak - start)
+            if self._open:
+                self._open[-1] = max(self._open[-1], peak)
+
+    def record_sites(self, filename: str) -> None:
+        """Remember the lines of `filename` responsible for the most memory
+        still in use, counting allocations made by the functions they call."""
+        sites: Dict[int, Tuple[int, int]] = {}
+        for trace in tracemalloc.take_snapshot().traces:
+            frame = next(
+                (
+                    f
+                    for f in reversed(trace.traceback)
+                    if f.filename == filename
+                ),
+                None,
+            )
+            if frame is None:
+                continue
+            size, count = sites.get(frame.lineno, (0, 0))
+            sites[frame.lineno] = (size + trace.size, count + 1)
+        ordered = sorted(sites.items(), key=lambda s: s[1][0], reverse=True)
+        self.sites = [
+            (f"{Path(filename).name}:{lineno}", size, count)
+            for lineno, (size, count) in ordered[: self.top_sites]
+        ]
+
+    def report(self) -> str:
+        lines = ["Peak memory by stage:"]
+        lines.extend(_rows(self.stages))
+        if self.embeds:
+            lines.append("Peak memory by embedded file:")
+            lines.extend(_rows(self.embeds))
+        if self.sites:
+            lines.append("Top allocation sites at the end of conversion:")
+            lines.extend(
+                f"    {site}  {cache.format_size(size)} in {count} blocks"
+                for site, size, count in self.sites
+            )
+        return "\n".join(lines)
+
+
+def _rows(table: Dict[str, int]) -> List[str]:
+    ordered = sorted(table.items(), key=lambda item: item[1], reverse=True)
+    width = max(len(name) for name, _ in ordered)
+    return [
+        f"    {name:<{width}}  {cache.format_size(size)}"
+        for name, size in ordered
+    ]
+
+
+def stage(name: str):
+    if PROFILE is None:
+        return contextlib.nullcontext()
+    return PROFILE.track(PROFILE.stages, name)
+
+
+def embed(file: Path):
+    if PROFILE is None:
+        return contextlib.nullcontext()
+    root = obsidian_path.current_root()
+    if root is not None and root in file.parents:
+        file = file.relative_to(root)
+    return PROFILE.track(PROFILE.embeds, obsidian_path.format_path(file))
+
+
+def record_sites(filename: str) -> None:
+    if PROFILE is not None:
+        PROFILE.record_sites(filename)
+
+
+@contextlib.contextmanager
+def enabled(profile: bool = True) -> Iterator[Optional[MemoryProfile]]:
+    # pylint: disable=global-statement
+    global PROFILE
+    if not profile:
+        yield None
+        return
+    PROFILE = MemoryProfile()
+    tracemalloc.start(TRACEBACK_FRAMES)
+    try:
+        yield PROFILE
+    finally:
+        tracemalloc.stop()
+        PROFILE = None
@@ -0,0 +1,116 @@
+import bisect
+import contextlib
+import threading
+import time
+from typing import Dict, Iterator, List
+
+PREFIX = "obsidian_to_latex_"
+COUNTERS = {
+    "lines_converted_total": "Markdown lines converted to TeX",
+    "notes_embedded_total": "Notes embedded into documents",
+    "find_file_lookups_total": "Files looked up in a vault",
+    "vault_index_builds_total": "Vault indexes built or rebuilt",
+    "pdf_cache_hits_total": "Builds served from the PDF cache",
+    "pdf_cache_misses_total": "Builds not found in the PDF cache",
+    "fragment_cache_hits_total": "Embedded notes reused from earlier builds",
+    "fragment_cache_misses_total": "Embedded notes converted again",
+    "builds_total": "PDF builds started",
+    "failures_total": "Conversions and builds that raised an error",
+}
+HISTOGRAMS = {
+    "conversion_seconds": "Time to convert a document to TeX",
+    "mmdc_seconds": "Time to render a mermaid diagram",
+    "latex_seconds": "Time to compile TeX to PDF",
+    "build_seconds": "Time to build a PDF, including cache hits",
+}
+BUCKETS = [0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0]
+
+
+class Metrics:
+    """Counters and histograms of what conversions and builds did.
+
+    A snapshot is plain JSON, so metrics gathered in worker processes can
+    be merged into those of the process that reports them.
+    """
+
+    def __init__(self):
+        self.counters: Dict[str, float] = {name: 0 for name in COUNTERS}
+        self.histograms: Dict[str, Dict] = {
+            name: _empty_histogram() for name in HISTOGRAMS
+        }
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, amount: float = 1) -> None:
+        with self._lock:
+            self.counters[name] += amount
+
+    def observe(self, name: str, value: float) -> None:
+        with self._lock:
+            histogram = self.histograms[name]
+            histogram["buckets"][bisect.bisect_left(BUCKETS, value)] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "histograms": {
+                    name: {**h, "buckets": list(h["buckets"])}
+                    for name, h in self.histograms.items()
+                },
+            }
+
+    def merge(self, snapshot: Dict) -> None:
+        with self._lock:
+            for name, value in snapshot["counters"].items():
+                self.counters[name] += value
+            for name, other in snapshot["histograms"].items():
+                histogram = self.histograms[name]
+                for i, count in enumerate(other["buckets"]):
+                    histogram["buckets"][i] += count
+                histogram["sum"] += other["sum"]
+                histogram["count"] += other["count"]
+
+    def prometheus(self) -> str:
+        """The metrics in Prometheus' text exposition format."""
+        snapshot = self.snapshot()
+        lines = []
+        for name, value in snapshot["counters"].items():
+            lines.append(f"# HELP {PREFIX}{name} {COUNTERS[name]}")
+            lines.append(f"# TYPE {PREFIX}{name} counter")
+            lines.append(f"{PREFIX}{name} {value}")
+        for name, histogram in snapshot["histograms"].items():
+            lines.append(f"# HELP {PREFIX}{name} {HISTOGRAMS[name]}")
+            lines.append(f"# TYPE {PREFIX}{name} histogram")
+            cumulative = 0
+            for bound, count in zip([*BUCKETS, "+Inf"], histogram["buckets"]):
+                cumulative += count
+                le = bound if isinstance(bound, str) else f"{bound:g}"
+                lines.append(
+                    f'{PREFIX}{name}_bucket{{le="{le}"}} {cumulative}'
+                )
+            lines.append(f"{PREFIX}{name}_sum {histogram['sum']}")
+            lines.append(f"{PREFIX}{name}_count {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+
+def _empty_histogram() -> Dict:
+    buckets: List[int] = [0] * (len(BUCKETS) + 1)
+    return {"buckets": buckets, "sum": 0.0, "count": 0}
+
+
+METRICS = Metrics()
+
+
+def inc(name: str, amount: float = 1) -> None:
+    METRICS.inc(name, amount)
+
+
+@contextlib.contextmanager
+def timed(name: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        METRICS.observe(name, time.perf_counter() - start)
@@ -1,17 +1,348 @@
+import dataclasses
+import logging
 import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent import futures
 from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Union
 
-VAULT_ROOT = None
+from obsidian_to_latex import metrics, storage
+
+# The vault being converted
+VAULT = None
+
+# Version control, Obsidian's own folders and the folders builds create
+DEFAULT_IGNORES = [
+    ".git/",
+    ".obsidian/",
+    ".trash/",
+    "node_modules/",
+    "temp/",
+    "output/",
+]
+IGNORE_FILE = ".obsidian_to_latex_ignore"
+GLOB_TOKEN = re.compile(r"\*\*/|\*\*|\*|\?|\[!?\]?[^\]]*\]|.")
+SCAN_WORKERS = 8
+MAX_OPEN_VAULTS = 8
 
 
 def format_path(path: Path) -> str:
     return str(path).replace(os.path.sep, "/")
 
 
-def find_file(file_name: str) -> Path:  # pragma: no cover
-    for root, _dirs, files in os.walk(VAULT_ROOT):
-        if file_name in files:
-            return Path(os.path.join(root, file_name))
-    raise FileNotFoundError(
-        f"Unable to locate `{file_name}` under `{VAULT_ROOT}`"
+class IgnoreRules:
+    """Gitignore-style patterns for paths relative to the vault root.
+
+    A trailing `/` matches only directories, a `/` anywhere else anchors
+    the pattern to the vault root, and `!` includes a path an earlier
+    pattern excluded.  The last matching pattern wins.  `*` and `?` match
+    within one part of a path, and `**` across any number of them.
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        self.patterns = list(patterns)
+        self._rules = []
+        for pattern in self.patterns:
+            pattern = pattern.strip()
+            if not pattern or pattern.startswith("#"):
+                continue
+            negate = pattern.startswith("!")
+            if negate:
+                pattern = pattern[1:]
+            dir_only = pattern.endswith("/")
+            pattern = pattern.rstrip("/")
+            anchored = "/" in pattern
+            regex = re.compile(_glob_regex(pattern.lstrip("/")))
+            self._rules.append((regex, negate, dir_only, anchored))
+
+    def ignored(self, relative_path: str, is_dir: bool) -> bool:
+        name = relative_path.rsplit("/", 1)[-1]
+        result = False
+        for regex, negate, dir_only, anchored in self._rules:
+            if dir_only and not is_dir:
+                continue
+            if regex.match(relative_path if anchored else name):
+                result = not negate
+        return result
+
+
+def _glob_regex(pattern: str) -> str:
+    parts = []
+    for m in GLOB_TOKEN.finditer(pattern):
+        token = m.group()
+        if token == "**/":
+            parts.append("(?:.*/)?")
+        elif token == "**":
+            parts.append(".*")
+        elif token == "*":
+            parts.append("[^/]*")
+        elif token == "?":
+            parts.append("[^/]")
+        elif len(token) > 1:  # A character class such as `[!a-z]`
+            negate = token[1] == "!"
+            parts.append("[" + "^" * negate + token[1 + negate : -1] + "]")
+        else:
+            parts.append(re.escape(token))
+    return "".join(parts) + r"\Z"
+
+
+def load_ignore_rules(
+    vault: Union[Path, storage.Storage], extra: Iterable[str] = ()
+) -> IgnoreRules:
+    """The default ignores, then those in the vault's ignore file, then
+    `extra`."""
+    store = _storage(vault)
+    patterns = list(DEFAULT_IGNORES)
+    ignore_file = store.root / IGNORE_FILE
+    if store.exists(ignore_file):
+        patterns.extend(store.read_text(ignore_file).splitlines())
+    patterns.extend(extra)
+    return IgnoreRules(patterns)
+
+
+def _storage(vault: Union[Path, storage.Storage]) -> storage.Storage:
+    if isinstance(vault, storage.Storage):
+        return vault
+    return storage.open_storage(vault)
+
+
+@dataclasses.dataclass
+class VaultScan:
+    paths: Dict[str, List[Path]]
+    skipped: int
+
+
+def scan_vault(
+    vault: Union[Path, storage.Storage],
+    rules: Optional[IgnoreRules] = None,
+    workers: int = SCAN_WORKERS,
+) -> VaultScan:
+    """Find every file in the vault that is not ignored.
+
+    Top level directories are scanned in parallel.  Files are listed
+    directory by directory in name order, so which of several files with
+    the same name comes first does not depend on the file system.
+    """
+    store = _storage(vault)
+    if rules is None:
+        rules = IgnoreRules(DEFAULT_IGNORES)
+    files, directories, skipped = _scan_directory(store, "", rules)
+    with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        subtrees = executor.map(
+            lambda d: _scan_tree(store, d, rules), directories
+        )
+        for subtree_files, subtree_skipped in subtrees:
+            files.extend(subtree_files)
+            skipped += subtree_skipped
+
+    paths = {}
+    for name, path in files:
+        paths.setdefault(name, []).append(path)
+    return VaultScan(paths=paths, skipped=skipped)
+
+
+def _scan_tree(
+    store: storage.Storage, prefix: str, rules: IgnoreRules
+) -> Tuple[List[Tuple[str, Path]], int]:
+    files = []
+    skipped = 0
+    pending = [prefix]
+    while pending:
+        prefix = pending.pop()
+        found, directories, ignored = _scan_directory(store, prefix, rules)
+        files.extend(found)
+        skipped += ignored
+        pending.extend(reversed(directories))
+    return files, skipped
+
+
+def _scan_directory(
+    store: storage.Storage, prefix: str, rules: IgnoreRules
+) -> Tuple[List[Tuple[str, Path]], List[str], int]:
+    files = []
+    directories = []
+    skipped = 0
+    try:
+        entries = store.list_dir(prefix)
+    except OSError:
+        return files, directories, 1
+    for name, is_dir in entries:
+        relative_path = prefix + name
+        if rules.ignored(relative_path, is_dir):
+            skipped += 1
+        elif is_dir:
+            directories.append(relative_path + "/")
+        else:
+            files.append((name, store.root / relative_path))
+    return files, directories, skipped
+
+
+def index_vault(
+    vault: Union[Path, storage.Storage], rules: Optional[IgnoreRules] = None
+) -> Dict[str, Path]:
+    store = _storage(vault)
+    scan = scan_vault(store, rules)
+    metrics.inc("vault_index_builds_total")
+    logging.getLogger(__name__).info(
+        "Indexed %s file names in `%s`, skipping %s ignored entries",
+        len(scan.paths),
+        store.root,
+        scan.skipped,
     )
+    return {name: paths[0] for name, paths in scan.paths.items()}
+
+
+class Vault:
+    """A vault's root, storage, ignore rules and the index of its file
+    names.
+
+    The index is built on first use and rebuilt when a name is missing
+    from it or the file it names has gone, so a vault can stay open while
+    its notes change.  Misses rebuild it at most once per generation, and
+    names still missing then fail straight away until `refresh` starts the
+    next generation.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        rules: Optional[IgnoreRules] = None,
+        index: Optional[Dict[str, Path]] = None,
+        store: Optional[storage.Storage] = None,
+    ):
+        self.root = root
+        self.store = store if store is not None else storage.open_storage(root)
+        self.rules = (
+            rules if rules is not None else load_ignore_rules(self.store)
+        )
+        self._index = index
+        # Whether a miss may rebuild the index in this generation
+        self._may_rebuild = True
+        self._missing: Set[str] = set()
+        self._lock = threading.Lock()
+
+    def index(self) -> Dict[str, Path]:
+        with self._lock:
+            if self._index is None:
+                self._index = index_vault(self.store, self.rules)
+            return self._index
+
+    def refresh(self) -> None:
+        """Let the next miss rebuild the index again, as notes may have
+        changed since the last rebuild."""
+        with self._lock:
+            self._may_rebuild = True
+            self._missing = set()
+
+    def scan(self) -> VaultScan:
+        return scan_vault(self.store, self.rules)
+
+    def find_file(self, file_name: str) -> Path:
+        metrics.inc("find_file_lookups_total")
+        if file_name not in self._missing:
+            path = self.index().get(file_name)
+            if path is not None and self.store.exists(path):
+                return path
+            with self._lock:
+                if self._may_rebuild:
+                    self._index = index_vault(self.store, self.rules)
+                    self._may_rebuild = False
+                path = self._index.get(file_name)
+                if path is not None and self.store.exists(path):
+                    return path
+                self._missing.add(file_name)
+        raise FileNotFoundError(
+            f"Unable to locate `{file_name}` under `{self.root}`"
+        )
+
+
+class VaultCache:
+    """Open vaults, so a long running process keeps the index of each vault
+    it converts from.  Reopening a vault refreshes it, so each conversion
+    finds the notes added since the last.  Beyond `max_open` vaults, the
+    least recently used is closed.
+    """
+
+    def __init__(self, max_open: int = MAX_OPEN_VAULTS):
+        self.max_open = max_open
+        self._vaults: "OrderedDict[Path, Vault]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def open(
+        self,
+        root: Path,
+        ignore: Iterable[str] = (),
+        store: Optional[storage.Storage] = None,
+    ) -> Vault:
+        """The vault at `root`, read through `store` when it is given and
+        otherwise through the storage it was opened with or, for a vault
+        not yet open, that of the folder or archive `root`."""
+        with self._lock:
+            vault = self._vaults.get(root)
+            if store is None:
+                store = vault.store if vault else storage.open_storage(root)
+            rules = load_ignore_rules(store, ignore)
+            if (
+                vault is None
+                or vault.store is not store
+                or vault.rules.patterns != rules.patterns
+            ):
+                if vault is not None and vault.store is not store:
+                    vault.store.close()
+                vault = Vault(root, rules, store=store)
+                self._vaults[root] = vault
+            else:
+                vault.refresh()
+            self._vaults.move_to_end(root)
+            while len(self._vaults) > self.max_open:
+                _, closed = self._vaults.popitem(last=False)
+                closed.store.close()
+            return vault
+
+    def root_of(self, path: Path) -> Optional[Path]:
+        """The root of the open vault holding `path` that is not on disk,
+        such as one in memory, whose root cannot be found from `path`."""
+        with self._lock:
+            for root, vault in self._vaults.items():
+                if not vault.store.on_disk and root in path.parents:
+                    return root
+        return None
+
+    def __len__(self) -> int:
+        return len(self._vaults)
+
+    def __contains__(self, root: Path) -> bool:
+        return root in self._vaults
+
+
+VAULTS = VaultCache()
+
+
+def current_root() -> Optional[Path]:
+    return VAULT.root if VAULT is not None else None
+
+
+def storage_for(path: Path) -> storage.Storage:
+    """The storage holding `path`: the current vault's when `path` is in
+    it, otherwise the file system."""
+    if VAULT is not None and VAULT.root in path.parents:
+        return VAULT.store
+    return storage.LocalStorage(path.parent)
+
+
+def read_text(path: Path) -> str:
+    return storage_for(path).read_text(path)
+
+
+def read_bytes(path: Path) -> bytes:
+    return storage_for(path).read_bytes(path)
+
+
+def find_file(file_name: str) -> Path:
+    if VAULT is None:
+        raise FileNotFoundError(
+            f"Unable to locate `{file_name}` outside a vault"
+        )
+    return VAULT.find_file(file_name)
@@ -1,9 +1,8 @@
-import logging
-import re
-import shutil
-import subprocess
+import datetime
+import json
+import os
 from pathlib import Path
-from typing import Optional
+from typing import List, Optional
 
 import click
 import colorama
@@ -11,10 +10,91 @@
 import coloredlogs
 import pydantic
 
-from obsidian_to_latex import obsidian_path, process_markdown
+from obsidian_to_latex import (
+    build,
+    cache,
+    job_queue,
+    memory_profile,
+    metrics,
+    obsidian_path,
+    process_markdown,
+    server,
+)
+
+
+class DefaultCommandGroup(click.Group):
+    """Run `default_command` when the first argument is not a subcommand, so
+    `obsidian_to_latex note.md` keeps working alongside subcommands."""
+
+    def __init__(self, *args, default_command: str, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.default_command = default_command
+
+    def parse_args(self, ctx, args):
+        if not args or args[0] not in self.commands and args[0] != "--help":
+            args = [self.default_command, *args]
+        return super().parse_args(ctx, args)
+
+
+def scratch_dir(value: Optional[Path]) -> Optional[Path]:
+    if value is None:
+        return None
+    if str(value) == "ram":
+        return build.ram_dir()
+    return value.resolve()
+
+
+def parse_size(value: Optional[str]) -> Optional[int]:
+    if value is None:
+        return None
+    try:
+        return cache.parse_size(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e)) from e
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    if value is None:
+        return None
+    try:
+        return cache.parse_duration(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e)) from e
+
+
+def cache_dirs(dirs: List[Path]) -> List[Path]:
+    if dirs:
+        return dirs
+    from_env = os.environ.get("OBSIDIAN_TO_LATEX_CACHE_DIR")
+    if from_env:
+        return [Path(from_env).resolve()]
+    raise click.UsageError(
+        "Name the cache directories, or set OBSIDIAN_TO_LATEX_CACHE_DIR"
+    )
+
 
+def describe_entries(entries: List[cache.Entry]) -> List[str]:
+    lines = [f"{'kind':<10}{'entries':>9}{'size':>12}  oldest use"]
+    for kind, (count, size, used) in cache.stats(entries).items():
+        when = datetime.datetime.fromtimestamp(used).isoformat(
+            sep=" ", timespec="minutes"
+        )
+        lines.append(
+            f"{kind:<10}{count:>9}{cache.format_size(size):>12}  {when}"
+        )
+    total = cache.format_size(sum(e.size for e in entries))
+    lines.append(f"{'total':<10}{len(entries):>9}{total:>12}")
+    return lines
 
-@click.command
+
+@click.group(cls=DefaultCommandGroup, default_command="build")
+def main():  # pragma: no cover
+    colorama.init()
+    colored_traceback.add_hook()
+    coloredlogs.install(level="INFO")
+
+
+@main.command(name="build")
 @click.argument(
     "filename",
     type=click.Path(path_type=Path, resolve_path=True),
@@ -24,79 +104,505 @@
     "--template",
     type=click.Path(path_type=Path, resolve_path=True),
 )
+@click.option(
+    "-j",
+    "--jobs",
+    type=int,
+    default=os.cpu_count() or 1,
+    show_default=True,
+    help="Build tasks, such as rendering diagrams, run concurrently.",
+)
+@click.option(
+    "--prefetch-workers",
+    type=int,
+    default=8,
+    show_default=True,
+    help="Threads used to read embedded files ahead of conversion.",
+)
+@click.option(
+    "--external-code-lines",
+    type=int,
+    help="Write code blocks with at least this many lines to separate files.",
+)
+@click.option(
+    "--line-time-budget",
+    type=float,
+    default=1.0,
+    show_default=True,
+    help="Warn about lines taking longer than this many seconds to convert.",
+)
+@click.option(
+    "--section",
+    metavar="HEADING",
+    help="Build only the section under this heading, as its own document.",
+)
+@click.option(
+    "--lines",
+    metavar="A:B",
+    help="Build only lines A to B of FILENAME, counting from 1.",
+)
+@click.option(
+    "--parallel-lines",
+    type=int,
+    default=20_000,
+    show_default=True,
+    help="Split notes with at least this many lines into chunks converted"
+    " on up to --jobs processes.",
+)
+@click.option(
+    "--max-embed-depth",
+    type=int,
+    default=32,
+    show_default=True,
+    help="Fail when notes embed notes more than this many levels deep.",
+)
+@click.option(
+    "--max-lines",
+    type=int,
+    default=1_000_000,
+    show_default=True,
+    help="Fail when the document and its embeds add up to more lines.",
+)
+@click.option(
+    "--max-output-size",
+    type=int,
+    default=100_000_000,
+    show_default=True,
+    help="Fail when the TeX of the document grows beyond this many"
+    " characters.",
+)
+@click.option(
+    "--draft",
+    is_flag=True,
+    help="Quick preview: one pdflatex pass, boxes in place of images and"
+    " diagrams that are not yet rendered, and plain code listings.",
+)
+@click.option(
+    "--dedupe-embeds",
+    is_flag=True,
+    help="Include each embedded note once; later embeds of it link back to"
+    " the first.",
+)
+@click.option(
+    "--build-root",
+    type=click.Path(path_type=Path, resolve_path=True),
+    help="Directory holding per-document build directories."
+    "  [default: temp next to FILENAME]",
+)
+@click.option(
+    "--build-dir",
+    "scratch_dir",
+    callback=lambda _ctx, _param, value: scratch_dir(value),
+    type=click.Path(path_type=Path, resolve_path=False),
+    help="Run the build in a scratch directory, or `ram` for tmpfs, keeping"
+    " only diagrams, listings and the PDF next to FILENAME.",
+)
+@click.option(
+    "--job-id",
+    help="Build in a directory of its own so parallel builds of the same"
+    " document do not collide.",
+)
+@click.option(
+    "--keep-builds",
+    type=int,
+    help="Job directories to keep per document; older ones are removed.",
+)
+@click.option(
+    "--ignore",
+    multiple=True,
+    help="Gitignore-style pattern of vault paths not to search for embedded"
+    " files, added to those in the vault's `.obsidian_to_latex_ignore`.",
+)
+@click.option(
+    "--cache-dir",
+    type=click.Path(path_type=Path, resolve_path=True),
+    envvar="OBSIDIAN_TO_LATEX_CACHE_DIR",
+    help="Reuse PDFs built from identical inputs, stored in this directory"
+    " which may be shared between machines.",
+)
+@click.option(
+    "--source-date-epoch",
+    type=int,
+    envvar="SOURCE_DATE_EPOCH",
+    help="Date written into the PDF, in seconds since 1970.  When given,"
+    " the title page shows it instead of the date of the build."
+    "  [default: the last commit to the note or its embeds, or 1980-01-01]",
+)
+@click.option(
+    "--verify",
+    is_flag=True,
+    help="Build twice from scratch and fail if the PDFs are not identical.",
+)
+@click.option(
+    "--memory-profile",
+    "profile_memory",
+    is_flag=True,
+    help="Report peak memory per stage and embedded file, and the lines of"
+    " the converter holding the most memory.",
+)
+@click.option(
+    "--metrics-json",
+    type=click.Path(path_type=Path, allow_dash=True),
+    help="Write counts and timings of the build to this file as JSON, or"
+    " to standard output with `-`.",
+)
+@click.option(
+    "--check",
+    "check_only",
+    is_flag=True,
+    help="Report every embed and link that is missing or ambiguous in the"
+    " vault, with its file and line, without building.",
+)
+@click.option(
+    "--server",
+    "server_url",
+    help="Build through a running `serve` daemon, e.g. http://127.0.0.1:8765"
+    " or unix:///tmp/obsidian_to_latex.sock.",
+)
 @pydantic.validate_arguments
-def main(filename: Path, template: Optional[Path]):  # pragma: no cover
-    colorama.init()
-    colored_traceback.add_hook()
-    coloredlogs.install(level="INFO")
+def build_command(  # pylint: disable=too-many-arguments,too-many-locals
+    filename: Path,
+    server_url: Optional[str],
+    profile_memory: bool,
+    metrics_json: Optional[Path],
+    check_only: bool,
+    verify: bool,
+    **options,
+):  # pragma: no cover
+    """Convert FILENAME to a PDF in the `output` folder next to it."""
+    options = build.BuildOptions(**options)
+    if check_only:
+        problems = build.check_links(filename, options)
+        for problem in problems:
+            click.echo(str(problem))
+        if problems:
+            raise click.ClickException(
+                f"Found {len(problems)} missing or ambiguous links"
+            )
+        return
+    if verify:
+        difference = build.verify_reproducible(filename, options)
+        if difference is not None:
+            raise click.ClickException(difference)
+        click.echo("Both builds produced identical PDFs")
+        return
+    if server_url is None:
+        try:
+            with memory_profile.enabled(profile_memory) as profile:
+                build.build_pdf(filename, options)
+        except (process_markdown.EmbedError, build.LatexError) as e:
+            raise click.ClickException(str(e)) from e
+        finally:
+            if metrics_json is not None:
+                with click.open_file(str(metrics_json), "w") as f:
+                    json.dump(metrics.METRICS.snapshot(), f, indent=2)
+        if profile:
+            click.echo(profile.report())
+        return
+    if profile_memory or metrics_json:
+        raise click.UsageError(
+            "--memory-profile and --metrics-json cannot be used with --server,"
+            " which reports metrics at its /metrics endpoint"
+        )
 
-    obsidian_path.VAULT_ROOT = get_vault_root(filename)
-
-    # pylint: disable=protected-access
-    process_markdown.STATE.file.append(filename)
-    with open(filename, "r", encoding="UTF-8") as f:
-        text = f.read()
-    title = get_title(text)
-    temp_dir = filename.parent / "temp"
-    temp_dir.mkdir(parents=True, exist_ok=True)
-    process_markdown.STATE.temp_dir = temp_dir
-    process_markdown.STATE.file.append(filename)
-    temp_file = temp_dir / "body.tex"
-
-    latex = process_markdown.obsidian_to_tex(text)
-    with open(temp_file, "w", encoding="UTF-8") as f:
-        f.write(latex)
-
-    latex_wrapper = (
-        template if template else Path(__file__).parent / "document.tex"
-    )
-    temp_wrapper = temp_dir / latex_wrapper.name
-
-    with open(latex_wrapper, "r", encoding="UTF-8") as f:
-        wrapper_text = f.read()
-    wrapper_text = wrapper_text.replace("TheTitleOfTheDocument", title)
-
-    with open(temp_wrapper, "w", encoding="UTF-8") as f:
-        f.write(wrapper_text)
-    subprocess.run(
-        [
-            "latexmk",
-            "-pdf",
-            "-g",
-            '-latexoption="-shell-escape -file-line-error -halt-on-error"',
-            temp_wrapper,
-        ],
-        check=False,
-        capture_output=False,
-        cwd=temp_wrapper.parent,
-    )
-    temp_pdf = temp_wrapper.with_suffix(".pdf")
+    vault_root = build.get_vault_root(filename)
+    payload = {
+        "vault": vault_root.name,
+        "file": str(filename.relative_to(vault_root)),
+        "options": server.request_options(options),
+    }
+    pdf = server.request(server_url, "/pdf", payload)
     out_dir = filename.parent / "output"
     out_dir.mkdir(parents=True, exist_ok=True)
-    out_pdf = (out_dir / filename.name).with_suffix(".pdf")
+    name = build.document_name(filename, options)
+    (out_dir / f"{name}.pdf").write_bytes(pdf)
+
+
+@main.command(name="serve")
+@click.argument(
+    "vaults",
+    nargs=-1,
+    required=True,
+    type=click.Path(path_type=Path, resolve_path=True, exists=True),
+)
+@click.option("--host", default="127.0.0.1", show_default=True)
+@click.option("--port", type=int, default=8765, show_default=True)
+@click.option(
+    "--socket",
+    "unix_socket",
+    type=click.Path(path_type=Path, resolve_path=True),
+    help="Listen on a unix socket instead of TCP.",
+)
+@click.option(
+    "-j",
+    "--workers",
+    type=int,
+    default=2,
+    show_default=True,
+    help="Conversions run concurrently.",
+)
+@click.option(
+    "--max-queue",
+    type=int,
+    default=8,
+    show_default=True,
+    help="Requests allowed to wait for a worker before being rejected.",
+)
+@click.option(
+    "--max-vaults",
+    type=int,
+    default=obsidian_path.MAX_OPEN_VAULTS,
+    show_default=True,
+    help="Vaults each worker keeps open, with their indexes.",
+)
+@click.option(
+    "--cache-dir",
+    type=click.Path(path_type=Path, resolve_path=True),
+    envvar="OBSIDIAN_TO_LATEX_CACHE_DIR",
+    help="Reuse PDFs built from identical inputs, stored in this directory.",
+)
+@pydantic.validate_arguments
+def serve_command(  # pylint: disable=too-many-arguments
+    vaults: List[Path],
+    host: str,
+    port: int,
+    unix_socket: Optional[Path],
+    workers: int,
+    max_queue: int,
+    max_vaults: int,
+    cache_dir: Optional[Path],
+):  # pragma: no cover
+    """Serve markdown to TeX and PDF conversions for VAULTS over HTTP.
+
+    VAULTS are folders, or zip or tar archives read without extracting
+    them.  Requests name the vault by its folder or archive name, and may
+    only set options that do not name paths, such as `draft` or `section`.
+    """
+    options = build.BuildOptions(cache_dir=cache_dir)
+    service = server.ConversionService(
+        vaults, workers, max_queue, max_vaults, options
+    )
+    service.warm_up()
+    httpd = server.make_server(service, host, port, unix_socket)
+    where = unix_socket if unix_socket else f"http://{host}:{port}"
+    names = ", ".join(f"`{v}`" for v in vaults)
+    click.echo(f"Serving {names} on {where}")
     try:
-        shutil.copy(temp_pdf, out_pdf)
-    except FileNotFoundError:
-        msg = f"Failed to create PDF: `{out_pdf}`"
-        logging.getLogger(__name__).error(msg)
-        raise FileNotFoundError(msg) from None
-
-
-def get_vault_root(path: Path) -> Path:  # pragma: no cover
-    if (path / ".obsidian").exists():
-        return path
-    if (path / ".git").exists():
-        logging.getLogger(__name__).info("Using .git for locating vault root")
-        return path
-    if path.parent == path:
-        raise FileNotFoundError("Unable to locate `.obsidian` folder")
-    return get_vault_root(path.parent)
-
-
-def get_title(text: str) -> str:  # pragma: no cover
-    line = text.splitlines()[0]
-    m = re.match(r"(^#*)\s*(.*)", line)
-    if not m:
-        return None
-    title = m.group(2)
-    return title
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        service.close()
+
+
+queue_argument = click.argument(
+    "queue_dir",
+    type=click.Path(path_type=Path, resolve_path=True, file_okay=False),
+)
+
+
+@main.command(name="worker")
+@queue_argument
+@click.option(
+    "--poll",
+    type=float,
+    default=1.0,
+    show_default=True,
+    help="Seconds between looks for new jobs.",
+)
+@click.option(
+    "--heartbeat",
+    type=float,
+    default=10.0,
+    show_default=True,
+    help="Seconds between signs of life while building.",
+)
+@click.option(
+    "--stale-after",
+    type=float,
+    default=60.0,
+    show_default=True,
+    help="Give the jobs of workers silent for this many seconds to others.",
+)
+@click.option(
+    "--max-attempts",
+    type=int,
+    default=3,
+    show_default=True,
+    help="Times a job is tried before it fails.",
+)
+@click.option("--max-jobs", type=int, help="Stop after building this many.")
+@click.option(
+    "--until-idle",
+    is_flag=True,
+    help="Stop once no job is pending or running.",
+)
+@pydantic.validate_arguments
+def worker_command(  # pylint: disable=too-many-arguments
+    queue_dir: Path,
+    poll: float,
+    heartbeat: float,
+    stale_after: float,
+    max_attempts: int,
+    max_jobs: Optional[int],
+    until_idle: bool,
+):  # pragma: no cover
+    """Build the jobs submitted to QUEUE_DIR, a directory shared with other
+    workers, for example on NFS.
+
+    Notes are built where the job names them, so every worker must see the
+    vaults, and any --cache-dir, at the same paths.
+    """
+    queue = job_queue.DirectoryQueue(
+        queue_dir, heartbeat, stale_after, max_attempts
+    )
+    worker = job_queue.worker_id()
+    click.echo(f"Worker `{worker}` building jobs from `{queue_dir}`")
+    try:
+        built = queue.work(None, worker, poll, max_jobs, until_idle)
+    except KeyboardInterrupt:
+        return
+    click.echo(f"Built {built} jobs")
+
+
+@main.command(name="submit")
+@queue_argument
+@click.argument(
+    "filenames",
+    nargs=-1,
+    required=True,
+    type=click.Path(path_type=Path, resolve_path=True, dir_okay=False),
+)
+@click.option(
+    "--options",
+    "options_json",
+    default="{}",
+    show_default=True,
+    help="Build options as JSON, named as in `serve` requests, such as"
+    """ '{"draft": true, "cache_dir": "/shared/cache"}'.""",
+)
+@click.option(
+    "--wait",
+    is_flag=True,
+    help="Wait for the jobs to finish and fail if any of them did.",
+)
+@pydantic.validate_arguments
+def submit_command(
+    queue_dir: Path, filenames: List[Path], options_json: str, wait: bool
+):  # pragma: no cover
+    """Queue builds of FILENAMES for `obsidian_to_latex worker QUEUE_DIR`."""
+    try:
+        options = server.decode_options(json.loads(options_json))
+    except (ValueError, TypeError) as e:
+        raise click.BadParameter(str(e), param_hint="--options") from e
+    # Each worker sets the options of its own host, such as `jobs`
+    job_options = job_queue.job_options(server.encode_options(options))
+    queue = job_queue.DirectoryQueue(queue_dir)
+    job_ids = {queue.submit(f, job_options): f for f in filenames}
+    for job_id, filename in job_ids.items():
+        click.echo(f"{job_id} {filename}")
+    if not wait:
+        return
+    results = queue.wait(list(job_ids))
+    failed = 0
+    for job_id, result in results.items():
+        if "pdf" in result:
+            click.echo(f"Built `{result['pdf']}`")
+        else:
+            failed += 1
+            click.echo(f"Failed `{job_ids[job_id]}`: {result['errors'][-1]}")
+    if failed:
+        raise click.ClickException(f"{failed} of {len(results)} jobs failed")
+
+
+cache_dirs_argument = click.argument(
+    "dirs",
+    nargs=-1,
+    type=click.Path(path_type=Path, resolve_path=True, file_okay=False),
+)
+wait_option = click.option(
+    "--wait",
+    type=float,
+    default=60,
+    show_default=True,
+    help="Seconds to wait for running builds to finish.",
+)
+
+
+@main.group(name="cache")
+def cache_group():
+    """Inspect and trim what builds keep between runs.
+
+    DIRS are `--cache-dir` directories and directories of build
+    directories, such as `temp` next to notes or `--build-root`, and
+    default to OBSIDIAN_TO_LATEX_CACHE_DIR.  Cached PDFs, converted
+    fragments, diagrams, listings, images and what LaTeX leaves in build
+    directories are all counted and evicted together.
+    """
+
+
+@cache_group.command(name="stats")
+@cache_dirs_argument
+@pydantic.validate_arguments
+def cache_stats_command(dirs: List[Path]):
+    """Count the entries of each kind in DIRS, and their size."""
+    entries = [e for d in cache_dirs(dirs) for e in cache.scan(d)]
+    for line in describe_entries(entries):
+        click.echo(line)
+
+
+@cache_group.command(name="gc")
+@cache_dirs_argument
+@click.option(
+    "--max-size",
+    callback=lambda _ctx, _param, value: parse_size(value),
+    metavar="SIZE",
+    help="Remove the least recently used entries until DIRS together fit,"
+    " e.g. 500M or 20G.",
+)
+@click.option(
+    "--max-age",
+    callback=lambda _ctx, _param, value: parse_duration(value),
+    metavar="DURATION",
+    help="Remove entries not used for this long, e.g. 12h or 30d.",
+)
+@click.option(
+    "--dry-run", is_flag=True, help="List what would be removed and stop."
+)
+@wait_option
+@pydantic.validate_arguments
+def cache_gc_command(
+    dirs: List[Path],
+    max_size: Optional[int],
+    max_age: Optional[float],
+    dry_run: bool,
+    wait: float,
+):
+    """Remove entries from DIRS by age and size, and leftovers of
+    interrupted writes."""
+    try:
+        removed = cache.gc(cache_dirs(dirs), max_size, max_age, dry_run, wait)
+    except TimeoutError as e:
+        raise click.ClickException(str(e)) from e
+    if dry_run:
+        for entry in removed:
+            click.echo(" ".join(str(p) for p in entry.paths))
+    size = cache.format_size(sum(e.size for e in removed))
+    verb = "Would remove" if dry_run else "Removed"
+    click.echo(f"{verb} {len(removed)} entries, {size}")
+
+
+@cache_group.command(name="clear")
+@cache_dirs_argument
+@wait_option
+@click.confirmation_option(prompt="Remove everything cached in DIRS?")
+@pydantic.validate_arguments
+def cache_clear_command(dirs: List[Path], wait: float):
+    """Remove every entry from DIRS."""
+    try:
+        removed = cache.clear(cache_dirs(dirs), wait)
+    except TimeoutError as e:
+        raise click.ClickException(str(e)) from e
+    size = cache.format_size(sum(e.size for e in removed))
+    click.echo(f"Removed {len(removed)} entries, {size}")
@@ -0,0 +1,108 @@
+import contextlib
+import logging
+import threading
+from concurrent import futures
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+from obsidian_to_latex import obsidian_path
+
+PREFETCHER = None
+
+
+def embed_targets(text: str) -> List[str]:
+    targets = []
+    for line in text.splitlines():
+        if not (line.startswith("![[") and line.endswith("]]")):
+            continue
+        file_name = line[3:-2].split("|")[0]
+        if Path(file_name).suffix == "":
+            file_name = file_name + ".md"
+        if file_name not in targets:
+            targets.append(file_name)
+    return targets
+
+
+class Prefetcher:
+    """Locate and read embed targets on a thread pool ahead of conversion.
+
+    At most `max_buffered` targets are held at once; targets that do not
+    fit are left for the converter to load when it reaches them.
+    """
+
+    def __init__(self, max_workers: int = 8, max_buffered: int = 64):
+        self.max_buffered = max_buffered
+        self._executor = futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="prefetch"
+        )
+        self._futures: Dict[str, futures.Future] = {}
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def schedule(self, text: str) -> None:
+        for file_name in embed_targets(text):
+            with self._lock:
+                if self._closed or file_name in self._futures:
+                    continue
+                if len(self._futures) >= self.max_buffered:
+                    return
+                self._futures[file_name] = self._executor.submit(
+                    self._load, file_name
+                )
+
+    def take(self, file_name: str):
+        with self._lock:
+            future = self._futures.pop(file_name, None)
+        if future is None:
+            return None
+        try:
+            return future.result()
+        except OSError as e:
+            logging.getLogger(__name__).debug(
+                "Prefetch of `%s` failed: %s", file_name, e
+            )
+            return None
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            for future in self._futures.values():
+                future.cancel()
+            self._futures.clear()
+        self._executor.shutdown(wait=True)
+
+    def _load(self, file_name: str):
+        file = obsidian_path.find_file(file_name)
+        if file.suffix != ".md":
+            return file
+        text = obsidian_path.read_text(file)
+        self.schedule(text)
+        return (file, text)
+
+
+def schedule(text: str) -> None:
+    if PREFETCHER is not None:
+        PREFETCHER.schedule(text)
+
+
+def take(file_name: str):
+    if PREFETCHER is None:
+        return None
+    return PREFETCHER.take(file_name)
+
+
+@contextlib.contextmanager
+def enabled(
+    max_workers: int = 8, max_buffered: int = 64
+) -> Iterator[Optional[Prefetcher]]:
+    # pylint: disable=global-statement
+    global PREFETCHER
+    if max_workers < 1:
+        yield None
+        return
+    PREFETCHER = Prefetcher(max_workers, max_buffered)
+    try:
+        yield PREFETCHER
+    finally:
+        PREFETCHER.close()
+        PREFETCHER = None
@@ -1,13 +1,28 @@
+import hashlib
 import logging
+import os
 import re
+import shutil
 import subprocess
+import time
 from pathlib import Path
-from typing import List, Optional, Tuple
+from typing import Dict, List, Optional, Set, Tuple
 
 import pydantic
 from pydantic.dataclasses import dataclass
 
-from obsidian_to_latex import obsidian_path
+from obsidian_to_latex import (
+    fragments,
+    memory_profile,
+    metrics,
+    obsidian_path,
+    prefetch,
+)
+
+
+class EmbedError(Exception):
+    """An embed that cannot be converted, such as one that embeds itself or
+    goes beyond the limits on how much a document may expand to."""
 
 
 @dataclass
@@ -18,24 +33,63 @@ class Indent:
 
 @dataclass
 class State:
+    # pylint: disable=too-many-instance-attributes
     depth: int
     code_block: Optional[int]
-    code_buffer: str
+    code_buffer: List[str]
+    code_lang: str
+    code_external_threshold: Optional[int]
     mermaid_block: Optional[int]
     list_depth: List[Indent]
     file: List[Path]
     temp_dir: Optional[Path]
+    asset_dir: Optional[Path]
+    line_time_budget: Optional[float]
+    pending_diagrams: Optional[List[Path]]
+    embedded: Optional[Set[Path]]
+    draft: bool
+    fragment_dir: Optional[Path]
+    fragment_digests: Dict[Path, str]
+    converter_version: str
+    assets: List[Path]
+    max_embed_depth: Optional[int]
+    max_lines: Optional[int]
+    max_output_size: Optional[int]
+    lines_read: int
+    deepest_embed: int
+    output_size: int
+    source_map: Optional[List[Tuple[Path, int]]]
+    converted_map: Optional[List[Tuple[Path, int]]]
 
     @classmethod
     def new(cls):
         return cls(
             depth=1,
             code_block=None,
-            code_buffer="",
+            code_buffer=[],
+            code_lang="",
+            code_external_threshold=None,
             mermaid_block=None,
             list_depth=[],
             file=[],
             temp_dir=None,
+            asset_dir=None,
+            line_time_budget=None,
+            pending_diagrams=None,
+            embedded=None,
+            draft=False,
+            fragment_dir=None,
+            fragment_digests={},
+            converter_version="",
+            assets=[],
+            max_embed_depth=None,
+            max_lines=None,
+            max_output_size=None,
+            lines_read=0,
+            deepest_embed=0,
+            output_size=0,
+            source_map=None,
+            converted_map=None,
         )
 
 
@@ -45,11 +99,77 @@ def new(cls):
 @pydantic.validate_arguments
 def obsidian_to_tex(input_text: str) -> str:
     lines = input_text.splitlines()
-    lines = [_line_to_tex(i + 1, line) for i, line in enumerate(lines)]
-    lines = [line for line in lines if line is not None]
-    text = "\n".join(lines)
-    text = text + cleanup()
-    return text
+    count_lines(len(lines))
+    prefetch.schedule(input_text)
+    outer_map = STATE.source_map
+    if outer_map is not None:
+        STATE.source_map = []
+    try:
+        converted = lines_to_tex(lines)
+        closing = cleanup()
+    finally:
+        sources, STATE.source_map = STATE.source_map, outer_map
+    if sources is not None:
+        STATE.converted_map = finish_map(
+            sources, bool(converted), closing, len(lines)
+        )
+    return "\n".join(converted) + closing
+
+
+@pydantic.validate_arguments
+def lines_to_tex(lines: List[str], first_lineno: int = 1) -> List[str]:
+    """Convert `lines`, leaving out those that produce nothing, such as the
+    lines of a code block before it closes."""
+    metrics.inc("lines_converted_total", len(lines))
+    converted = []
+    for i, line in enumerate(lines):
+        # Only an embed on this line leaves the map of what it converted
+        STATE.converted_map = None
+        tex = _line_to_tex(first_lineno + i, line)
+        if tex is None:
+            continue
+        converted.append(tex)
+        if STATE.source_map is not None:
+            map_lines(tex, first_lineno + i)
+    return converted
+
+
+def map_lines(tex: str, lineno: int) -> None:
+    """Record that the lines of `tex` came from line `lineno`, apart from
+    those of a note it embeds, which come from that note."""
+    embedded, STATE.converted_map = STATE.converted_map, None
+    source = (STATE.file[-1], lineno)
+    own = tex.count("\n") + 1
+    if embedded is None:
+        STATE.source_map.extend([source] * own)
+        return
+    STATE.source_map.extend([source] * (own - len(embedded)))
+    STATE.source_map.extend(embedded)
+
+
+def finish_map(
+    sources: List[Tuple[Path, int]],
+    converted: bool,
+    closing: str,
+    line_count: int,
+) -> List[Tuple[Path, int]]:
+    """Add the lines that close a note, such as the ends of its lists, which
+    come from its last line."""
+    source = (STATE.file[-1], max(line_count, 1))
+    if not converted:
+        sources.append(source)
+    sources.extend([source] * closing.count("\n"))
+    return sources
+
+
+@pydantic.validate_arguments
+def count_lines(count: int) -> None:
+    STATE.lines_read += count
+    if STATE.max_lines is not None and STATE.lines_read > STATE.max_lines:
+        raise EmbedError(
+            f"`{STATE.file[-1]}` takes the document beyond"
+            f" {STATE.max_lines} lines"
+        )
 
 
 @pydantic.validate_arguments
@@ -57,13 +177,27 @@ def _line_to_tex(
     lineno: int,
     line: str,
 ) -> str:
+    start = time.perf_counter()
     try:
-        return line_to_tex(lineno, line)
+        tex = line_to_tex(lineno, line)
     except Exception:  # pragma: no cover
         logging.getLogger(__name__).error(
             "Failed to parse `%s:%s`", STATE.file[-1], lineno
         )
         raise
+    elapsed = time.perf_counter() - start
+    # Embedded files count their own output and report their own slow lines
+    if tex is not None and not is_embedded(line):
+        add_output(len(tex))
+    if (
+        STATE.line_time_budget is not None
+        and elapsed > STATE.line_time_budget
+        and not is_embedded(line)
+    ):
+        logging.getLogger(__name__).warning(
+            "Converting `%s:%s` took %.2fs", STATE.file[-1], lineno, elapsed
+        )
+    return tex
 
 
 @pydantic.validate_arguments
@@ -80,10 +214,8 @@ def line_to_tex(
 
     if is_code_block_toggle(line):
         return toggle_code_block(lineno, line)
-    if STATE.code_block:
-        return line
-    if STATE.mermaid_block:
-        STATE.code_buffer += line + "\n"
+    if STATE.code_block or STATE.mermaid_block:
+        STATE.code_buffer.append(line)
         return None
     if is_embedded(line):
         return embed_file(line)
@@ -146,10 +278,13 @@ def embed_markdown(embed_line: str) -> str:
     assert is_markdown(embed_line), embed_line
 
     file_name = file_name + ".md"
-    file = obsidian_path.find_file(file_name)
-
-    with open(file, "r", encoding="UTF-8") as f:
-        text = f.read()
+    file, text = read_markdown(file_name)
+    check_embed(file)
+    if STATE.embedded is not None:
+        if file in STATE.embedded:
+            return embed_reference(file)
+        STATE.embedded.add(file)
+    metrics.inc("notes_embedded_total")
     lines = text.splitlines()
     for i, line in enumerate(lines):
         if line.startswith("#"):
@@ -157,9 +292,11 @@ def embed_markdown(embed_line: str) -> str:
     text = "\n".join(lines)
 
     STATE.file.append(file)
+    STATE.deepest_embed = max(STATE.deepest_embed, len(STATE.file))
     current_depth = STATE.depth
     try:
-        result = obsidian_to_tex(text)
+        with memory_profile.embed(file):
+            result = convert_fragment(file, text)
     finally:
         STATE.file.pop()
         STATE.depth = current_depth
@@ -167,6 +304,139 @@ def embed_markdown(embed_line: str) -> str:
     return file_label(file) + result
 
 
+@pydantic.validate_arguments
+def check_embed(file: Path) -> None:
+    if file in STATE.file:
+        cycle = STATE.file[STATE.file.index(file) :] + [file]
+        raise EmbedError(
+            "Embed cycle " + " > ".join(f"`{f.name}`" for f in cycle)
+        )
+    depth = len(STATE.file)
+    if STATE.max_embed_depth is not None and depth > STATE.max_embed_depth:
+        raise EmbedError(
+            f"Embedding `{file.name}` in `{STATE.file[-1].name}` goes beyond"
+            f" {STATE.max_embed_depth} levels of embeds"
+        )
+
+
+@pydantic.validate_arguments
+def add_output(size: int) -> None:
+    STATE.output_size += size
+    if (
+        STATE.max_output_size is not None
+        and STATE.output_size > STATE.max_output_size
+    ):
+        raise EmbedError(
+            f"`{STATE.file[-1]}` takes the document beyond"
+            f" {STATE.max_output_size} characters of TeX"
+        )
+
+
+@pydantic.validate_arguments
+def convert_fragment(file: Path, text: str) -> str:
+    """Convert an embedded note, or reuse its TeX from an earlier build when
+    nothing it depends on has changed."""
+    # With dedupe_embeds, what a note converts to depends on what came before
+    if STATE.fragment_dir is None or STATE.embedded is not None:
+        return obsidian_to_tex(text)
+    fragment_cache = fragments.FragmentCache(
+        STATE.fragment_dir, STATE.converter_version
+    )
+    settings = {
+        "draft": STATE.draft,
+        "code_external_threshold": STATE.code_external_threshold,
+        "asset_dir": STATE.asset_dir and str(STATE.asset_dir),
+    }
+    key = fragment_cache.key(
+        file, text, STATE.depth, settings, STATE.fragment_digests
+    )
+    cached = fragment_cache.get(key)
+    if cached is not None:
+        metrics.inc("fragment_cache_hits_total")
+        reuse_fragment(file, cached)
+        return cached.tex
+    metrics.inc("fragment_cache_misses_total")
+    first_asset = len(STATE.assets)
+    lines_read = STATE.lines_read
+    deepest_embed = STATE.deepest_embed
+    STATE.deepest_embed = len(STATE.file)
+    tex = obsidian_to_tex(text)
+    fragment = fragments.Fragment(
+        tex,
+        STATE.assets[first_asset:],
+        STATE.converted_map if STATE.source_map is not None else None,
+        lines=STATE.lines_read - lines_read,
+        levels=STATE.deepest_embed - len(STATE.file),
+    )
+    STATE.deepest_embed = max(deepest_embed, STATE.deepest_embed)
+    fragment_cache.put(key, fragment)
+    return tex
+
+
+@pydantic.validate_arguments
+def reuse_fragment(file: Path, fragment: fragments.Fragment) -> None:
+    """Account for a fragment from the cache as if it had been converted,
+    so the notes it embeds count towards the limits of this document."""
+    count_lines(fragment.lines)
+    deepest_embed = len(STATE.file) + fragment.levels
+    # As `check_embed` counts the levels above the note being embedded
+    if (
+        STATE.max_embed_depth is not None
+        and deepest_embed - 1 > STATE.max_embed_depth
+    ):
+        raise EmbedError(
+            f"Embeds in `{file.name}` go beyond"
+            f" {STATE.max_embed_depth} levels of embeds"
+        )
+    STATE.deepest_embed = max(STATE.deepest_embed, deepest_embed)
+    add_output(len(fragment.tex))
+    reuse_assets(fragment.assets)
+    if STATE.source_map is not None:
+        STATE.converted_map = fragment.sources
+
+
+@pydantic.validate_arguments
+def reuse_assets(assets: List[Path]) -> None:
+    """Copy the assets of a fragment another build or document made into
+    this build, where its TeX refers to them by name."""
+    for asset in assets:
+        copy = asset_path(asset.name)
+        if copy == asset:
+            continue
+        copy.parent.mkdir(parents=True, exist_ok=True)
+        files = [asset]
+        if asset.suffix == ".mmd":
+            files.append(asset.with_suffix(".pdf"))
+        for file in files:
+            # Assets are named after their content
+            if not copy.with_suffix(file.suffix).exists():
+                shutil.copyfile(file, copy.with_suffix(file.suffix))
+
+
+@pydantic.validate_arguments
+def embed_reference(file: Path) -> str:
+    """Refer back to a note already embedded earlier in the document."""
+    disp_text = sanitize_special_characters(file.stem)
+    return f"\\hyperref[{file_ref_label(file)}]{{{disp_text}}}"
+
+
+@pydantic.validate_arguments
+def read_markdown(file_name: str) -> Tuple[Path, str]:
+    prefetched = prefetch.take(file_name)
+    if prefetched is not None:
+        return prefetched
+    file = obsidian_path.find_file(file_name)
+    return (file, obsidian_path.read_text(file))
+
+
+@pydantic.validate_arguments
+def locate_file(file_name: str) -> Path:
+    prefetched = prefetch.take(file_name)
+    if prefetched is not None:
+        return prefetched
+    return obsidian_path.find_file(file_name)
+
+
 @pydantic.validate_arguments
 def is_image(line: str) -> bool:
     m = re.match(r"!\[\[([\s_a-zA-Z0-9.]*)(\|)?([0-9x]+)?\]\]", line)
@@ -185,14 +455,35 @@ def embed_image(line: str) -> str:
     if not m:  # pragma: no cover
         raise Exception(line)
     file_name, width, height = m.groups()
-    return include_image(obsidian_path.find_file(file_name), width, height)
+    if STATE.draft:
+        return placeholder(file_name, image_width(width))
+    return include_image(image_file(locate_file(file_name)), width, height)
+
+
+@pydantic.validate_arguments
+def image_file(file: Path) -> Path:
+    """The image as a file LaTeX can read: the image itself in vaults on
+    disk, otherwise a copy among the assets named after its content."""
+    store = obsidian_path.storage_for(file)
+    if store.on_disk:
+        return file
+    data = store.read_bytes(file)
+    digest = hashlib.sha256(data).hexdigest()
+    image = asset_path(f"image_{digest[:16]}{file.suffix.lower()}")
+    if image.exists():
+        # Mark the copy as recently used
+        os.utime(image)
+    else:
+        image.parent.mkdir(parents=True, exist_ok=True)
+        image.write_bytes(data)
+    return image
 
 
 @pydantic.validate_arguments
 def include_image(
     image_path: Path, width: Optional[int], height: Optional[int]
 ) -> str:
-    width_text = R"\columnwidth" if width is None else f"{int(width/2)}pt"
+    width_text = image_width(width)
     height_text = (
         R"keepaspectratio" if height is None else f"height={int(height/2)}pt"
     )
@@ -204,6 +495,18 @@ def include_image(
     )
 
 
+@pydantic.validate_arguments
+def image_width(width: Optional[int]) -> str:
+    return R"\columnwidth" if width is None else f"{int(width/2)}pt"
+
+
+@pydantic.validate_arguments
+def placeholder(name: str, width: str = R"\columnwidth") -> str:
+    """A framed box standing in for an image in draft mode."""
+    name = sanitize_special_characters(name)
+    return f"\\framebox[{width}]{{\\rule{{0pt}}{{4em}}\\texttt{{{name}}}}}"
+
+
 @pydantic.validate_arguments
 def is_code_block_toggle(line: str) -> bool:
     return re.match(r"\s*```", line) is not None
@@ -213,60 +516,180 @@ def is_code_block_toggle(line: str) -> bool:
 def toggle_code_block(
     lineno: int,
     line: str,
-) -> str:
+) -> Optional[str]:
     # pylint: disable=global-statement
     if not (STATE.code_block or STATE.mermaid_block):
-        STATE.code_buffer = ""
+        STATE.code_buffer = []
         lang = line[3:]
         if "mermaid" == lang:
             STATE.mermaid_block = lineno
-            lines = [
-                R"",
-                R"\begin{minipage}{\columnwidth}",
-                R"\includegraphics[width=\columnwidth,keepaspectratio]"
-                f"{{{STATE.file[-1].stem}_{STATE.mermaid_block}}}",
-            ]
-            return "\n".join(lines)
+            return None
 
         STATE.code_block = lineno
+        STATE.code_lang = lang
+        return None
+
+    if STATE.code_block:
+        STATE.code_block = None
+        lines = code_block_lines(STATE.code_lang, STATE.code_buffer)
+    else:
+        name = diagram_name(STATE.code_buffer)
+        if process_mermaid_diagram(name):
+            figure = (
+                R"\includegraphics[width=\columnwidth,keepaspectratio]"
+                f"{{{asset_ref(name)}}}"
+            )
+        else:
+            figure = placeholder(f"{name}.mmd")
+        STATE.mermaid_block = None
         lines = [
             R"",
             R"\begin{minipage}{\columnwidth}",
-            R"\begin{minted}[bgcolor=bg]" f"{{{lang}}}",
+            figure,
+            R"\end{minipage}",
         ]
-        return "\n".join(lines)
+    STATE.code_buffer = []
+    return "\n".join(lines)
 
-    if STATE.code_block:
-        STATE.code_block = None
-        lines = [
-            R"\end{minted}",
+
+@pydantic.validate_arguments
+def code_block_lines(lang: str, code: List[str]) -> List[str]:
+    if STATE.draft:
+        return [
+            R"",
+            R"\begin{minipage}{\columnwidth}",
+            R"\begin{verbatim}",
+            *code,
+            R"\end{verbatim}",
             R"\end{minipage}",
         ]
-    if STATE.mermaid_block:
-        assert STATE.temp_dir, STATE.temp_dir
-        process_mermaid_diagram()
-        STATE.mermaid_block = None
-        lines = [
+    threshold = STATE.code_external_threshold
+    if threshold is not None and len(code) >= threshold:
+        listing = write_listing(lang, code)
+        return [
+            R"",
+            R"\begin{minipage}{\columnwidth}",
+            R"\inputminted[bgcolor=bg]"
+            f"{{{lang}}}{{{asset_ref(listing.name)}}}",
             R"\end{minipage}",
         ]
-    return "\n".join(lines)
+    return [
+        R"",
+        R"\begin{minipage}{\columnwidth}",
+        R"\begin{minted}[bgcolor=bg]" f"{{{lang}}}",
+        *code,
+        R"\end{minted}",
+        R"\end{minipage}",
+    ]
 
 
 @pydantic.validate_arguments
-def process_mermaid_diagram():  # pragma: no cover
-    mmd_file: Path = (
-        STATE.temp_dir / f"{STATE.file[-1].stem}_{STATE.mermaid_block}.mmd"
-    )
+def write_listing(lang: str, code: List[str]) -> Path:
+    text = "".join(f"{line}\n" for line in code)
+    digest = hashlib.sha256(f"{lang}\n{text}".encode("UTF-8")).hexdigest()
+    suffix = lang if lang.isalnum() else "txt"
+    listing = asset_path(f"listing_{digest[:16]}.{suffix}")
+    if listing.exists():
+        os.utime(listing)
+    else:
+        write_if_changed(listing, text)
+    return listing
+
+
+@pydantic.validate_arguments
+def diagram_name(code: List[str]) -> str:
+    """Name a diagram after its source, so the same diagram gets the same
+    name wherever it appears and builds of unchanged notes are identical."""
+    text = "".join(f"{line}\n" for line in code)
+    digest = hashlib.sha256(text.encode("UTF-8")).hexdigest()
+    return f"diagram_{digest[:16]}"
+
+
+@pydantic.validate_arguments
+def process_mermaid_diagram(name: str) -> bool:
+    """Write the diagram's source and render it, unless it is unchanged.
+
+    Returns whether the diagram will be available; in draft mode diagrams
+    that are not already rendered are left out.
+    """
+    mmd_file = asset_path(f"{name}.mmd")
     img_file = mmd_file.with_suffix(".pdf")
-    with open(mmd_file, "w", encoding="UTF-8") as f:
-        f.write(STATE.code_buffer)
-    cmd = ["mmdc", "-i", mmd_file, "-o", img_file, "--pdfFit"]
-    subprocess.run(cmd, shell=True, check=True)
+    source = "".join(f"{line}\n" for line in STATE.code_buffer)
+    if STATE.draft:
+        return img_file.exists() and not is_changed(mmd_file, source)
+    if not write_if_changed(mmd_file, source) and img_file.exists():
+        os.utime(img_file)
+        return True
+    if STATE.pending_diagrams is not None:
+        STATE.pending_diagrams.append(mmd_file)
+        return True
+    render_diagram(mmd_file)
+    return True
+
+
+def mmdc_command(mmd_file: Path) -> List:
+    return [
+        "mmdc",
+        "-i",
+        mmd_file,
+        "-o",
+        mmd_file.with_suffix(".pdf"),
+        "--pdfFit",
+    ]
+
+
+def render_diagram(mmd_file: Path) -> Path:  # pragma: no cover
+    with metrics.timed("mmdc_seconds"):
+        subprocess.run(
+            mmdc_command(mmd_file), shell=os.name == "nt", check=True
+        )
+    return mmd_file.with_suffix(".pdf")
+
+
+@pydantic.validate_arguments
+def asset_path(name: str) -> Path:
+    asset_dir = STATE.asset_dir or STATE.temp_dir
+    assert asset_dir, asset_dir
+    STATE.assets.append(asset_dir / name)
+    return asset_dir / name
+
+
+@pydantic.validate_arguments
+def asset_ref(name: str) -> str:
+    if STATE.asset_dir is None:
+        return name
+    return obsidian_path.format_path(STATE.asset_dir / name)
+
+
+@pydantic.validate_arguments
+def is_changed(path: Path, text: str) -> bool:
+    try:
+        with open(path, "r", encoding="UTF-8") as f:
+            return f.read() != text
+    except FileNotFoundError:
+        return True
+
+
+@pydantic.validate_arguments
+def write_if_changed(path: Path, text: str) -> bool:
+    if not is_changed(path, text):
+        return False
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="UTF-8") as f:
+        f.write(text)
+    return True
 
 
 @pydantic.validate_arguments
 def sanitize_special_characters(line: str) -> str:
-    return re.sub(r"([&$_#%{}])(?!.*`)", r"\\\1", line)
+    # Leave characters alone when a back tick follows them on the same line
+    lines = []
+    for text in line.split("\n"):
+        head = text.rfind("`") + 1
+        lines.append(
+            text[:head] + SPECIAL_CHARACTERS.sub(r"\\\1", text[head:])
+        )
+    return "\n".join(lines)
 
 
 @pydantic.validate_arguments
@@ -281,12 +704,12 @@ def is_list(line: str) -> bool:
 
 @pydantic.validate_arguments
 def is_numbered_list_item(line: str) -> bool:
-    return re.match(r"\s*[0-9]+\.", line)
+    return re.match(r"\s*[0-9]+\.\s", line)
 
 
 @pydantic.validate_arguments
 def numbered_list_item(line: str) -> str:
-    indent, number, text = re.match(r"(\s*)([0-9])+\.\s+(.*)", line).groups()
+    indent, number, text = re.match(r"(\s*)([0-9]+)\.\s+(.*)", line).groups()
     sanitized_text = string_to_tex(text)
     list_line = R"\item " + sanitized_text
     if line_depth(indent) > total_depth():
@@ -307,7 +730,7 @@ def numbered_list_item(line: str) -> str:
 
 @pydantic.validate_arguments
 def is_bullet_list_item(line: str) -> bool:
-    return re.match(r"\s*-", line)
+    return re.match(r"\s*-\s", line)
 
 
 @pydantic.validate_arguments
@@ -370,96 +793,134 @@ def end_lists():
     return lines
 
 
-@pydantic.validate_arguments
-def string_to_tex(unprocessed_text: str) -> str:
-    logging.getLogger(__name__).debug("unprocessed_text %s", unprocessed_text)
-    processed_text = ""
-
-    while unprocessed_text:
-        char = unprocessed_text[0]
-        unprocessed_text = unprocessed_text[1:]
-        if char == "`":
-            pt, unprocessed_text = split_verbatim(unprocessed_text)
-            processed_text += pt
-        elif char == "*":
-            pt, unprocessed_text = split_formatted(unprocessed_text)
-            processed_text += pt
-        elif char == "[":
-            pt, unprocessed_text = split_link(unprocessed_text)
-            processed_text += pt
-        elif char == "^":
-            pt, unprocessed_text = split_reference(unprocessed_text)
-            processed_text += pt
-        else:
-            processed_text += sanitize_special_characters(char)
+class InlineText:
+    """A line of text being converted.
 
-    return processed_text
+    Searches remember their results, so scanning forward through the line
+    for closing delimiters stays linear in the length of the line.
+    """
 
+    def __init__(self, text: str):
+        self.text = text
+        self._found = {}
+        self._last = {}
 
-@pydantic.validate_arguments
-def split_verbatim(text: str) -> Tuple[str, str]:
-    processed_text = R"\verb`"
-    verb_text, unprocessed_text = re.match(r"(.*?`)(.*)", text).groups()
-    processed_text += verb_text
-    return (processed_text, unprocessed_text)
+    def find(self, needle: str, start: int) -> int:
+        previous = self._found.get(needle)
+        if previous is not None:
+            previous_start, found = previous
+            if start >= previous_start and (found == -1 or start <= found):
+                return found
+        found = self.text.find(needle, start)
+        self._found[needle] = (start, found)
+        return found
+
+    def rfind(self, needle: str) -> int:
+        if needle not in self._last:
+            self._last[needle] = self.text.rfind(needle)
+        return self._last[needle]
+
+
+PLAIN_TEXT = re.compile(r"[^`*\[^]+")
+LITERAL_STARS = re.compile(r"\*{4,}")
+SPECIAL_CHARACTERS = re.compile(r"([&$_#%{}])")
+PARAGRAPH_LINK = re.compile(r"\[#\^([a-zA-Z0-9-]+)\|?(.+)\]\]")
+REFERENCE = re.compile(r"[a-zA-Z0-9-]+$")
 
 
 @pydantic.validate_arguments
-def split_formatted(text: str) -> Tuple[str, str]:
-    if text.startswith("*"):
-        return split_bold(text)
-    return split_italics(text)
+def string_to_tex(unprocessed_text: str) -> str:
+    logging.getLogger(__name__).debug("unprocessed_text %s", unprocessed_text)
+    line = InlineText(unprocessed_text)
+    splitters = {
+        "`": split_verbatim,
+        "*": split_formatted,
+        "[": split_link,
+        "^": split_reference,
+    }
+    processed_text = []
+    pos = 0
+    while pos < len(unprocessed_text):
+        m = PLAIN_TEXT.match(unprocessed_text, pos) or LITERAL_STARS.match(
+            unprocessed_text, pos
+        )
+        if m:
+            processed_text.append(SPECIAL_CHARACTERS.sub(r"\\\1", m.group()))
+            pos = m.end()
+            continue
+        char = unprocessed_text[pos]
+        pt, pos = splitters[char](line, pos + 1)
+        processed_text.append(pt)
 
+    return "".join(processed_text)
 
-def split_bold(text: str) -> Tuple[str, str]:
-    processed_text = R"\textbf{"
-    bold_text, unprocessed_text = re.match(
-        r"\*(.*?\**)\*\*(.*)", text
-    ).groups()
 
-    bold_text = string_to_tex(bold_text)
-    processed_text += bold_text
-    processed_text += R"}"
-    return (processed_text, unprocessed_text)
+def split_verbatim(line: InlineText, pos: int) -> Tuple[str, int]:
+    end = line.find("`", pos)
+    if end == -1:
+        return (R"\textasciigrave{}", pos)
+    return (R"\verb`" + line.text[pos : end + 1], end + 1)
 
 
-def split_italics(text: str) -> Tuple[str, str]:
-    processed_text = R"\textit{"
-    italic_text, unprocessed_text = re.match(r"(.*?)\*(.*)", text).groups()
+def split_formatted(line: InlineText, pos: int) -> Tuple[str, int]:
+    if line.text.startswith("*", pos):
+        return split_bold(line, pos)
+    return split_italics(line, pos)
 
-    italic_text = string_to_tex(italic_text)
-    processed_text += italic_text
-    processed_text += R"}"
-    return (processed_text, unprocessed_text)
 
+def split_bold(line: InlineText, pos: int) -> Tuple[str, int]:
+    # Stars directly before the closing `**` belong to the bold text, so
+    # `***text***` is bold italic text.
+    end = line.find("**", pos + 1)
+    if end == -1:
+        return ("**", pos + 1)
+    while end < len(line.text) and line.text[end] == "*":
+        end += 1
+    bold_text = string_to_tex(line.text[pos + 1 : end - 2])
+    return (R"\textbf{" + bold_text + R"}", end)
 
-@pydantic.validate_arguments
-def split_link(text: str) -> Tuple[str, str]:
+
+def split_italics(line: InlineText, pos: int) -> Tuple[str, int]:
+    end = line.find("*", pos)
+    if end == -1:
+        return ("*", pos)
+    italic_text = string_to_tex(line.text[pos:end])
+    return (R"\textit{" + italic_text + R"}", end + 1)
+
+
+def split_link(line: InlineText, pos: int) -> Tuple[str, int]:
     return (
-        split_markdown_link(text)
-        or split_document_link(text)
-        or split_paragraph_link(text)
-        or (R"\[", text)
+        split_markdown_link(line, pos)
+        or split_document_link(line, pos)
+        or split_paragraph_link(line, pos)
+        or (R"\[", pos)
     )
 
 
-@pydantic.validate_arguments
-def split_markdown_link(text: str) -> Tuple[str, str]:
-    m = re.match(r"(.*?)\]\((.*?)\)(.*)", text)
-    if not m:
+def split_markdown_link(
+    line: InlineText, pos: int
+) -> Optional[Tuple[str, int]]:
+    disp_end = line.find("](", pos)
+    if disp_end == -1:
         return None
-    disp_text, link, unprocessed_text = m.groups()
-    disp_text = sanitize_special_characters(disp_text)
+    link_end = line.find(")", disp_end + 2)
+    if link_end == -1:
+        return None
+    disp_text = sanitize_special_characters(line.text[pos:disp_end])
+    link = line.text[disp_end + 2 : link_end]
     processed_text = f"\\href{{{link}}}{{{disp_text}}}"
-    return (processed_text, unprocessed_text)
+    return (processed_text, link_end + 1)
 
 
-@pydantic.validate_arguments
-def split_document_link(text: str) -> Tuple[str, str]:
-    m = re.match(r"\[(.+?)\]\](.*)", text)
-    if not m:
+def split_document_link(
+    line: InlineText, pos: int
+) -> Optional[Tuple[str, int]]:
+    if not line.text.startswith("[", pos):
         return None
-    link_text, unprocessed_text = m.groups()
+    end = line.find("]]", pos + 2)
+    if end == -1:
+        return None
+    link_text = line.text[pos + 1 : end]
 
     m = re.match(r"([a-zA-Z0-9-_\s]+)\|?(.+?)?", link_text)
     if not m:
@@ -471,27 +932,30 @@ def split_document_link(text: str) -> Tuple[str, str]:
         sanitize_special_characters(disp_text) if disp_text else doc_name
     )
     processed_text = f"\\hyperref[{doc_ref}]{{{disp_text}}}"
-    return (processed_text, unprocessed_text)
+    return (processed_text, end + 2)
 
 
-@pydantic.validate_arguments
-def split_paragraph_link(text: str) -> Tuple[str, str]:
-    m = re.match(r"\[#\^([a-zA-Z0-9-]+)\|?(.+)\]\](.*)", text)
+def split_paragraph_link(
+    line: InlineText, pos: int
+) -> Optional[Tuple[str, int]]:
+    # The display text runs to the last `]]` on the line
+    end = line.rfind("]]")
+    if end < pos:
+        return None
+    m = PARAGRAPH_LINK.fullmatch(line.text, pos, end + 2)
     if not m:
         return None
-    link, disp_text, unprocessed_text = m.groups()
+    link, disp_text = m.groups()
     disp_text = sanitize_special_characters(disp_text)
     processed_text = f"\\hyperref[{link}]{{{disp_text}}}"
-    return (processed_text, unprocessed_text)
+    return (processed_text, end + 2)
 
 
-@pydantic.validate_arguments
-def split_reference(text: str) -> Tuple[str, str]:
-    m = re.match(r"([a-zA-Z0-9-]+)$", text)
+def split_reference(line: InlineText, pos: int) -> Tuple[str, int]:
+    m = REFERENCE.match(line.text, pos)
     if not m:
-        return R"\textasciicircum{}", text
-    ref_text = m.groups()[0]
-    return f"\\label{{{ref_text}}}", ""
+        return R"\textasciicircum{}", pos
+    return f"\\label{{{m.group()}}}", m.end()
 
 
 @pydantic.validate_arguments
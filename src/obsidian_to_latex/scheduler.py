@@ -0,0 +1,101 @@
+import threading
+import time
+from concurrent import futures
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+
+class TaskGraph:
+    """Named tasks that run as soon as the tasks they depend on finish.
+
+    Each task is called with the results of its dependencies, in order. A
+    task may only depend on tasks added before it, so the graph never has
+    a cycle, and running tasks may add more tasks, such as one per diagram
+    found while converting.
+    """
+
+    def __init__(self):
+        self.tasks: Dict[str, Tuple[Callable, List[str]]] = {}
+        self.results: Dict[str, Any] = {}
+        self.times: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, fn: Callable, deps: Iterable[str] = ()) -> str:
+        deps = list(deps)
+        with self._lock:
+            if name in self.tasks:
+                raise ValueError(f"Task `{name}` already exists")
+            unknown = [d for d in deps if d not in self.tasks]
+            if unknown:
+                raise ValueError(f"Task `{name}` depends on unknown {unknown}")
+            self.tasks[name] = (fn, deps)
+        return name
+
+    def run(self, jobs: int = 1) -> Dict[str, Any]:
+        """Run every task, at most `jobs` at a time.
+
+        When a task fails, no further tasks start and its exception is
+        raised once the running tasks finish.
+        """
+        scheduled = set()
+        running = {}
+        error = None
+        with futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+            while True:
+                if error is None:
+                    with self._lock:
+                        ready = [
+                            name
+                            for name, (_fn, deps) in self.tasks.items()
+                            if name not in scheduled
+                            and all(d in self.results for d in deps)
+                        ]
+                    for name in ready:
+                        scheduled.add(name)
+                        running[executor.submit(self._run_task, name)] = name
+                if not running:
+                    break
+                done, _ = futures.wait(
+                    running, return_when=futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    del running[future]
+                    error = error or future.exception()
+        if error is not None:
+            raise error
+        return self.results
+
+    def _run_task(self, name: str) -> None:
+        fn, deps = self.tasks[name]
+        start = time.perf_counter()
+        result = fn(*[self.results[d] for d in deps])
+        self.times[name] = (start, time.perf_counter())
+        self.results[name] = result
+
+    def critical_path(self) -> Tuple[List[str], float]:
+        """The chain of dependent tasks that took longest in total."""
+        finish = {}
+        previous = {}
+        for name, (_fn, deps) in self.tasks.items():
+            if name not in self.times:
+                continue
+            start, end = self.times[name]
+            slowest = max(deps, key=lambda d: finish[d], default=None)
+            previous[name] = slowest
+            finish[name] = (end - start) + (finish[slowest] if slowest else 0)
+        if not finish:
+            return [], 0.0
+        name = max(finish, key=lambda n: finish[n])
+        total = finish[name]
+        path = []
+        while name is not None:
+            path.append(name)
+            name = previous[name]
+        return path[::-1], total
+
+    def report(self) -> str:
+        path, total = self.critical_path()
+        steps = []
+        for name in path:
+            start, end = self.times[name]
+            steps.append(f"{name} {end - start:.2f}s")
+        return f"Critical path {total:.2f}s: " + " > ".join(steps)
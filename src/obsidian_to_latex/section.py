@@ -0,0 +1,86 @@
+import re
+from typing import Iterator, List, Optional, Tuple
+
+from obsidian_to_latex import process_markdown
+
+
+def headings(lines: List[str]) -> Iterator[Tuple[int, int, str]]:
+    """Yield the index, level and text of each heading outside code
+    blocks, read the way `line_to_section` reads them."""
+    in_code = False
+    for i, line in enumerate(lines):
+        if process_markdown.is_code_block_toggle(line):
+            in_code = not in_code
+            continue
+        if in_code or not line.startswith("#"):
+            continue
+        hashes, title = re.match(r"(#*)\s*(.*)", line).groups()
+        yield i, len(hashes), title.strip()
+
+
+def select(
+    text: str, heading: Optional[str] = None, line_range: Optional[str] = None
+) -> str:
+    if heading is not None and line_range is not None:
+        raise ValueError("Select either a section or lines, not both")
+    if heading is not None:
+        return select_section(text, heading)
+    if line_range is not None:
+        return select_lines(text, line_range)
+    return text
+
+
+def select_section(text: str, heading: str) -> str:
+    """The heading and everything below it up to the next heading of the
+    same or a higher level, with the heading promoted to the title."""
+    lines = text.splitlines()
+    found = list(headings(lines))
+    for n, (start, level, title) in enumerate(found):
+        if title == heading:
+            break
+    else:
+        titles = ", ".join(f"`{title}`" for _, _, title in found)
+        raise ValueError(f"No heading `{heading}`; found {titles}")
+    end = next(
+        (i for i, lower, _ in found[n + 1 :] if lower <= level), len(lines)
+    )
+    section = lines[start:end]
+    for i, depth, _ in headings(section):
+        section[i] = section[i][min(level - 1, depth - 1) :]
+    return "\n".join(section)
+
+
+def select_lines(text: str, line_range: str) -> str:
+    """Lines `A:B`, counting from 1 and including both ends; either end may
+    be left out.
+
+    The note's title is kept, as are the fences of a code block the range
+    starts or ends inside.
+    """
+    m = re.fullmatch(r"([0-9]*):([0-9]*)", line_range)
+    if not m:
+        raise ValueError(f"Lines must look like `A:B`, not `{line_range}`")
+    lines = text.splitlines()
+    start = int(m.group(1) or 1)
+    end = int(m.group(2) or len(lines))
+    if not 1 <= start <= end <= len(lines):
+        raise ValueError(f"Lines `{line_range}` are not within 1:{len(lines)}")
+
+    selection = lines[start - 1 : end]
+    fence = open_fence(lines[: start - 1])
+    if fence is not None:
+        selection.insert(0, fence)
+    if open_fence(selection) is not None:
+        selection.append("```")
+    if start > 1 and re.match(r"#\s", lines[0]):
+        selection.insert(0, lines[0])
+    return "\n".join(selection)
+
+
+def open_fence(lines: List[str]) -> Optional[str]:
+    """The line opening a code block left open at the end of `lines`."""
+    fence = None
+    for line in lines:
+        if process_markdown.is_code_block_toggle(line):
+            fence = line if fence is None else None
+    return fence
@@ -0,0 +1,337 @@
+import dataclasses
+import http.client
+import http.server
+import json
+import logging
+import shutil
+import socket
+import socketserver
+import tempfile
+import threading
+import urllib.parse
+import uuid
+from concurrent import futures
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+import pydantic
+
+from obsidian_to_latex import (
+    build,
+    metrics,
+    obsidian_path,
+    process_markdown,
+    storage,
+)
+
+# Options a request may set.  The rest, such as where builds and caches
+# go or the template LaTeX runs, are for whoever runs the service to set.
+REQUEST_OPTIONS = {
+    "draft",
+    "dedupe_embeds",
+    "external_code_lines",
+    "ignore",
+    "lines",
+    "section",
+    "source_date_epoch",
+}
+
+
+class ServiceBusy(Exception):
+    pass
+
+
+class ConversionService:
+    """Run conversions on a pool of worker processes that keep vaults and
+    their indexes open between requests.
+
+    Requests name one of the served vaults by its folder or archive name;
+    with a single vault the name may be left out.  Each worker keeps up to
+    `max_vaults` vaults open, dropping the least recently used.  At most
+    `workers` requests run at once and at most `max_queue` more wait for a
+    worker; anything beyond that is rejected with `ServiceBusy`.
+
+    Requests build with `options`, changing only those in
+    `REQUEST_OPTIONS`.
+    """
+
+    def __init__(
+        self,
+        vault_roots: List[Path],
+        workers: int = 2,
+        max_queue: int = 8,
+        max_vaults: int = obsidian_path.MAX_OPEN_VAULTS,
+        options: Optional[build.BuildOptions] = None,
+    ):
+        self.vaults: Dict[str, Path] = {}
+        for root in vault_roots:
+            if not (root.is_dir() or storage.is_archive(root)):
+                raise ValueError(
+                    f"`{root}` is neither a folder nor a zip or tar archive"
+                )
+            if root.name in self.vaults:
+                raise ValueError(f"More than one vault is named `{root.name}`")
+            self.vaults[root.name] = root
+        self.workers = workers
+        self.options = options or build.BuildOptions()
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        self._executor = futures.ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(list(self.vaults.values()), max_vaults),
+        )
+
+    def warm_up(self) -> None:
+        warm = [self._executor.submit(_ping) for _ in range(self.workers)]
+        futures.wait(warm)
+
+    def submit(self, fn, *args):
+        """Run `fn` on a worker, adding the metrics it records to those of
+        this process."""
+        # Released below; `with` would wait for a slot instead of refusing
+        # pylint: disable-next=consider-using-with
+        if not self._slots.acquire(blocking=False):
+            raise ServiceBusy("Too many requests queued")
+        try:
+            result, snapshot = self._executor.submit(
+                _measured, fn, *args
+            ).result()
+        except Exception:
+            metrics.inc("failures_total")
+            raise
+        finally:
+            self._slots.release()
+        metrics.METRICS.merge(snapshot)
+        return result
+
+    def tex(self, payload: dict) -> str:
+        file, options = self._parse(payload)
+        return self.submit(
+            _convert_tex, file, options, payload.get("markdown")
+        )
+
+    def pdf(self, payload: dict) -> bytes:
+        file, options = self._parse(payload)
+        return self.submit(_build_pdf, file, options)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+
+    def _parse(self, payload: dict):
+        if not isinstance(payload.get("file"), str):
+            raise ValueError("Request requires a `file`")
+        vault_root = self._vault(payload.get("vault"))
+        file = (vault_root / payload["file"]).resolve()
+        if vault_root.resolve() not in file.parents:
+            raise ValueError(f"`{payload['file']}` is outside the vault")
+        options = decode_options(
+            payload.get("options", {}), self.options, REQUEST_OPTIONS
+        )
+        return file, options
+
+    def _vault(self, name: Optional[str]) -> Path:
+        if name is None and len(self.vaults) == 1:
+            return next(iter(self.vaults.values()))
+        if name not in self.vaults:
+            raise ValueError(
+                f"Unknown vault `{name}`, serving {sorted(self.vaults)}"
+            )
+        return self.vaults[name]
+
+
+def _init_worker(
+    vault_roots: List[Path], max_vaults: int
+) -> None:  # pragma: no cover
+    obsidian_path.VAULTS = obsidian_path.VaultCache(max_vaults)
+    for root in vault_roots[:max_vaults]:
+        obsidian_path.VAULTS.open(root).index()
+
+
+def _ping() -> None:  # pragma: no cover
+    pass
+
+
+def _measured(fn, *args):  # pragma: no cover
+    metrics.METRICS = metrics.Metrics()
+    result = fn(*args)
+    return result, metrics.METRICS.snapshot()
+
+
+def _convert_tex(
+    file: Path, options: build.BuildOptions, text: Optional[str]
+) -> str:  # pragma: no cover
+    _title, latex = build.convert_file(file, options, text)
+    return latex
+
+
+def _build_pdf(
+    file: Path, options: build.BuildOptions
+) -> bytes:  # pragma: no cover
+    # Concurrent requests for one note build in directories of their own,
+    # and each returns the PDF it built rather than the shared output
+    options = dataclasses.replace(options, job_id=uuid.uuid4().hex)
+    try:
+        with tempfile.TemporaryDirectory(prefix="request-") as out_dir:
+            out_pdf = Path(out_dir) / "document.pdf"
+            return build.build_pdf(file, options, out_pdf).read_bytes()
+    finally:
+        shutil.rmtree(build.build_dir(file, options), ignore_errors=True)
+
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+    service: ConversionService = None
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        if self.path == "/health":
+            self._reply(200, "text/plain", b"ok")
+            return
+        if self.path == "/metrics":
+            body = metrics.METRICS.prometheus().encode("UTF-8")
+            self._reply(200, "text/plain; version=0.0.4", body)
+            return
+        self._reply(404, "text/plain", b"Not found")
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        routes = {
+            "/tex": lambda r: (
+                "text/x-tex",
+                self.service.tex(r).encode("UTF-8"),
+            ),
+            "/pdf": lambda r: ("application/pdf", self.service.pdf(r)),
+        }
+        if self.path not in routes:
+            self._reply(404, "text/plain", b"Not found")
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length))
+            content_type, body = routes[self.path](payload)
+        except ServiceBusy as e:
+            self._reply(503, "text/plain", str(e).encode("UTF-8"))
+        except FileNotFoundError as e:
+            self._reply(404, "text/plain", str(e).encode("UTF-8"))
+        except (process_markdown.EmbedError, build.LatexError) as e:
+            self._reply(422, "text/plain", str(e).encode("UTF-8"))
+        except (ValueError, TypeError, pydantic.ValidationError) as e:
+            self._reply(400, "text/plain", str(e).encode("UTF-8"))
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logging.getLogger(__name__).exception("Conversion failed")
+            self._reply(500, "text/plain", str(e).encode("UTF-8"))
+        else:
+            self._reply(200, content_type, body)
+
+    def address_string(self) -> str:
+        if isinstance(self.client_address, tuple):
+            return super().address_string()
+        return "unix"
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        logging.getLogger(__name__).info(
+            "%s %s", self.address_string(), format % args
+        )
+
+    def _reply(self, status: int, content_type: str, body: bytes) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+if hasattr(socketserver, "ThreadingUnixStreamServer"):  # pragma: no branch
+
+    class UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+
+        def get_request(self):
+            connection, _ = super().get_request()
+            return connection, ""
+
+
+def make_server(
+    service: ConversionService,
+    host: str = "127.0.0.1",
+    port: int = 8765,
+    unix_socket: Optional[Path] = None,
+) -> socketserver.BaseServer:
+    handler = type("Handler", (RequestHandler,), {"service": service})
+    if unix_socket is not None:
+        unix_socket.unlink(missing_ok=True)
+        # pylint: disable=possibly-used-before-assignment
+        return UnixHTTPServer(str(unix_socket), handler)
+    return http.server.ThreadingHTTPServer((host, port), handler)
+
+
+def encode_options(options: build.BuildOptions) -> dict:
+    return {
+        k: str(v) if isinstance(v, Path) else v
+        for k, v in dataclasses.asdict(options).items()
+    }
+
+
+def request_options(options: build.BuildOptions) -> dict:
+    """The options a request to `serve` may carry."""
+    encoded = encode_options(options)
+    return {k: encoded[k] for k in sorted(REQUEST_OPTIONS)}
+
+
+def decode_options(
+    options: dict,
+    base: Optional[build.BuildOptions] = None,
+    allowed: Optional[Set[str]] = None,
+) -> build.BuildOptions:
+    """`base`, or the default options, changed by those in `options`, which
+    must all be in `allowed` when it is given."""
+    known = {f.name for f in dataclasses.fields(build.BuildOptions)}
+    unknown = set(options) - known
+    if unknown:
+        raise ValueError(f"Unknown options {sorted(unknown)}")
+    if allowed is not None and set(options) - allowed:
+        raise ValueError(
+            f"Options {sorted(set(options) - allowed)} cannot be set by"
+            " requests"
+        )
+    return dataclasses.replace(base or build.BuildOptions(), **options)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: Optional[float] = None):
+        super().__init__("localhost", timeout=timeout)
+        self.unix_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_path)
+
+
+def request(
+    server: str, endpoint: str, payload: dict, timeout: Optional[float] = None
+) -> bytes:
+    """Send `payload` to a running `obsidian_to_latex serve`.
+
+    `server` is either `http://host:port` or `unix:///path/to/socket`.
+    """
+    url = urllib.parse.urlsplit(server)
+    if url.scheme == "unix":
+        connection = UnixHTTPConnection(url.path, timeout=timeout)
+    else:
+        connection = http.client.HTTPConnection(
+            url.hostname, url.port, timeout=timeout
+        )
+    try:
+        connection.request(
+            "POST",
+            endpoint,
+            body=json.dumps(payload).encode("UTF-8"),
+            headers={"Content-Type": "application/json"},
+        )
+        response = connection.getresponse()
+        body = response.read()
+    finally:
+        connection.close()
+    if response.status != 200:
+        raise Exception(
+            f"Server responded {response.status}: {body.decode('UTF-8')}"
+        )
+    return body
@@ -0,0 +1,110 @@
+import bisect
+import json
+import re
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from obsidian_to_latex import obsidian_path
+
+# A note and a line in it, counting from 1
+Source = Tuple[Path, int]
+# Errors as TeX reports them with `-file-line-error`
+FILE_LINE_ERROR = re.compile(r"^(.*?\.tex):(\d+): (.*)$", re.MULTILINE)
+
+
+def encode(sources: Sequence[Source], root: Optional[Path] = None) -> Dict:
+    """Encode the source of every line of TeX as runs of lines that come
+    from the same line of the same note.
+
+    Notes in `root` are named relative to it.
+    """
+    files: List[str] = []
+    indexes: Dict[Path, int] = {}
+    runs = []
+    previous = None
+    for tex_line, source in enumerate(sources, start=1):
+        if source == previous:
+            continue
+        previous = source
+        file, line = source
+        if file not in indexes:
+            indexes[file] = len(files)
+            files.append(_name(file, root))
+        runs.append([tex_line, indexes[file], line])
+    return {"files": files, "runs": runs, "lines": len(sources)}
+
+
+def decode(encoded: Dict, root: Optional[Path] = None) -> List[Source]:
+    files = [Path(f) if root is None else root / f for f in encoded["files"]]
+    ends = [run[0] for run in encoded["runs"][1:]] + [encoded["lines"] + 1]
+    sources = []
+    for (start, file, line), end in zip(encoded["runs"], ends):
+        sources.extend([(files[file], line)] * (end - start))
+    return sources
+
+
+def lookup(encoded: Dict, tex_line: int) -> Optional[Tuple[str, int]]:
+    """The note and line that line `tex_line` of the TeX came from."""
+    if not 1 <= tex_line <= encoded["lines"]:
+        return None
+    starts = [run[0] for run in encoded["runs"]]
+    _, file, line = encoded["runs"][bisect.bisect_right(starts, tex_line) - 1]
+    return encoded["files"][file], line
+
+
+def write(path: Path, sources: Sequence[Source], root: Optional[Path]) -> None:
+    with open(path, "w", encoding="UTF-8") as f:
+        json.dump(encode(sources, root), f)
+
+
+def load(path: Path) -> Optional[Dict]:
+    try:
+        with open(path, "r", encoding="UTF-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def translate_errors(log: str, encoded: Dict, tex_name: str) -> List[str]:
+    """The errors in a TeX log, with those in `tex_name` pointing at the
+    note and line they came from instead."""
+    errors = []
+    for m in FILE_LINE_ERROR.finditer(log):
+        file, tex_line, message = m.group(1), int(m.group(2)), m.group(3)
+        source = None
+        if Path(file).name == tex_name:
+            source = lookup(encoded, tex_line)
+        if source is None:
+            errors.append(f"{file}:{tex_line}: {message}")
+        else:
+            errors.append(
+                f"{source[0]}:{source[1]}: {message}"
+                f" ({tex_name}:{tex_line})"
+            )
+    return errors
+
+
+def changed_region(old: str, new: str) -> Optional[Tuple[int, int]]:
+    """The first and last lines of `new` that differ from `old`, counting
+    from 1, or None if nothing changed."""
+    if old == new:
+        return None
+    old_lines = old.split("\n")
+    new_lines = new.split("\n")
+    first = 0
+    shortest = min(len(old_lines), len(new_lines))
+    while first < shortest and old_lines[first] == new_lines[first]:
+        first += 1
+    last = 0
+    while (
+        last < shortest - first
+        and old_lines[-1 - last] == new_lines[-1 - last]
+    ):
+        last += 1
+    return first + 1, max(first + 1, len(new_lines) - last)
+
+
+def _name(file: Path, root: Optional[Path]) -> str:
+    if root is not None and root in file.parents:
+        file = file.relative_to(root)
+    return obsidian_path.format_path(file)
@@ -0,0 +1,217 @@
+import abc
+import hashlib
+import os
+import tarfile
+import tempfile
+import threading
+import zipfile
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Tuple, Union
+
+ARCHIVE_SUFFIXES = [".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz"]
+
+
+class Storage(abc.ABC):
+    """Where a vault keeps its files.
+
+    Files are named by paths under `root` whether or not `root` is a folder
+    on disk, so the converter keeps passing `Path`s around and only reads
+    files through the storage of the vault they are in.
+    """
+
+    on_disk = False
+
+    def __init__(self, root: Path):
+        self.root = root
+
+    @abc.abstractmethod
+    def list_dir(self, relative_dir: str) -> List[Tuple[str, bool]]:
+        """The files and folders in `relative_dir`, a vault relative path
+        ending in `/` or empty for the root, with whether each is a folder,
+        in name order.  Raises `OSError` when it cannot be listed."""
+
+    @abc.abstractmethod
+    def exists(self, path: Path) -> bool:
+        """Whether `path` is a file in the vault."""
+
+    @abc.abstractmethod
+    def read_bytes(self, path: Path) -> bytes:
+        """The contents of `path`, raising `FileNotFoundError` when it is
+        not a file in the vault."""
+
+    def close(self) -> None:
+        """Release what the storage holds open, once its vault is closed."""
+
+    def read_text(self, path: Path) -> str:
+        # Translate line endings as reading a text file from disk does
+        text = self.read_bytes(path).decode("UTF-8")
+        return text.replace("\r\n", "\n").replace("\r", "\n")
+
+    def local_dir(self, path: Path) -> Path:
+        """A folder on disk for what is built from `path`: next to it for
+        vaults on disk, otherwise in the temporary folder."""
+        digest = hashlib.sha1(str(self.root).encode("UTF-8")).hexdigest()
+        vault_dir = f"{self.root.name}-{digest[:8]}"
+        relative = path.parent.relative_to(self.root)
+        return (
+            Path(tempfile.gettempdir()) / "obsidian_to_latex" / vault_dir
+        ) / relative
+
+    def relative(self, path: Path) -> str:
+        try:
+            relative = path.relative_to(self.root)
+        except ValueError:
+            raise FileNotFoundError(
+                f"`{path}` is not in `{self.root}`"
+            ) from None
+        return str(relative).replace(os.path.sep, "/")
+
+
+class LocalStorage(Storage):
+    """A vault in a folder on disk."""
+
+    on_disk = True
+
+    def list_dir(self, relative_dir: str) -> List[Tuple[str, bool]]:
+        entries = []
+        with os.scandir(self.root / relative_dir) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    entries.append((entry.name, True))
+                elif entry.is_file():
+                    entries.append((entry.name, False))
+        return sorted(entries)
+
+    def exists(self, path: Path) -> bool:
+        return path.is_file()
+
+    def read_bytes(self, path: Path) -> bytes:
+        return path.read_bytes()
+
+    def read_text(self, path: Path) -> str:
+        with open(path, "r", encoding="UTF-8") as f:
+            return f.read()
+
+    def local_dir(self, path: Path) -> Path:
+        return path.parent
+
+
+class ListedStorage(Storage, abc.ABC):
+    """Storage that lists all of its files up front, keyed by their vault
+    relative paths."""
+
+    def __init__(self, root: Path, entries: Dict[str, Any]):
+        super().__init__(root)
+        self._entries = entries
+        self._folders = _folders(entries)
+
+    def list_dir(self, relative_dir: str) -> List[Tuple[str, bool]]:
+        if relative_dir not in self._folders:
+            raise FileNotFoundError(f"No folder `{relative_dir}`")
+        return self._folders[relative_dir]
+
+    def exists(self, path: Path) -> bool:
+        try:
+            return self.relative(path) in self._entries
+        except FileNotFoundError:
+            return False
+
+    def entry(self, path: Path) -> Any:
+        relative = self.relative(path)
+        if relative not in self._entries:
+            raise FileNotFoundError(f"No file `{relative}` in `{self.root}`")
+        return self._entries[relative]
+
+
+class MemoryStorage(ListedStorage):
+    """A vault held in memory as a dict of vault relative paths, such as
+    `notes/Root.md`, to their text or bytes."""
+
+    def __init__(self, root: Path, files: Dict[str, Union[str, bytes]]):
+        super().__init__(
+            root,
+            {
+                _normalize(name): (
+                    data.encode("UTF-8") if isinstance(data, str) else data
+                )
+                for name, data in files.items()
+            },
+        )
+
+    def read_bytes(self, path: Path) -> bytes:
+        return self.entry(path)
+
+
+class ArchiveStorage(ListedStorage):
+    """A read-only vault in a zip or tar archive, read without extracting
+    it.  The archive is the vault root, so `vault.zip/notes/Root.md` names
+    `notes/Root.md` in `vault.zip`.
+    """
+
+    def __init__(self, root: Path):
+        # The archive stays open for as long as the vault is
+        # pylint: disable=consider-using-with
+        self._lock = threading.Lock()
+        members = {}
+        if zipfile.is_zipfile(root):
+            self._archive = zipfile.ZipFile(root)
+            for info in self._archive.infolist():
+                if not info.is_dir():
+                    members[_normalize(info.filename)] = info
+        else:
+            self._archive = tarfile.open(root)
+            for member in self._archive.getmembers():
+                if member.isfile():
+                    members[_normalize(member.name)] = member
+        super().__init__(root, members)
+
+    def __getstate__(self):
+        # Processes receiving the storage open the archive themselves
+        return {"root": self.root}
+
+    def __setstate__(self, state):
+        self.__init__(state["root"])
+
+    def read_bytes(self, path: Path) -> bytes:
+        member = self.entry(path)
+        with self._lock:
+            if isinstance(self._archive, zipfile.ZipFile):
+                return self._archive.read(member)
+            return self._archive.extractfile(member).read()
+
+    def close(self) -> None:
+        with self._lock:
+            self._archive.close()
+
+
+def is_archive(path: Path) -> bool:
+    name = path.name.lower()
+    return path.is_file() and any(name.endswith(s) for s in ARCHIVE_SUFFIXES)
+
+
+def open_storage(root: Path) -> Storage:
+    """The storage for a vault in the folder or archive `root`."""
+    if is_archive(root):
+        return ArchiveStorage(root)
+    return LocalStorage(root)
+
+
+def _normalize(name: str) -> str:
+    name = name.replace("\\", "/")
+    while name.startswith("./"):
+        name = name[2:]
+    return name.lstrip("/")
+
+
+def _folders(names: Iterable[str]) -> Dict[str, List[Tuple[str, bool]]]:
+    folders: Dict[str, Dict[str, bool]] = {"": {}}
+    for name in names:
+        parts = name.split("/")
+        prefix = ""
+        for i, part in enumerate(parts):
+            is_dir = i < len(parts) - 1
+            folders.setdefault(prefix, {})[part] = is_dir
+            prefix = f"{prefix}{part}/"
+    return {
+        prefix: sorted(entries.items()) for prefix, entries in folders.items()
+    }
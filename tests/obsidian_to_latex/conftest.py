@@ -0,0 +1,98 @@
+import os
+import stat
+import sys
+from pathlib import Path
+from typing import Dict, Union
+
+import pytest
+
+from obsidian_to_latex import obsidian_path, process_markdown
+
+# Stand-ins for latexmk, pdflatex and mmdc, so builds run without a TeX
+# toolchain or node.  Words in the input steer them: `latex-error`,
+# `latex-pause`, `latex-slow`, `mmdc-fail` and `mmdc-slow`.  Slow tools
+# write their process ID to a `.pid` file next to their input first.
+FAKE_LATEX = """\
+import os, sys, time
+from pathlib import Path
+
+wrapper = Path(sys.argv[-1])
+body = Path("body.tex").read_text(encoding="UTF-8")
+if "latex-pause" in body:
+    time.sleep(0.5)
+if "latex-slow" in body:
+    Path("latex.pid").write_text(str(os.getpid()), encoding="UTF-8")
+    time.sleep(30)
+if "latex-error" in body:
+    wrapper.with_suffix(".log").write_text(
+        "./body.tex:1: Undefined control sequence.\\n", encoding="UTF-8"
+    )
+    sys.exit(1)
+wrapper_text = wrapper.read_text(encoding="UTF-8")
+mode = "draft" if "[draft]" in wrapper_text else "final"
+epoch = os.environ.get("SOURCE_DATE_EPOCH")
+pdf = f"%PDF-fake {epoch} {mode}\\n{body}\\n"
+# Like \\today, the title date is that of the build unless forced
+when = int(epoch) if os.environ.get("FORCE_SOURCE_DATE") == "1" else None
+pdf += f"date {time.strftime('%Y-%m-%d', time.gmtime(when))}\\n"
+# pdfTeX derives the trailer ID from the path of the output, unless the
+# document empties it
+if "\\\\pdftrailerid{}" not in wrapper_text:
+    pdf += f"/ID {os.getcwd()}\\n"
+wrapper.with_suffix(".pdf").write_text(pdf, encoding="UTF-8")
+"""
+FAKE_MMDC = """\
+import os, sys, time
+from pathlib import Path
+
+source = Path(sys.argv[sys.argv.index("-i") + 1])
+text = source.read_text(encoding="UTF-8")
+if "mmdc-slow" in text:
+    source.with_suffix(".pid").write_text(str(os.getpid()), encoding="UTF-8")
+    time.sleep(30)
+if "mmdc-fail" in text:
+    sys.exit(1)
+Path(sys.argv[sys.argv.index("-o") + 1]).write_text(
+    f"%PDF-diagram\\n{text}", encoding="UTF-8"
+)
+"""
+
+
+@pytest.fixture(name="fake_tools")
+def fake_tools_fixture(tmp_path_factory, monkeypatch) -> Path:
+    bin_dir = tmp_path_factory.mktemp("bin")
+    for name, code in [
+        ("latexmk", FAKE_LATEX),
+        ("pdflatex", FAKE_LATEX),
+        ("mmdc", FAKE_MMDC),
+    ]:
+        tool = bin_dir / name
+        tool.write_text(f"#!{sys.executable}\n{code}", encoding="UTF-8")
+        tool.chmod(tool.stat().st_mode | stat.S_IXUSR)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    return bin_dir
+
+
+@pytest.fixture(name="write_vault")
+def write_vault_fixture(tmp_path, monkeypatch):
+    """Write notes and images into a vault at `tmp_path`, given as a dict of
+    vault relative paths to their text or bytes, and return its root.  With
+    `current=True` it becomes `obsidian_path.VAULT`.  The open vaults and
+    the conversion state are put back after the test."""
+    monkeypatch.setattr(obsidian_path, "VAULTS", obsidian_path.VaultCache())
+    monkeypatch.setattr(obsidian_path, "VAULT", None)
+    monkeypatch.setattr(process_markdown, "STATE", process_markdown.STATE)
+
+    def write_vault(files: Dict[str, Union[str, bytes]], current=False):
+        for name, content in files.items():
+            path = tmp_path / name
+            path.parent.mkdir(parents=True, exist_ok=True)
+            if isinstance(content, bytes):
+                path.write_bytes(content)
+            else:
+                path.write_text(content, encoding="UTF-8")
+        if current:
+            obsidian_path.VAULT = obsidian_path.Vault(tmp_path)
+        return tmp_path
+
+    return write_vault
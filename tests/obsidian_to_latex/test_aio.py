@@ -0,0 +1,217 @@
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from obsidian_to_latex import aio, build, cache, metrics
+
+# Builds run the stand-ins for latexmk and mmdc
+pytestmark = pytest.mark.usefixtures("fake_tools")
+
+run_subprocess_params = [
+    ("import sys; sys.exit(0)", 0),
+    ("import sys; sys.exit(3)", 3),
+]
+
+
+@pytest.mark.parametrize("code, expected", run_subprocess_params)
+def test_run_subprocess(code, expected):
+    cmd = [sys.executable, "-c", code]
+    assert asyncio.run(aio.run_subprocess(cmd)) == expected
+
+
+def test_run_subprocess_check():
+    cmd = [sys.executable, "-c", "import sys; sys.exit(3)"]
+    with pytest.raises(subprocess.CalledProcessError):
+        asyncio.run(aio.run_subprocess(cmd, check=True))
+
+
+def test_run_subprocess_in_folder_with_environment(tmp_path):
+    code = "import os; open('out', 'w').write(os.environ['NAME'])"
+    cmd = [sys.executable, "-c", code]
+    env = {"NAME": "value"}
+    asyncio.run(aio.run_subprocess(cmd, cwd=tmp_path, env=env))
+    assert (tmp_path / "out").read_text() == "value"
+
+
+def test_timeout_kills_process_and_its_children(tmp_path):
+    # The child starts a grandchild that writes a file unless it is killed
+    grandchild = "import time; time.sleep(1); open('late', 'w').write('')"
+    child = (
+        "import subprocess, sys, time;"
+        f"subprocess.Popen([sys.executable, '-c', {grandchild!r}]);"
+        "time.sleep(10)"
+    )
+    cmd = [sys.executable, "-c", child]
+
+    start = time.perf_counter()
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(
+            asyncio.wait_for(aio.run_subprocess(cmd, cwd=tmp_path), 0.5)
+        )
+    assert time.perf_counter() - start < 5
+    time.sleep(1.5)
+    assert not (tmp_path / "late").exists()
+
+
+def test_gather_all():
+    async def value(v):
+        await asyncio.sleep(0)
+        return v
+
+    assert asyncio.run(aio.gather_all([value(1), value(2)])) == [1, 2]
+
+
+def test_gather_all_cancels_the_rest_on_failure():
+    cancelled = []
+
+    async def fail():
+        raise ValueError("failed")
+
+    async def slow():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    with pytest.raises(ValueError):
+        asyncio.run(aio.gather_all([slow(), fail()]))
+    assert cancelled == [True]
+
+
+def test_conversion_executor_is_shared():
+    aio.EXECUTOR = None
+    try:
+        executor = aio.conversion_executor()
+        assert aio.conversion_executor() is executor
+        assert executor.submit(lambda: 1).result() == 1
+    finally:
+        aio.EXECUTOR.shutdown()
+        aio.EXECUTOR = None
+
+
+def test_locked_waits_for_gc(tmp_path):
+    gc_lock = cache.Locks([tmp_path], shared=False)
+    assert gc_lock.try_acquire()
+
+    async def hold():
+        loop = asyncio.get_running_loop()
+        loop.call_later(0.3, gc_lock.release)
+        start = time.monotonic()
+        async with aio.locked([tmp_path]):
+            waited = time.monotonic() - start
+            assert not cache.Locks([tmp_path], shared=False).try_acquire()
+        assert cache.Locks([tmp_path], shared=True).try_acquire()
+        return waited
+
+    assert asyncio.run(hold()) >= 0.2
+
+
+@pytest.fixture(name="vault")
+def vault_fixture(write_vault, monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS", metrics.Metrics())
+    return write_vault(
+        {
+            ".obsidian/app.json": "{}",
+            "Root.md": "# Root\nintro\n![[Diagram]]\n",
+            "Diagram.md": "```mermaid\ngraph\n```\n",
+        }
+    )
+
+
+def test_convert_document(vault):
+    latex = asyncio.run(
+        aio.convert_document(vault / "Root.md", build.BuildOptions())
+    )
+    [diagram] = (vault / "temp").glob("*/diagram_*.pdf")
+    assert f"{{{diagram.stem}}}" in latex
+    assert "intro" in latex
+
+
+build_pdf_params = [
+    ({}, "latexmk"),
+    ({"draft": True}, "pdflatex"),
+]
+
+
+@pytest.mark.parametrize("options, expected", build_pdf_params)
+def test_build_pdf(vault, options, expected):
+    options = build.BuildOptions(**options)
+    pdf = asyncio.run(aio.build_pdf(vault / "Root.md", options))
+
+    assert pdf == vault / "output/Root.pdf"
+    assert "intro" in pdf.read_text(encoding="UTF-8")
+    assert metrics.METRICS.snapshot()["counters"]["builds_total"] == 1
+    assert (
+        metrics.METRICS.snapshot()["histograms"]["latex_seconds"]["count"] == 1
+    ), expected
+
+
+def test_build_pdf_reuses_cached_pdf(vault, tmp_path_factory):
+    options = build.BuildOptions(cache_dir=tmp_path_factory.mktemp("cache"))
+    pdf = asyncio.run(aio.build_pdf(vault / "Root.md", options))
+    built = pdf.read_bytes()
+    pdf.unlink()
+    (vault / "temp").rename(vault / "old")
+
+    asyncio.run(aio.build_pdf(vault / "Root.md", options))
+
+    assert pdf.read_bytes() == built
+    assert not list((vault / "temp").glob("*/body.tex"))
+
+
+def test_build_pdf_prunes_old_jobs(vault):
+    for job_id in ["1", "2", "3"]:
+        options = build.BuildOptions(job_id=job_id, keep_builds=2)
+        asyncio.run(aio.build_pdf(vault / "Root.md", options))
+    document_dir = build.build_dir(vault / "Root.md", build.BuildOptions())
+    assert sorted(p.name for p in document_dir.iterdir()) == [
+        "2",
+        "3",
+        "fragments",
+    ]
+
+
+def test_build_pdf_timeout_kills_latex(vault):
+    (vault / "Root.md").write_text("# Root\nlatex-slow\n", encoding="UTF-8")
+
+    start = time.monotonic()
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(
+            aio.build_pdf(vault / "Root.md", build.BuildOptions(), timeout=2)
+        )
+
+    assert time.monotonic() - start < 10
+    [pid] = (vault / "temp").glob("*/latex.pid")
+    assert not is_running(int(pid.read_text()))
+    assert not list((vault / "temp").glob("*/*.pdf"))
+    assert metrics.METRICS.snapshot()["counters"]["failures_total"] == 1
+
+
+def test_failed_diagram_cancels_the_others(vault):
+    (vault / "Root.md").write_text(
+        "# Root\n```mermaid\nmmdc-slow\n```\n```mermaid\nmmdc-fail\n```\n",
+        encoding="UTF-8",
+    )
+
+    start = time.monotonic()
+    options = build.BuildOptions(jobs=2)
+    with pytest.raises(subprocess.CalledProcessError):
+        asyncio.run(aio.build_pdf(vault / "Root.md", options))
+
+    assert time.monotonic() - start < 10
+    [pid] = (vault / "temp").glob("*/diagram_*.pid")
+    assert not is_running(int(pid.read_text()))
+    assert not list((vault / "temp").glob("*/diagram_*.pdf"))
+
+
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    return True
@@ -0,0 +1,670 @@
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+from unittest import mock
+
+import pytest
+
+from obsidian_to_latex import (
+    build,
+    cache,
+    metrics,
+    obsidian_path,
+    process_markdown,
+    storage,
+)
+
+build_dir_params = [
+    (Path("/vault/notes/Widget.md"), {}, Path("/vault/notes/temp")),
+    (
+        Path("/vault/notes/Widget XP.md"),
+        {"build_root": Path("/scratch")},
+        Path("/scratch"),
+    ),
+]
+
+
+@pytest.mark.parametrize("filename, options, root", build_dir_params)
+def test_build_dir_is_stable_per_document(filename, options, root):
+    options = build.BuildOptions(**options)
+    result = build.build_dir(filename, options)
+    assert result == build.build_dir(filename, options)
+    assert result.parent == root
+    assert result.name.startswith(filename.stem.replace(" ", "_") + "-")
+
+
+def test_build_dir_differs_between_documents():
+    options = build.BuildOptions()
+    a = build.build_dir(Path("/vault/a/Note.md"), options)
+    b = build.build_dir(Path("/vault/b/Note.md"), options)
+    assert a.parent == Path("/vault/a/temp")
+    assert a.name != b.name
+
+
+def test_build_dir_per_job():
+    options = build.BuildOptions(job_id="ci/42")
+    result = build.build_dir(Path("/vault/Note.md"), options)
+    assert result.name == "ci_42"
+    assert result.parent == build.build_dir(
+        Path("/vault/Note.md"), build.BuildOptions()
+    )
+
+
+document_name_params = [
+    ({}, "Note"),
+    ({"section": "Design"}, "Note - Design"),
+    ({"section": "In/Out: A?"}, "Note - In_Out_ A_"),
+    ({"lines": "3:10"}, "Note - lines 3-10"),
+]
+
+
+@pytest.mark.parametrize("options, expected", document_name_params)
+def test_document_name(options, expected):
+    options = build.BuildOptions(**options)
+    assert build.document_name(Path("/vault/Note.md"), options) == expected
+
+
+def test_build_dir_per_section():
+    filename = Path("/vault/Note.md")
+    whole = build.build_dir(filename, build.BuildOptions())
+    part = build.build_dir(filename, build.BuildOptions(section="Design"))
+    assert part.parent == whole.parent
+    assert part.name.startswith("Note_-_Design-")
+    assert part.name != whole.name
+
+
+def test_fragment_dir_is_shared_between_jobs():
+    filename = Path("/vault/Note.md")
+    options = build.BuildOptions(job_id="1", scratch_dir=Path("/scratch"))
+    result = build.fragment_dir(filename, options)
+    assert result == build.build_dir(filename, build.BuildOptions()) / (
+        "fragments"
+    )
+
+
+def test_fragment_dir_with_cache():
+    options = build.BuildOptions(cache_dir=Path("/cache"))
+    result = build.fragment_dir(Path("/vault/Note.md"), options)
+    assert result == Path("/cache/fragments")
+
+
+def test_prune_builds(tmp_path):
+    for i, name in enumerate(["old", "middle", "new"]):
+        (tmp_path / name).mkdir()
+        os.utime(tmp_path / name, (i, i))
+    (tmp_path / "body.tex").write_text("", encoding="UTF-8")
+    for name in ["fragments", "assets"]:
+        (tmp_path / name).mkdir()
+        os.utime(tmp_path / name, (0, 0))
+
+    removed = build.prune_builds(tmp_path, 2)
+
+    assert removed == [tmp_path / "old"]
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "assets",
+        "body.tex",
+        "fragments",
+        "middle",
+        "new",
+    ]
+    assert not build.prune_builds(tmp_path / "missing", 1)
+
+
+def test_prune_builds_keeps_running_jobs(tmp_path):
+    # Another build of the document is still using its job directory
+    running = cache.Locks([tmp_path / "running"], shared=True)
+    assert running.try_acquire()
+    for i, name in enumerate(["running", "finished", "new"]):
+        (tmp_path / name).mkdir(exist_ok=True)
+        os.utime(tmp_path / name, (i, i))
+    try:
+        removed = build.prune_builds(tmp_path, 1)
+    finally:
+        running.release()
+
+    assert removed == [tmp_path / "finished"]
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["new", "running"]
+
+
+locked_dirs_params = [
+    ({}, ["/vault/temp"]),
+    ({"job_id": "7"}, ["/vault/temp", "/vault/temp/Note-{digest}/7"]),
+]
+
+
+@pytest.mark.parametrize("options, expected", locked_dirs_params)
+def test_locked_dirs(options, expected):
+    filename = Path("/vault/Note.md")
+    options = build.BuildOptions(**options)
+    digest = build.build_dir(filename, build.BuildOptions()).name[-8:]
+    assert build.locked_dirs(filename, options) == [
+        Path(e.format(digest=digest)) for e in expected
+    ]
+
+
+def test_copy_atomic(tmp_path):
+    source = tmp_path / "source.pdf"
+    source.write_bytes(b"pdf")
+    destination = tmp_path / "out/result.pdf"
+    destination.parent.mkdir()
+
+    build.copy_atomic(source, destination)
+
+    assert destination.read_bytes() == b"pdf"
+    assert list(destination.parent.iterdir()) == [destination]
+    with pytest.raises(FileNotFoundError):
+        build.copy_atomic(tmp_path / "missing.pdf", destination)
+    assert list(destination.parent.iterdir()) == [destination]
+
+
+def test_asset_dir_persists_next_to_document():
+    filename = Path("/vault/notes/Widget.md")
+    assert build.asset_dir(filename, build.BuildOptions()) is None
+
+    options = build.BuildOptions(scratch_dir=Path("/dev/shm/o2l"))
+    scratch = build.build_dir(filename, options)
+    assets = build.asset_dir(filename, options)
+
+    assert scratch.parent == Path("/dev/shm/o2l")
+    assert assets.parent == build.build_dir(filename, build.BuildOptions())
+    assert assets.parent.name == scratch.name
+
+
+def test_ram_dir():
+    result = build.ram_dir()
+    assert result.name == "obsidian_to_latex"
+    assert result.parent.is_dir()
+
+
+def test_ram_dir_falls_back_to_temp_dir():
+    with mock.patch("os.access", return_value=False):
+        result = build.ram_dir()
+    assert result == Path(tempfile.gettempdir()) / "obsidian_to_latex"
+
+
+@pytest.fixture(name="vault")
+def vault_fixture(write_vault):
+    return write_vault(
+        {
+            "notes/Root.md": "# Root\n![[Hello]]\n![[foo.png]]\n![[Missing]]\n",
+            "notes/Hello.md": "# Hello\n",
+            "images/foo.png": b"png",
+            "template.tex": "",
+        },
+        current=True,
+    )
+
+
+def change_embed(vault):
+    (vault / "notes/Hello.md").write_text("# Hello\nworld\n", encoding="UTF-8")
+
+
+def change_image(vault):
+    (vault / "images/foo.png").write_bytes(b"png!")
+
+
+def add_missing_embed(vault):
+    (vault / "notes/Missing.md").write_text("", encoding="UTF-8")
+
+
+cache_key_changes_params = [
+    (change_embed, {}),
+    (change_image, {}),
+    (add_missing_embed, {}),
+    (None, {"external_code_lines": 10}),
+    (None, {"template": "template.tex"}),
+    (None, {"source_date_epoch": 0}),
+]
+
+
+@pytest.mark.parametrize("change, options", cache_key_changes_params)
+def test_cache_key_changes_with_inputs(vault, change, options):
+    filename = vault / "notes/Root.md"
+    before = build.cache_key(filename, build.BuildOptions())
+    if change:
+        change(vault)
+        # As opening the vault for the next build does
+        obsidian_path.VAULT.refresh()
+    if "template" in options:
+        options["template"] = vault / options["template"]
+    after = build.cache_key(filename, build.BuildOptions(**options))
+    assert before != after
+
+
+def test_cache_key_ignores_build_location(vault, tmp_path_factory):
+    filename = vault / "notes/Root.md"
+    before = build.cache_key(filename, build.BuildOptions())
+    options = build.BuildOptions(
+        build_root=tmp_path_factory.mktemp("builds"),
+        job_id="42",
+        keep_builds=1,
+        prefetch_workers=1,
+        cache_dir=tmp_path_factory.mktemp("cache"),
+    )
+    assert build.cache_key(filename, options) == before
+
+
+def test_cache_key_is_independent_of_vault_location(vault, tmp_path_factory):
+    before = build.cache_key(vault / "notes/Root.md", build.BuildOptions())
+    moved = tmp_path_factory.mktemp("elsewhere") / "vault"
+    shutil.copytree(vault, moved)
+    obsidian_path.VAULT = obsidian_path.Vault(moved)
+    after = build.cache_key(moved / "notes/Root.md", build.BuildOptions())
+    assert before == after
+
+
+def test_vault_path_outside_vault(vault):
+    assert build.vault_path(vault / "notes/Root.md") == "notes/Root.md"
+    outside = vault.parent / "template.tex"
+    assert build.vault_path(outside) == obsidian_path.format_path(outside)
+
+
+def commit(repo, when, paths=("-A",)):
+    git = ["git", "-c", "user.name=A", "-c", "user.email=a@example.com"]
+    env = {
+        **os.environ,
+        "GIT_AUTHOR_DATE": f"@{when} +0000",
+        "GIT_COMMITTER_DATE": f"@{when} +0000",
+    }
+    subprocess.run([*git, "add", *paths], cwd=repo, check=True)
+    subprocess.run(
+        [*git, "commit", "-qm", "notes"], cwd=repo, env=env, check=True
+    )
+
+
+def test_source_date_epoch_follows_last_commit(vault):
+    filename = vault / "notes/Root.md"
+    subprocess.run(["git", "init", "-q"], cwd=vault, check=True)
+    commit(vault, 1000)
+    os.utime(filename, (5000, 5000))
+    assert build.source_date_epoch(filename, build.BuildOptions()) == 1000
+
+    change_embed(vault)
+    commit(vault, 2000)
+    assert build.source_date_epoch(filename, build.BuildOptions()) == 2000
+    options = build.BuildOptions(source_date_epoch=5)
+    assert build.source_date_epoch(filename, options) == 5
+
+
+def test_source_date_epoch_without_commits(vault):
+    filename = vault / "notes/Root.md"
+    options = build.BuildOptions()
+    expected = build.DEFAULT_SOURCE_DATE_EPOCH
+    assert build.source_date_epoch(filename, options) == expected
+    # A repository without commits, or one the notes are not committed in
+    subprocess.run(["git", "init", "-q"], cwd=vault, check=True)
+    assert build.source_date_epoch(filename, options) == expected
+    (vault / "other").write_text("", encoding="UTF-8")
+    commit(vault, 1000, ["other"])
+    assert build.source_date_epoch(filename, options) == expected
+
+
+def test_last_commit_time_without_git(tmp_path):
+    assert build.last_commit_time([]) is None
+    with mock.patch("subprocess.run", side_effect=OSError):
+        assert build.last_commit_time([tmp_path / "Note.md"]) is None
+
+
+def test_cache_key_changes_with_commit_time(vault):
+    filename = vault / "notes/Root.md"
+    with mock.patch.object(build, "last_commit_time", return_value=1000):
+        before = build.cache_key(filename, build.BuildOptions())
+    with mock.patch.object(build, "last_commit_time", return_value=2000):
+        assert build.cache_key(filename, build.BuildOptions()) != before
+
+
+def test_latex_env(monkeypatch):
+    monkeypatch.setenv("FORCE_SOURCE_DATE", "1")
+    env = build.latex_env(1234)
+    assert env["SOURCE_DATE_EPOCH"] == "1234"
+    assert "FORCE_SOURCE_DATE" not in env
+    assert env["PATH"] == os.environ["PATH"]
+    assert build.latex_env(1234, force=True)["FORCE_SOURCE_DATE"] == "1"
+
+
+title_date_params = [
+    ({}, time.strftime("%Y-%m-%d", time.gmtime())),
+    ({"source_date_epoch": 86400}, "1970-01-02"),
+]
+
+
+@pytest.mark.usefixtures("fake_tools")
+@pytest.mark.parametrize("options, expected", title_date_params)
+def test_title_date(diagram_vault, options, expected):
+    filename = diagram_vault / "Root.md"
+    pdf = build.build_pdf(filename, build.BuildOptions(**options))
+    assert f"date {expected}" in pdf.read_text(encoding="UTF-8")
+
+
+first_difference_params = [
+    (b"", b"", None),
+    (b"pdf", b"pdf", None),
+    (b"pdf1", b"pdf2", 3),
+    (b"pdf", b"pdf2", 3),
+    (b"xpdf", b"pdf", 0),
+]
+
+
+@pytest.mark.parametrize("first, second, expected", first_difference_params)
+def test_first_difference(first, second, expected):
+    assert build.first_difference(first, second) == expected
+
+
+add_class_option_params = [
+    ("\\documentclass{article}\n", "\\documentclass[draft]{article}\n"),
+    (
+        "\\documentclass[11pt, a4paper]{article}",
+        "\\documentclass[11pt, a4paper,draft]{article}",
+    ),
+    ("\\documentclass[]{report}", "\\documentclass[draft]{report}"),
+    ("no class", "no class"),
+]
+
+
+@pytest.mark.parametrize("wrapper_text, expected", add_class_option_params)
+def test_add_class_option(wrapper_text, expected):
+    assert build.add_class_option(wrapper_text, "draft") == expected
+
+
+def test_latex_commands():
+    wrapper = Path("/build/document.tex")
+    assert build.latexmk_command(wrapper)[-1] == wrapper
+    assert build.latexmk_command(wrapper)[0] == "latexmk"
+    assert build.pdflatex_command(wrapper)[0] == "pdflatex"
+    # pdflatex runs in the build folder, so it is given the name alone
+    assert build.pdflatex_command(wrapper)[-1] == "document.tex"
+    assert "-file-line-error" in build.pdflatex_command(wrapper)
+
+
+cache_roots_params = [
+    ({}, ["/vault/temp"]),
+    ({"build_root": "/builds"}, ["/builds"]),
+    ({"scratch_dir": "/dev/shm/x"}, ["/dev/shm/x", "/vault/temp"]),
+    ({"cache_dir": "/cache"}, ["/cache", "/vault/temp"]),
+]
+
+
+@pytest.mark.parametrize("options, expected", cache_roots_params)
+def test_cache_roots(options, expected):
+    roots = build.cache_roots(
+        Path("/vault/Note.md"), build.BuildOptions(**options)
+    )
+    assert roots == [Path(r) for r in expected]
+
+
+@pytest.fixture(name="diagram_vault")
+def diagram_vault_fixture(write_vault):
+    return write_vault(
+        {
+            ".obsidian/app.json": "{}",
+            "Root.md": "# Root\n![[B]]\n",
+            "B.md": "```mermaid\ngraph\n```\n",
+        }
+    )
+
+
+def test_cached_fragments_bring_their_assets(diagram_vault):
+    filename = diagram_vault / "Root.md"
+    first = build.BuildOptions(job_id="1")
+    _title, latex = build.convert_file(filename, first, defer_diagrams=True)
+    [diagram] = process_markdown.STATE.pending_diagrams
+    # Render the diagram, as a build would
+    diagram.with_suffix(".pdf").write_bytes(b"pdf")
+
+    second = build.BuildOptions(job_id="2")
+    _title, reused = build.convert_file(filename, second, defer_diagrams=True)
+
+    assert reused == latex
+    assert f"{{{diagram.stem}}}" in reused
+    assert process_markdown.STATE.pending_diagrams == []
+    second_dir = build.build_dir(filename, second)
+    assert sorted(p.name for p in second_dir.glob("diagram_*")) == [
+        diagram.name,
+        diagram.with_suffix(".pdf").name,
+    ]
+
+
+@pytest.mark.usefixtures("fake_tools")
+def test_verify_reproducible(diagram_vault):
+    filename = diagram_vault / "Root.md"
+    options = build.BuildOptions(source_date_epoch=1000)
+    assert build.verify_reproducible(filename, options) is None
+
+
+@pytest.mark.usefixtures("fake_tools")
+def test_verify_reproducible_reports_difference(diagram_vault, monkeypatch):
+    monkeypatch.setattr(build, "EMPTY_TRAILER_ID", "")
+    filename = diagram_vault / "Root.md"
+
+    difference = build.verify_reproducible(filename, build.BuildOptions())
+
+    assert difference.startswith("`Root.pdf` differs between builds from")
+
+
+@pytest.fixture(name="metrics_reset")
+def metrics_reset_fixture(monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS", metrics.Metrics())
+    return metrics.METRICS
+
+
+@pytest.mark.usefixtures("fake_tools")
+def test_build_pdf(diagram_vault, metrics_reset):
+    filename = diagram_vault / "Root.md"
+    pdf = build.build_pdf(filename, build.BuildOptions())
+
+    assert pdf == diagram_vault / "output/Root.pdf"
+    temp_dir = build.build_dir(filename, build.BuildOptions())
+    assert pdf.read_text(encoding="UTF-8").startswith("%PDF-fake")
+    assert list(temp_dir.glob("diagram_*.pdf"))
+    assert (temp_dir / build.SOURCE_MAP).exists()
+    assert metrics_reset.snapshot()["counters"]["builds_total"] == 1
+
+
+@pytest.mark.usefixtures("fake_tools")
+def test_build_pdf_to_given_file(diagram_vault, tmp_path_factory):
+    out_pdf = tmp_path_factory.mktemp("out") / "document.pdf"
+
+    pdf = build.build_pdf(
+        diagram_vault / "Root.md", build.BuildOptions(), out_pdf
+    )
+
+    assert pdf == out_pdf
+    assert out_pdf.read_text(encoding="UTF-8").startswith("%PDF-fake")
+    assert not (diagram_vault / "output/Root.pdf").exists()
+
+
+@pytest.mark.usefixtures("fake_tools")
+def test_build_pdf_draft(diagram_vault):
+    filename = diagram_vault / "Root.md"
+    options = build.BuildOptions(draft=True)
+
+    build.build_pdf(filename, options)
+
+    # Drafts leave out diagrams that are not rendered yet
+    temp_dir = build.build_dir(filename, options)
+    assert not list(temp_dir.glob("diagram_*.pdf"))
+    wrapper = temp_dir / build.DEFAULT_TEMPLATE.name
+    assert "\\documentclass[draft]" in wrapper.read_text(encoding="UTF-8")
+
+
+@pytest.mark.usefixtures("fake_tools")
+def test_build_pdf_reuses_cached_pdf(diagram_vault, metrics_reset, tmp_path):
+    filename = diagram_vault / "Root.md"
+    options = build.BuildOptions(cache_dir=tmp_path / "cache")
+    pdf = build.build_pdf(filename, options)
+    built = pdf.read_bytes()
+    pdf.unlink()
+
+    assert build.build_pdf(filename, options).read_bytes() == built
+    counters = metrics_reset.snapshot()["counters"]
+    assert counters["pdf_cache_misses_total"] == 1
+    assert counters["pdf_cache_hits_total"] == 1
+
+
+@pytest.mark.usefixtures("fake_tools")
+def test_build_pdf_prunes_old_jobs(diagram_vault):
+    filename = diagram_vault / "Root.md"
+    for job_id in ["1", "2", "3"]:
+        options = build.BuildOptions(job_id=job_id, keep_builds=1)
+        build.build_pdf(filename, options)
+    document_dir = build.build_dir(filename, build.BuildOptions())
+    assert sorted(p.name for p in document_dir.iterdir()) == [
+        "3",
+        "fragments",
+    ]
+
+
+@pytest.mark.usefixtures("fake_tools")
+def test_build_pdf_reports_latex_errors(diagram_vault, metrics_reset):
+    filename = diagram_vault / "Root.md"
+    filename.write_text("latex-error\n![[B]]\n", encoding="UTF-8")
+
+    with pytest.raises(build.LatexError) as e:
+        build.build_pdf(filename, build.BuildOptions())
+
+    assert str(e.value) == (
+        "Root.md:1: Undefined control sequence. (body.tex:1)"
+    )
+    assert metrics_reset.snapshot()["counters"]["failures_total"] == 1
+
+
+@pytest.mark.usefixtures("fake_tools")
+def test_convert_file(diagram_vault):
+    filename = diagram_vault / "Root.md"
+    (diagram_vault / "Root.md").write_text(
+        "# Root\n![[B]]\n![[B]]\n", encoding="UTF-8"
+    )
+    options = build.BuildOptions(dedupe_embeds=True)
+
+    title, latex = build.convert_file(filename, options)
+
+    assert title == "Root"
+    assert latex.count("\\label{file_B_md}") == 1
+    assert "\\hyperref[file_B_md]{B}" in latex
+    # Diagrams are rendered straight away unless deferred
+    [diagram] = build.build_dir(filename, options).glob("diagram_*.pdf")
+    os.utime(diagram, (0, 0))
+    # Deduplicated documents convert embeds afresh, keeping the unchanged
+    # diagram and marking it as used
+    build.convert_file(filename, options)
+    assert diagram.stat().st_mtime > 0
+    assert build.convert_file(filename, options, "other")[1] == "other"
+
+
+def test_write_tex(tmp_path, caplog):
+    caplog.set_level(logging.INFO)
+    wrapper = build.write_tex(None, False, tmp_path, "Title", "a\nb\nc")
+    assert wrapper == tmp_path / build.DEFAULT_TEMPLATE.name
+    assert not caplog.records
+
+    build.write_tex(None, False, tmp_path, "Title", "a\nb\nc")
+    assert not caplog.records
+
+    build.write_tex(None, False, tmp_path, "Title", "a\nB\nc")
+    assert caplog.messages == ["Changed body.tex lines 2-2"]
+    assert (tmp_path / build.BODY).read_text(encoding="UTF-8") == "a\nB\nc"
+
+
+def test_write_tex_logs_notes_of_changed_lines(tmp_path, caplog):
+    caplog.set_level(logging.INFO)
+    note = tmp_path / "Note.md"
+    sources = [(note, 1), (note, 2), (note, 3)]
+    build.write_tex(None, False, tmp_path, "T", "a\nb\nc", sources)
+
+    build.write_tex(None, False, tmp_path, "T", "a\nB\nc", sources)
+    build.write_tex(None, False, tmp_path, "T", "a\nB\nc\nd", sources)
+
+    note_name = obsidian_path.format_path(note)
+    assert caplog.messages == [
+        f"Changed body.tex lines 2-2, from {note_name}:2 to {note_name}:2",
+        # The map does not reach the new line
+        "Changed body.tex lines 4-4",
+    ]
+
+
+write_wrapper_params = [
+    (False, "\\documentclass{article}"),
+    (True, "\\documentclass[draft]{article}"),
+]
+
+
+@pytest.mark.parametrize("draft, expected", write_wrapper_params)
+def test_write_wrapper(tmp_path, draft, expected):
+    template = tmp_path / "report.tex"
+    template.write_text(
+        "\\documentclass{article}\n\\title{TheTitleOfTheDocument}\n",
+        encoding="UTF-8",
+    )
+    (tmp_path / "build").mkdir()
+
+    wrapper = build.write_wrapper(template, tmp_path / "build", "Hi", draft)
+
+    assert wrapper == tmp_path / "build/report.tex"
+    assert wrapper.read_text(encoding="UTF-8") == (
+        f"{build.EMPTY_TRAILER_ID}{expected}\n\\title{{Hi}}\n"
+    )
+
+
+def test_compiled_pdf(tmp_path):
+    wrapper = tmp_path / "document.tex"
+    with pytest.raises(FileNotFoundError, match="Failed to create PDF"):
+        build.compiled_pdf(wrapper)
+
+    wrapper.with_suffix(".pdf").write_bytes(b"pdf")
+    assert build.compiled_pdf(wrapper) == wrapper.with_suffix(".pdf")
+
+    # Without a source map, errors keep pointing at the TeX
+    wrapper.with_suffix(".log").write_text(
+        "./body.tex:3: Missing $ inserted.\n", encoding="UTF-8"
+    )
+    with pytest.raises(build.LatexError, match=r"^./body.tex:3: Missing"):
+        build.compiled_pdf(wrapper)
+
+
+def test_check_links(diagram_vault):
+    filename = diagram_vault / "Root.md"
+    filename.write_text("![[B]]\n![[Missing]]\n", encoding="UTF-8")
+
+    problems = build.check_links(filename, build.BuildOptions())
+
+    assert [(p.line, p.target) for p in problems] == [(2, "Missing.md")]
+
+
+def test_get_vault_root(tmp_path):
+    (tmp_path / "vault/.obsidian").mkdir(parents=True)
+    (tmp_path / "vault/notes").mkdir()
+    (tmp_path / "repo/.git").mkdir(parents=True)
+    archive = tmp_path / "vault.zip"
+    with zipfile.ZipFile(archive, "w"):
+        pass
+
+    assert build.get_vault_root(tmp_path / "vault/notes") == tmp_path / "vault"
+    assert build.get_vault_root(tmp_path / "repo") == tmp_path / "repo"
+    assert build.get_vault_root(archive) == archive
+    with pytest.raises(FileNotFoundError, match="Unable to locate"):
+        build.get_vault_root(tmp_path / "elsewhere")
+
+
+def test_get_title():
+    assert build.get_title("## The Title\ntext") == "The Title"
+    assert build.get_title("text") == "text"
+
+
+def test_convert_file_from_memory(tmp_path, monkeypatch):
+    monkeypatch.setattr(obsidian_path, "VAULTS", obsidian_path.VaultCache())
+    monkeypatch.setattr(obsidian_path, "VAULT", None)
+    monkeypatch.setattr(process_markdown, "STATE", process_markdown.STATE)
+    root = tmp_path / "memory"
+    files = {"Root.md": "# Root\n![[Hello]]\n", "notes/Hello.md": "Hi\n"}
+    obsidian_path.VAULTS.open(root, store=storage.MemoryStorage(root, files))
+
+    title, latex = build.convert_file(root / "Root.md", build.BuildOptions())
+
+    assert title == "Root"
+    assert "Hi" in latex
+    assert obsidian_path.VAULT.root == root
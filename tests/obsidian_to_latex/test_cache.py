@@ -0,0 +1,375 @@
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from unittest import mock
+
+import pytest
+
+from obsidian_to_latex import cache
+
+
+def test_get_missing_entry(tmp_path):
+    content_cache = cache.ContentCache(tmp_path)
+    assert content_cache.get("abcdef", "document.pdf") is None
+
+
+def test_put_then_get(tmp_path):
+    source = tmp_path / "document.pdf"
+    source.write_bytes(b"pdf")
+    content_cache = cache.ContentCache(tmp_path / "cache")
+
+    entry = content_cache.put("abcdef", {"document.pdf": source})
+    os.utime(entry, (0, 0))
+
+    assert entry == tmp_path / "cache/ab/cdef"
+    result = content_cache.get("abcdef", "document.pdf")
+    assert result.read_bytes() == b"pdf"
+    assert entry.stat().st_mtime > 0
+    assert content_cache.get("abcdef", "body.tex") is None
+    assert [p.name for p in entry.parent.iterdir()] == ["cdef"]
+
+
+def test_first_writer_wins(tmp_path):
+    first = tmp_path / "first.pdf"
+    first.write_bytes(b"first")
+    second = tmp_path / "second.pdf"
+    second.write_bytes(b"second")
+    content_cache = cache.ContentCache(tmp_path / "cache")
+
+    content_cache.put("abcdef", {"document.pdf": first})
+    content_cache.put("abcdef", {"document.pdf": second})
+
+    result = content_cache.get("abcdef", "document.pdf")
+    assert result.read_bytes() == b"first"
+
+
+def test_concurrent_writer_wins(tmp_path):
+    second = tmp_path / "second.pdf"
+    second.write_bytes(b"second")
+    content_cache = cache.ContentCache(tmp_path / "cache")
+    real_rename = os.rename
+
+    def rename_after_other_writer(source, destination):
+        destination.mkdir()
+        (destination / "document.pdf").write_bytes(b"first")
+        real_rename(source, destination)
+
+    with mock.patch("os.rename", side_effect=rename_after_other_writer):
+        content_cache.put("abcdef", {"document.pdf": second})
+
+    result = content_cache.get("abcdef", "document.pdf")
+    assert result.read_bytes() == b"first"
+    assert [p.name for p in result.parent.parent.iterdir()] == ["cdef"]
+
+
+def test_failed_put_leaves_no_entry(tmp_path):
+    content_cache = cache.ContentCache(tmp_path / "cache")
+    with pytest.raises(FileNotFoundError):
+        content_cache.put("abcdef", {"document.pdf": tmp_path / "missing"})
+    assert not list((tmp_path / "cache/ab").iterdir())
+
+
+# Entries are last used this many seconds after T0
+T0 = int(time.time()) - 7000
+
+
+def write(path, size, used):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"x" * size)
+    os.utime(path, (T0 + used, T0 + used))
+    for parent in path.parents:
+        if parent.name in ["cdef", ".partial-1"]:
+            os.utime(parent, (T0 + used, T0 + used))
+
+
+@pytest.fixture(name="caches")
+def caches_fixture(tmp_path):
+    """A `--cache-dir` and a `temp` directory of document builds, with
+    every kind of entry."""
+    shared = tmp_path / "shared"
+    temp = tmp_path / "temp"
+    write(shared / "ab/cdef/document.pdf", 100, 1000)
+    write(shared / "ab/.partial-1/document.pdf", 5, 5000)
+    write(shared / "fragments/12/3456.json", 10, 2000)
+    write(shared / ".lock", 0, 0)
+    document = temp / "Root-0123abcd"
+    write(document / "diagram_0123456789abcdef.mmd", 1, 3000)
+    write(document / "diagram_0123456789abcdef.pdf", 20, 3500)
+    write(document / "body.tex", 30, 4000)
+    write(document / "document.log", 40, 4500)
+    write(document / "assets/listing_0123456789abcdef.py", 2, 1500)
+    write(document / "assets/image_0123456789abcdef.png", 3, 6000)
+    write(document / "fragments/ff/0000.json", 4, 500)
+    write(document / "job-1/body.tex", 50, 7000)
+    write(temp / "unrelated/file.txt", 1, 0)
+    return shared, temp
+
+
+def summary(entries):
+    return sorted(
+        (e.kind, sorted(str(p) for p in e.paths), e.size, e.used)
+        for e in entries
+    )
+
+
+def test_scan(caches):
+    shared, temp = caches
+    document = temp / "Root-0123abcd"
+    entries = cache.scan(shared) + cache.scan(temp)
+
+    assert summary(entries) == summary(
+        [
+            cache.Entry(
+                "build",
+                [document / "body.tex", document / "document.log"],
+                70,
+                T0 + 4500,
+            ),
+            cache.Entry("build", [document / "job-1/body.tex"], 50, T0 + 7000),
+            cache.Entry(
+                "diagram",
+                [
+                    document / "diagram_0123456789abcdef.mmd",
+                    document / "diagram_0123456789abcdef.pdf",
+                ],
+                21,
+                T0 + 3500,
+            ),
+            cache.Entry(
+                "fragment", [shared / "fragments/12/3456.json"], 10, T0 + 2000
+            ),
+            cache.Entry(
+                "fragment", [document / "fragments/ff/0000.json"], 4, T0 + 500
+            ),
+            cache.Entry(
+                "image",
+                [document / "assets/image_0123456789abcdef.png"],
+                3,
+                T0 + 6000,
+            ),
+            cache.Entry(
+                "listing",
+                [document / "assets/listing_0123456789abcdef.py"],
+                2,
+                T0 + 1500,
+            ),
+            cache.Entry("partial", [shared / "ab/.partial-1"], 5, T0 + 5000),
+            cache.Entry("pdf", [shared / "ab/cdef"], 100, T0 + 1000),
+        ]
+    )
+    assert not cache.scan(temp / "missing")
+    assert not cache.scan(temp / "unrelated/file.txt")
+
+
+def test_scan_skips_what_builds_remove_meanwhile(caches):
+    _shared, temp = caches
+    document = temp / "Root-0123abcd"
+    real_iterdir = Path.iterdir
+
+    def iterdir_then_build(path):
+        children = list(real_iterdir(path))
+        if path == document:
+            shutil.rmtree(document / "job-1")
+            shutil.rmtree(document / "fragments")
+            (document / "document.log").unlink()
+        return iter(children)
+
+    with mock.patch.object(Path, "iterdir", iterdir_then_build):
+        entries = cache.scan(temp)
+
+    assert cache.stats(entries)["build"] == (1, 30, T0 + 4000)
+    assert "fragment" not in cache.stats(entries)
+
+
+collect_params = [
+    (None, None, ["partial"]),
+    (None, 5000, ["fragment", "pdf", "listing", "partial"]),
+    (
+        80,
+        None,
+        [
+            "partial",
+            "fragment",
+            "pdf",
+            "listing",
+            "fragment",
+            "diagram",
+            "build",
+        ],
+    ),
+    (
+        0,
+        None,
+        [
+            "partial",
+            *["fragment", "pdf", "listing", "fragment", "diagram", "build"],
+            *["image", "build"],
+        ],
+    ),
+]
+
+
+@pytest.mark.parametrize("max_size, max_age, expected", collect_params)
+def test_collect(caches, max_size, max_age, expected):
+    entries = [e for root in caches for e in cache.scan(root)]
+    removed = cache.collect(entries, max_size, max_age, now=T0 + 7000)
+    assert [e.kind for e in removed] == expected
+
+
+def test_stats(caches):
+    entries = [e for root in caches for e in cache.scan(root)]
+    assert cache.stats(entries) == {
+        "pdf": (1, 100, T0 + 1000),
+        "fragment": (2, 14, T0 + 500),
+        "diagram": (1, 21, T0 + 3500),
+        "listing": (1, 2, T0 + 1500),
+        "image": (1, 3, T0 + 6000),
+        "build": (2, 120, T0 + 4500),
+        "partial": (1, 5, T0 + 5000),
+    }
+
+
+def test_gc(caches):
+    shared, temp = caches
+    roots = [shared, temp]
+
+    assert len(cache.gc(roots, max_size=0, dry_run=True)) == 9
+    assert len(cache.scan(shared) + cache.scan(temp)) == 9
+
+    removed = cache.gc(roots, max_age=3000)
+
+    assert [e.kind for e in removed] == [
+        *["fragment", "pdf", "listing", "fragment", "diagram", "partial"]
+    ]
+    assert not (shared / "ab").exists()
+    assert (shared / ".lock").exists()
+    assert not (shared / "fragments").exists()
+    assert not (temp / "Root-0123abcd/fragments").exists()
+    assert (temp / "unrelated/file.txt").exists()
+    assert [e.kind for e in cache.scan(shared) + cache.scan(temp)] == [
+        "build",
+        "image",
+        "build",
+    ]
+
+
+def test_clear(caches):
+    shared, temp = caches
+    removed = cache.clear([shared, temp])
+    assert len(removed) == 9
+    assert not cache.scan(shared) + cache.scan(temp)
+    assert sorted(p.name for p in temp.iterdir()) == [".lock", "unrelated"]
+
+
+def test_locks_exclude_gc_while_builds_run(tmp_path):
+    build_lock = cache.Locks([tmp_path / "a", tmp_path / "b"], shared=True)
+    other_build = cache.Locks([tmp_path / "b"], shared=True)
+    assert build_lock.try_acquire()
+    assert other_build.try_acquire()
+    gc_lock = cache.Locks([tmp_path / "b", tmp_path / "a"], shared=False)
+    assert not gc_lock.try_acquire()
+
+    build_lock.release()
+    assert not gc_lock.try_acquire()
+    other_build.release()
+    assert gc_lock.try_acquire()
+    assert not cache.Locks([tmp_path / "a"], shared=True).try_acquire()
+    gc_lock.release()
+
+
+def test_locked_times_out(tmp_path):
+    build_lock = cache.Locks([tmp_path], shared=True)
+    assert build_lock.try_acquire()
+    try:
+        with pytest.raises(TimeoutError):
+            with cache.locked([tmp_path], shared=False, timeout=0.2):
+                pass  # pragma: no cover
+        with cache.locked([tmp_path], shared=True, timeout=0):
+            pass
+    finally:
+        build_lock.release()
+
+
+def test_locked_waits_for_release(tmp_path):
+    build_lock = cache.Locks([tmp_path], shared=True)
+    assert build_lock.try_acquire()
+    timer = threading.Timer(0.3, build_lock.release)
+    timer.start()
+    start = time.monotonic()
+    with cache.locked([tmp_path], shared=False):
+        assert time.monotonic() - start >= 0.2
+    timer.join()
+
+
+parse_size_params = [
+    ("100", 100),
+    ("2k", 2048),
+    ("500M", 500 * 2**20),
+    ("1.5GiB", int(1.5 * 2**30)),
+    ("1 TB", 2**40),
+]
+
+
+@pytest.mark.parametrize("text, expected", parse_size_params)
+def test_parse_size(text, expected):
+    assert cache.parse_size(text) == expected
+
+
+format_size_params = [
+    (0, "0 B"),
+    (1023, "1023 B"),
+    (1024, "1.0 KiB"),
+    (5 * 2**20, "5.0 MiB"),
+    (3 * 2**30, "3.0 GiB"),
+    (2 * 2**40, "2.0 TiB"),
+]
+
+
+@pytest.mark.parametrize("size, expected", format_size_params)
+def test_format_size(size, expected):
+    assert cache.format_size(size) == expected
+
+
+parse_duration_params = [
+    ("90", 90),
+    ("30s", 30),
+    ("5m", 300),
+    ("12h", 43200),
+    ("1.5d", 129600),
+    ("2w", 1209600),
+]
+
+
+@pytest.mark.parametrize("text, expected", parse_duration_params)
+def test_parse_duration(text, expected):
+    assert cache.parse_duration(text) == expected
+
+
+@pytest.mark.parametrize("parse", [cache.parse_size, cache.parse_duration])
+def test_parse_invalid(parse):
+    with pytest.raises(ValueError):
+        parse("12x")
+
+
+def test_scan_document_without_build(tmp_path):
+    document = tmp_path / "Root-0123abcd"
+    write(document / ".lock", 0, 0)
+    write(document / "fragments/stray.txt", 0, 0)
+    write(document / "fragments/ff/0000.json", 4, 500)
+
+    entries = cache.scan(tmp_path)
+
+    assert [(e.kind, e.paths) for e in entries] == [
+        ("fragment", [document / "fragments/ff/0000.json"])
+    ]
+    assert list(cache.stats(entries)) == ["fragment"]
+
+
+def test_scan_keeps_unknown_assets_with_the_build(tmp_path):
+    document = tmp_path / "Root-0123abcd"
+    write(document / "assets/.listing.part", 0, 0)
+    assert [(e.kind, e.paths) for e in cache.scan(tmp_path)] == [
+        ("build", [document / "assets/.listing.part"])
+    ]
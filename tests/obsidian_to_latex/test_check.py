@@ -0,0 +1,65 @@
+import pytest
+
+from obsidian_to_latex import check, obsidian_path
+
+targets_params = [
+    ("![[Child]]", [(1, "Child.md", True)]),
+    ("![[pic.png|300]]", [(1, "pic.png", True)]),
+    (
+        "see [[Child]] and [[Other|the other]]",
+        [(1, "Child.md", False), (1, "Other.md", False)],
+    ),
+    ("```\n![[Child]]\n[[Child]]\n```\n[[After]]", [(5, "After.md", False)]),
+    ("`[[Code]]` [[Text]]", [(1, "Text.md", False)]),
+    ("[[#^para|paragraph]] and ^para", []),
+]
+
+
+@pytest.mark.parametrize("text, expected", targets_params)
+def test_targets(text, expected):
+    assert list(check.targets(text)) == expected
+
+
+@pytest.fixture(name="vault")
+def vault_fixture(write_vault):
+    return write_vault(
+        {
+            "Root.md": (
+                "# Root\n![[Child]]\n![[Missing]]\nSee [[Gone]]\n![[Child]]\n"
+            ),
+            "Child.md": "![[Twin]]\n![[pic.png]]\n![[Root]]\n",
+            "a/Twin.md": "[[Child]] [[Lost]]\n",
+            "b/Twin.md": "![[Unreached]]\n",
+            "pic.png": b"png",
+        }
+    )
+
+
+def test_check_document(vault):
+    paths = obsidian_path.scan_vault(vault).paths
+
+    problems = check.check_document(vault / "Root.md", vault, paths)
+
+    assert [str(p) for p in problems] == [
+        "Root.md:3: `Missing.md` was not found",
+        "Root.md:4: `Gone.md` was not found",
+        "Child.md:1: `Twin.md` is ambiguous, it could be any of a/Twin.md,"
+        " b/Twin.md",
+        "a/Twin.md:1: `Lost.md` was not found",
+    ]
+
+
+def test_check_document_outside_vault(vault, tmp_path_factory):
+    other = tmp_path_factory.mktemp("other") / "Note.md"
+    other.write_text("[[Nowhere]]\n", encoding="UTF-8")
+
+    problems = check.check_document(other, vault, {})
+
+    assert problems == [
+        check.Problem(
+            file=obsidian_path.format_path(other),
+            line=1,
+            target="Nowhere.md",
+            message="was not found",
+        )
+    ]
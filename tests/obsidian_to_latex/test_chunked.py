@@ -0,0 +1,128 @@
+from unittest import mock
+
+import pytest
+
+from obsidian_to_latex import chunked, obsidian_path, process_markdown
+
+
+def chunk_starts(text, chunk_lines):
+    chunks = chunked.split_chunks(text.splitlines(), chunk_lines)
+    return [(c.start, c.depth) for c in chunks]
+
+
+split_chunks_params = [
+    ("a\n\nb\n\nc", 1, [(0, 1), (2, 1), (4, 1)]),
+    ("a\n\nb\n\nc", 3, [(0, 1), (4, 1)]),
+    ("a\nb\nc", 1, [(0, 1)]),
+    ("", 1, [(0, 1)]),
+    ("a\n\n", 1, [(0, 1)]),
+    ("```\na\n\nb\n```\n\nc", 1, [(0, 1), (6, 1)]),
+    ("```mermaid\n\n```\n\n", 1, [(0, 1)]),
+    ("# T\n## A\n\n### B\n\nc", 1, [(0, 1), (3, 2), (5, 3)]),
+    ("```\n# not\n```\n\nc", 1, [(0, 1), (4, 1)]),
+    ("- a\n  \n- b", 1, [(0, 1), (2, 1)]),
+]
+
+
+@pytest.mark.parametrize("text, chunk_lines, expected", split_chunks_params)
+def test_split_chunks(text, chunk_lines, expected):
+    assert chunk_starts(text, chunk_lines) == expected
+
+
+def test_split_chunks_keeps_every_line():
+    lines = "a\n\n- b\n- c\n\n```\nd\n\n```\n\ne".splitlines()
+    chunks = chunked.split_chunks(lines, 1)
+    assert [line for c in chunks for line in c.lines] == lines
+
+
+NOTE_SECTION = """\
+## Part {i}
+Some *text* with `code` and a [[Child]] link
+
+- a list
+    - nested
+1. numbered
+
+![[Child]]
+
+```python
+x = {i}
+
+y = x
+```
+
+```mermaid
+graph {i}
+```
+"""
+
+
+@pytest.fixture(name="vault")
+def vault_fixture(write_vault):
+    return write_vault(
+        {"Root.md": "", "Child.md": "# Child\n## Inside\nchild text\n"},
+        current=True,
+    )
+
+
+def fresh_state(vault):
+    process_markdown.STATE = process_markdown.State.new()
+    process_markdown.STATE.file.append(vault / "Root.md")
+    process_markdown.STATE.temp_dir = vault / "temp"
+    process_markdown.STATE.pending_diagrams = []
+    process_markdown.STATE.source_map = []
+    return process_markdown.STATE
+
+
+def test_convert_in_chunks_matches_serial(vault):
+    text = "# Root\n" + "\n".join(NOTE_SECTION.format(i=i) for i in range(8))
+
+    serial_state = fresh_state(vault)
+    serial = process_markdown.obsidian_to_tex(text)
+    chunked_state = fresh_state(vault)
+    result = chunked.convert(text, workers=2, min_lines=1, min_chunk_lines=40)
+
+    assert result == serial
+    assert chunked_state.pending_diagrams == serial_state.pending_diagrams
+    assert chunked_state.lines_read == serial_state.lines_read
+    assert chunked_state.output_size == serial_state.output_size
+    assert chunked_state.converted_map == serial_state.converted_map
+    assert len(chunked_state.converted_map) == result.count("\n") + 1
+
+
+serial_params = [
+    ({"min_lines": None}, {}),
+    ({"min_lines": 1000}, {}),
+    ({"workers": 1}, {}),
+    ({}, {"embedded": set()}),
+    ({"min_chunk_lines": 1000}, {}),
+]
+
+
+@pytest.mark.parametrize("arguments, state", serial_params)
+def test_convert_serially(vault, arguments, state):
+    fresh_state(vault)
+    for name, value in state.items():
+        setattr(process_markdown.STATE, name, value)
+    arguments = {
+        "workers": 2,
+        "min_lines": 1,
+        "min_chunk_lines": 1,
+        **arguments,
+    }
+    with mock.patch.object(
+        process_markdown, "obsidian_to_tex", return_value="serial"
+    ), mock.patch("concurrent.futures.ProcessPoolExecutor") as pool:
+        assert chunked.convert("a\n\nb\n", **arguments) == "serial"
+    pool.assert_not_called()
+
+
+def test_convert_outside_vault(vault):
+    obsidian_path.VAULT = None
+    state = fresh_state(vault)
+    state.pending_diagrams = None
+    state.source_map = None
+    result = chunked.convert(
+        "a\n\nb", workers=2, min_lines=1, min_chunk_lines=1
+    )
+    assert result == "a\n\nb"
@@ -0,0 +1,144 @@
+import math
+import random
+import time
+from pathlib import Path
+
+import pytest
+
+from obsidian_to_latex import process_markdown
+
+MOTIFS = [
+    "*",
+    "**",
+    "***",
+    "_",
+    "`",
+    "[",
+    "](",
+    ")",
+    "[[",
+    "]]",
+    "[#^",
+    "|",
+    "^",
+    "#",
+    "-",
+    "$",
+    "{",
+    "}",
+    " ",
+    "a",
+    "1.",
+]
+SIZES = [1000, 2000, 4000, 8000]
+MAX_SLOPE = 1.5
+
+
+def adversarial_motif(seed: int) -> str:
+    rng = random.Random(seed)
+    return "".join(rng.choice(MOTIFS) for _ in range(rng.randint(1, 4)))
+
+
+motif_params = [
+    "*",
+    "**",
+    "_",
+    "`_",
+    "*_",
+    "**a",
+    "a*",
+    "[",
+    "[a](",
+    "[[",
+    "[[#^a|",
+    "^",
+    *[adversarial_motif(seed) for seed in range(8)],
+]
+
+
+def paragraph_line(text: str) -> str:
+    # Keep generated lines from being read as embeds or code fences
+    return "a " + text
+
+
+def bullet_line(text: str) -> str:
+    return "- " + text
+
+
+def numbered_line(text: str) -> str:
+    return "1. " + text
+
+
+def heading_line(text: str) -> str:
+    return "## " + text
+
+
+def convert_string(text: str) -> str:
+    return process_markdown.string_to_tex(text)
+
+
+def convert_line(make_line):
+    def convert(text: str) -> str:
+        process_markdown.STATE = process_markdown.State.new()
+        process_markdown.STATE.file.append(Path("adversarial.md"))
+        return process_markdown.line_to_tex(1, make_line(text))
+
+    return convert
+
+
+converter_params = [
+    ("string_to_tex", convert_string),
+    ("paragraph", convert_line(paragraph_line)),
+    ("bullet list", convert_line(bullet_line)),
+    ("numbered list", convert_line(numbered_line)),
+    ("heading", convert_line(heading_line)),
+]
+
+
+def runtime(convert, text: str, repeats: int = 3) -> float:
+    best = math.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        convert(text)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def scaling_exponent(sizes, times) -> float:
+    """Slope of the least squares fit of log(time) against log(size)."""
+    xs = [math.log(s) for s in sizes]
+    ys = [math.log(max(t, 1e-9)) for t in times]
+    x_mean = sum(xs) / len(xs)
+    y_mean = sum(ys) / len(ys)
+    covariance = sum((x - x_mean) * (y - y_mean) for x, y in zip(xs, ys))
+    variance = sum((x - x_mean) ** 2 for x in xs)
+    return covariance / variance
+
+
+scaling_exponent_params = [
+    ([1, 2, 4], [3, 6, 12], 1.0),
+    ([1, 2, 4], [1, 4, 16], 2.0),
+    ([1, 2, 4], [5, 5, 5], 0.0),
+]
+
+
+@pytest.mark.parametrize("sizes, times, expected", scaling_exponent_params)
+def test_scaling_exponent(sizes, times, expected):
+    assert scaling_exponent(sizes, times) == pytest.approx(expected)
+
+
+@pytest.fixture(autouse=True)
+def setup_teardown():
+    process_markdown.STATE = process_markdown.State.new()
+    yield
+    process_markdown.STATE = process_markdown.State.new()
+
+
+@pytest.mark.parametrize("_name, convert", converter_params)
+@pytest.mark.parametrize("motif", motif_params)
+def test_conversion_scales_linearly(_name, convert, motif):
+    lines = [(motif * (size // len(motif) + 1))[:size] for size in SIZES]
+    convert(lines[0])  # warm up
+    times = [runtime(convert, line) for line in lines]
+    slope = scaling_exponent(SIZES, times)
+    assert slope < MAX_SLOPE, (motif, list(zip(SIZES, times)))
@@ -0,0 +1,36 @@
+import pytest
+
+from obsidian_to_latex import dependencies
+
+
+@pytest.fixture(name="vault")
+def vault_fixture(write_vault):
+    return write_vault(
+        {
+            "notes/Root.md": "# Root\n![[Hello]]\n![[foo.png]]\n![[Missing]]\n",
+            "notes/Hello.md": "# Hello\n![[World]]\n![[Root]]\n",
+            "notes/World.md": "# World\n![[foo.png]]\n![[Missing]]\n",
+            "images/foo.png": b"",
+        },
+        current=True,
+    )
+
+
+def test_embedded_files(vault):
+    result = dependencies.embedded_files(vault / "notes/Root.md")
+    assert result.files == [
+        vault / "notes/Root.md",
+        vault / "notes/Hello.md",
+        vault / "images/foo.png",
+        vault / "notes/World.md",
+    ]
+    assert result.missing == ["Missing.md"]
+
+
+def test_embedded_files_of_given_text(vault):
+    result = dependencies.embedded_files(vault / "notes/Root.md", "![[World]]")
+    assert result.files == [
+        vault / "notes/Root.md",
+        vault / "notes/World.md",
+        vault / "images/foo.png",
+    ]
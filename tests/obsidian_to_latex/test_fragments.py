@@ -0,0 +1,161 @@
+from pathlib import Path
+from unittest import mock
+
+import pytest
+
+from obsidian_to_latex import fragments, storage
+
+
+@pytest.fixture(name="vault")
+def vault_fixture(write_vault):
+    return write_vault(
+        {
+            "Note.md": "![[Child]]\n![[pic.png]]\n",
+            "Child.md": "child\n",
+            "pic.png": b"png",
+        },
+        current=True,
+    )
+
+
+def key(vault, version="1", text=None, depth=1, settings=None):
+    fragment_cache = fragments.FragmentCache(vault / "cache", version)
+    text = text or (vault / "Note.md").read_text(encoding="UTF-8")
+    return fragment_cache.key(vault / "Note.md", text, depth, settings or {})
+
+
+def test_key_reads_each_embed_once_per_build(vault):
+    (vault / "Other.md").write_text(
+        "![[Note]]\n![[Child]]\n", encoding="UTF-8"
+    )
+    fragment_cache = fragments.FragmentCache(vault / "cache", "1")
+    digests = {}
+    with mock.patch(
+        "obsidian_to_latex.obsidian_path.read_text",
+        wraps=fragments.obsidian_path.read_text,
+    ) as read_text:
+        for name in ["Note.md", "Other.md", "Note.md"]:
+            text = (vault / name).read_text(encoding="UTF-8")
+            fragment_cache.key(vault / name, text, 1, {}, digests)
+
+    assert [c.args[0].name for c in read_text.call_args_list] == [
+        "Child.md",
+        "Note.md",
+    ]
+
+
+def test_key_of_embed_cycle(vault):
+    (vault / "Child.md").write_text("![[Note]]\n", encoding="UTF-8")
+    assert key(vault) == key(vault)
+
+
+def test_key_is_stable(vault):
+    assert key(vault) == key(vault)
+
+
+key_changes_params = [
+    ({"text": "changed"}, None),
+    ({"depth": 2}, None),
+    ({"settings": {"draft": True}}, None),
+    ({"version": "2"}, None),
+    ({}, lambda v: (v / "Child.md").write_text("changed\n", encoding="UTF-8")),
+]
+
+
+@pytest.mark.parametrize("arguments, change", key_changes_params)
+def test_key_changes(vault, arguments, change):
+    before = key(vault)
+    if change is not None:
+        change(vault)
+    assert key(vault, **arguments) != before
+
+
+def test_key_changes_when_embed_goes_missing(vault):
+    before = key(vault)
+    with mock.patch(
+        "obsidian_to_latex.obsidian_path.find_file",
+        side_effect=FileNotFoundError,
+    ):
+        assert key(vault) != before
+
+
+# Images on disk are included by path, others are copied under their hash
+image_content_params = [(True, False), (False, True)]
+
+
+@pytest.mark.parametrize("on_disk, changes", image_content_params)
+def test_key_follows_image_content_off_disk(vault, on_disk, changes):
+    with mock.patch.object(storage.LocalStorage, "on_disk", on_disk):
+        before = key(vault)
+        (vault / "pic.png").write_bytes(b"other png")
+        assert (key(vault) != before) == changes
+
+
+def test_put_then_get(tmp_path):
+    fragment_cache = fragments.FragmentCache(tmp_path, "1")
+    listing = tmp_path / "listing.py"
+    listing.write_text("pass\n", encoding="UTF-8")
+
+    fragment = fragments.Fragment("tex", [listing], lines=3, levels=1)
+    fragment_cache.put("abcdef", fragment)
+
+    assert fragment_cache.entry("abcdef") == tmp_path / "ab/cdef.json"
+    assert fragment_cache.get("abcdef") == fragment
+    assert [p.name for p in (tmp_path / "ab").iterdir()] == ["cdef.json"]
+
+
+def test_put_then_get_with_sources(tmp_path):
+    fragment_cache = fragments.FragmentCache(tmp_path, "1")
+    sources = [(tmp_path / "A.md", 1), (tmp_path / "A.md", 1)]
+
+    fragment_cache.put("abcdef", fragments.Fragment("a\nb", [], sources))
+
+    assert fragment_cache.get("abcdef") == fragments.Fragment(
+        "a\nb", [], sources
+    )
+
+
+get_missing_params = [
+    ("no entry", None),
+    ("corrupt entry", "{"),
+]
+
+
+@pytest.mark.parametrize("name, content", get_missing_params)
+def test_get_missing(tmp_path, name, content):
+    fragment_cache = fragments.FragmentCache(tmp_path, "1")
+    if content is not None:
+        fragment_cache.entry("abcdef").parent.mkdir()
+        fragment_cache.entry("abcdef").write_text(content, encoding="UTF-8")
+    assert fragment_cache.get("abcdef") is None, name
+
+
+assets_params = [
+    ([], [], True),
+    (["diagram.mmd"], ["diagram.mmd", "diagram.pdf"], True),
+    (["diagram.mmd"], ["diagram.mmd"], False),
+    (["listing.py"], ["listing.py"], True),
+    (["listing.py"], [], False),
+]
+
+
+@pytest.mark.parametrize("assets, existing, available", assets_params)
+def test_get_requires_assets(tmp_path, assets, existing, available):
+    fragment_cache = fragments.FragmentCache(tmp_path / "cache", "1")
+    for name in existing:
+        (tmp_path / name).write_text("", encoding="UTF-8")
+    fragment_cache.put(
+        "abcdef", fragments.Fragment("tex", [tmp_path / a for a in assets])
+    )
+
+    assert (fragment_cache.get("abcdef") is not None) == available
+
+
+def test_put_failure_leaves_no_partial(tmp_path):
+    fragment_cache = fragments.FragmentCache(tmp_path, "1")
+    with mock.patch("os.replace", side_effect=OSError):
+        with pytest.raises(OSError):
+            fragment_cache.put(
+                "abcdef", fragments.Fragment("tex", [Path("a")])
+            )
+    assert not list((tmp_path / "ab").iterdir())
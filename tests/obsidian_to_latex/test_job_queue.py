@@ -0,0 +1,304 @@
+import json
+import multiprocessing
+import os
+import time
+from pathlib import Path
+
+import pytest
+
+from obsidian_to_latex import (
+    build,
+    job_queue,
+    obsidian_path,
+    process_markdown,
+    server,
+)
+
+
+@pytest.fixture(name="queue")
+def queue_fixture(tmp_path):
+    return job_queue.DirectoryQueue(
+        tmp_path / "queue", heartbeat=0.05, stale_after=1.0, max_attempts=2
+    )
+
+
+def built_pdf(file, _options, _build_id):
+    return file.with_suffix(".pdf")
+
+
+def make_old(path):
+    os.utime(path, (time.time() - 60, time.time() - 60))
+
+
+def test_submit_claim_and_run(queue):
+    job_id = queue.submit(Path("/vault/Note.md"), {"draft": True})
+    assert queue.state(job_id) == "pending"
+    assert queue.state("missing") is None
+    with pytest.raises(FileNotFoundError):
+        queue.result(job_id)
+
+    running = queue.claim("worker-1")
+
+    assert running.name == f"{job_id}~worker-1.json"
+    assert queue.state(job_id) == "running"
+    assert queue.claim("worker-2") is None
+    assert not queue.is_idle()
+
+    assert queue.run(running, built_pdf) == "done"
+
+    result = queue.result(job_id)
+    assert result["pdf"] == "/vault/Note.pdf"
+    assert result["options"] == {"draft": True}
+    assert result["worker"] == "worker-1"
+    assert queue.state(job_id) == "done"
+    assert queue.is_idle()
+
+
+def test_jobs_are_claimed_in_submission_order(queue):
+    ids = [queue.submit(Path(f"/vault/{i}.md"), {}) for i in range(3)]
+    claimed = [queue.claim("w").name.split("~")[0] for _ in ids]
+    assert claimed == ids
+
+
+def test_claim_lost_to_another_worker(queue, monkeypatch):
+    queue.submit(Path("/vault/Note.md"), {})
+    real_rename = os.rename
+
+    def rename_after_other_worker(source, destination):
+        real_rename(source, Path(destination).with_name("other.json"))
+        real_rename(source, destination)
+
+    monkeypatch.setattr(os, "rename", rename_after_other_worker)
+    assert queue.claim("worker-1") is None
+
+
+retried_errors_params = [
+    (RuntimeError("out of memory"), "RuntimeError: out of memory"),
+    # A share may not show a note another host has just written yet
+    (FileNotFoundError("Note.md"), "FileNotFoundError: Note.md"),
+]
+
+
+@pytest.mark.parametrize("error, message", retried_errors_params)
+def test_errors_are_retried_then_fail(queue, error, message):
+    job_id = queue.submit(Path("/vault/Note.md"), {})
+
+    def crash(_file, _options, _build_id):
+        raise error
+
+    assert queue.run(queue.claim("w"), crash) == "pending"
+    assert queue.run(queue.claim("w"), crash) == "failed"
+    assert queue.result(job_id)["errors"] == [message, message]
+
+
+def test_errors_in_notes_fail_at_once(queue):
+    job_id = queue.submit(Path("/vault/Note.md"), {})
+
+    def latex_error(_file, _options, _build_id):
+        raise build.LatexError("Note.md:3: Undefined control sequence.")
+
+    assert queue.run(queue.claim("w"), latex_error) == "failed"
+    assert queue.result(job_id)["attempts"] == 1
+
+
+def test_heartbeat_keeps_long_jobs(queue):
+    job_id = queue.submit(Path("/vault/Note.md"), {})
+    running = queue.claim("w")
+
+    def slow(file, options, build_id):
+        time.sleep(1.5)
+        assert queue.requeue_stale() == []
+        return built_pdf(file, options, build_id)
+
+    assert queue.run(running, slow) == "done"
+    assert queue.result(job_id)["attempts"] == 0
+
+
+def test_stale_jobs_are_requeued_then_fail(queue):
+    job_id = queue.submit(Path("/vault/Note.md"), {})
+
+    make_old(queue.claim("stopped-1"))
+    assert queue.requeue_stale() == [job_id]
+    assert queue.state(job_id) == "pending"
+
+    make_old(queue.claim("stopped-2"))
+    assert queue.requeue_stale() == [job_id]
+    assert queue.state(job_id) == "failed"
+    assert queue.result(job_id)["errors"] == [
+        "Worker `stopped-1` stopped responding",
+        "Worker `stopped-2` stopped responding",
+    ]
+    assert queue.is_idle()
+
+
+def test_requeue_skips_fresh_and_vanishing_jobs(queue, monkeypatch):
+    queue.submit(Path("/vault/Fresh.md"), {})
+    queue.claim("w")
+    (queue.root / "running/.partial-1").write_text("", encoding="UTF-8")
+    assert queue.requeue_stale() == []
+
+    real_stat = Path.stat
+
+    def vanished(path, *args, **kwargs):
+        if path.parent.name == "running":
+            raise FileNotFoundError(path)
+        return real_stat(path, *args, **kwargs)
+
+    monkeypatch.setattr(Path, "stat", vanished)
+    assert queue.requeue_stale() == []
+
+
+def test_requeue_lost_to_another_worker(queue, monkeypatch):
+    queue.submit(Path("/vault/Note.md"), {})
+    make_old(queue.claim("stopped"))
+    monkeypatch.setattr(job_queue, "_move", lambda _source, _dest: False)
+    assert queue.requeue_stale() == []
+
+
+def test_result_of_a_requeued_job_is_dropped(queue):
+    job_id = queue.submit(Path("/vault/Note.md"), {})
+    running = queue.claim("slow")
+
+    def requeued_meanwhile(file, options, build_id):
+        make_old(running)
+        queue.requeue_stale()
+        # Long enough for the heartbeat to find the job gone
+        time.sleep(0.2)
+        return built_pdf(file, options, build_id)
+
+    assert queue.run(running, requeued_meanwhile) is None
+    assert queue.state(job_id) == "pending"
+
+
+def test_work_until_idle(queue):
+    ids = [queue.submit(Path(f"/vault/{i}.md"), {}) for i in range(3)]
+    assert queue.work(built_pdf, poll=0.01, until_idle=True) == 3
+    assert [queue.state(i) for i in ids] == ["done"] * 3
+    assert queue.wait(ids, poll=0.01)[ids[0]]["pdf"] == "/vault/0.pdf"
+
+
+def test_work_max_jobs_and_wait_for_others(queue):
+    first = queue.submit(Path("/vault/First.md"), {})
+    running = queue.claim("other")
+    second = queue.submit(Path("/vault/Second.md"), {})
+
+    # Waits for the job another worker is running before stopping
+    assert queue.work(built_pdf, poll=0.01, max_jobs=1) == 1
+    assert queue.state(second) == "done"
+    queue.run(running, built_pdf)
+    assert queue.wait([first, second], poll=0.01)[first]["worker"] == "other"
+
+
+def test_attempts_build_apart_and_work_counts_built_jobs(queue):
+    job_id = queue.submit(Path("/vault/Note.md"), {})
+    build_ids = []
+
+    def fail_once(file, options, build_id):
+        build_ids.append(build_id)
+        if len(build_ids) == 1:
+            raise RuntimeError("out of memory")
+        return built_pdf(file, options, build_id)
+
+    assert queue.work(fail_once, poll=0.01, until_idle=True) == 1
+    assert build_ids == [f"{job_id}-0", f"{job_id}-1"]
+
+
+def test_work_polls_until_other_workers_finish(queue, monkeypatch):
+    queue.submit(Path("/vault/Note.md"), {})
+    running = queue.claim("other")
+    sleeps = []
+
+    def finish_other_job(seconds):
+        sleeps.append(seconds)
+        queue.run(running, built_pdf)
+
+    monkeypatch.setattr(job_queue.time, "sleep", finish_other_job)
+    assert queue.work(built_pdf, poll=0.5, until_idle=True) == 0
+    assert sleeps == [0.5]
+
+
+def test_wait_polls(queue, monkeypatch):
+    done = queue.submit(Path("/vault/Done.md"), {})
+    queue.run(queue.claim("other"), built_pdf)
+    job_id = queue.submit(Path("/vault/Note.md"), {})
+    running = queue.claim("other")
+    monkeypatch.setattr(
+        job_queue.time, "sleep", lambda _s: queue.run(running, built_pdf)
+    )
+    results = queue.wait([done, job_id])
+    assert results[job_id]["pdf"] == "/vault/Note.pdf"
+    assert results[done]["pdf"] == "/vault/Done.pdf"
+
+
+def test_worker_id():
+    first = job_queue.worker_id()
+    assert first != job_queue.worker_id()
+    assert "~" not in first and "." not in first
+
+
+def test_failed_write_leaves_no_file(queue, monkeypatch):
+    monkeypatch.setattr(json, "dump", lambda *_args, **_kwargs: 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        queue.submit(Path("/vault/Note.md"), {})
+    assert not list((queue.root / "pending").iterdir())
+
+
+def log_build(file, _options, _build_id):
+    """Record which process built `file`, slowly enough for the other
+    workers to claim jobs meanwhile."""
+    time.sleep(0.05)
+    with open(file.parent / "built.log", "a", encoding="UTF-8") as f:
+        f.write(f"{file.name} {os.getpid()}\n")
+    return file.with_suffix(".pdf")
+
+
+def work(root):  # pragma: no cover
+    queue = job_queue.DirectoryQueue(root, heartbeat=0.05, stale_after=5)
+    queue.work(log_build, poll=0.01, until_idle=True)
+
+
+def test_several_worker_processes(tmp_path):
+    root = tmp_path / "queue"
+    queue = job_queue.DirectoryQueue(root)
+    ids = [queue.submit(tmp_path / f"{i}.md", {}) for i in range(20)]
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=work, args=(root,)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(timeout=60)
+        assert worker.exitcode == 0
+
+    results = queue.wait(ids, poll=0.01)
+
+    assert all(r["attempts"] == 0 for r in results.values())
+    built = (tmp_path / "built.log").read_text(encoding="UTF-8").split("\n")
+    names = sorted(line.split()[0] for line in built if line)
+    assert names == sorted(f"{i}.md" for i in range(20))
+    assert len({line.split()[1] for line in built if line}) > 1
+    assert queue.is_idle()
+
+
+@pytest.mark.usefixtures("fake_tools")
+def test_build_pdf(tmp_path, monkeypatch):
+    monkeypatch.setattr(obsidian_path, "VAULTS", obsidian_path.VaultCache())
+    monkeypatch.setattr(obsidian_path, "VAULT", None)
+    monkeypatch.setattr(process_markdown, "STATE", process_markdown.STATE)
+    (tmp_path / ".obsidian").mkdir()
+    (tmp_path / "Note.md").write_text("# Note\n", encoding="UTF-8")
+
+    pdf = job_queue.build_pdf(tmp_path / "Note.md", {"draft": True}, "j-0")
+
+    assert pdf == tmp_path / "output/Note.pdf"
+    assert pdf.read_text(encoding="UTF-8").startswith("%PDF-fake")
+    [body] = (tmp_path / "temp").glob("*/*/body.tex")
+    assert body.parent.name == "j-0"
+
+
+def test_job_options():
+    options = server.encode_options(build.BuildOptions(jobs=64, draft=True))
+    assert job_queue.job_options(options) == {
+        k: v
+        for k, v in options.items()
+        if k not in ["jobs", "prefetch_workers", "scratch_dir", "job_id"]
+    }
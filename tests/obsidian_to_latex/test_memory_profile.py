@@ -0,0 +1,103 @@
+from pathlib import Path
+
+from obsidian_to_latex import memory_profile, obsidian_path, process_markdown
+
+MIB = 1024 * 1024
+
+
+def allocate(size: int) -> bytearray:
+    return bytearray(size)
+
+
+def test_disabled_profile_tracks_nothing():
+    with memory_profile.enabled(False) as profile:
+        with memory_profile.stage("convert"):
+            with memory_profile.embed(Path("Hello.md")):
+                memory_profile.record_sites(__file__)
+    assert profile is None
+
+
+def test_nested_peaks():
+    with memory_profile.enabled() as profile:
+        with memory_profile.stage("convert"):
+            with memory_profile.embed(Path("Hello.md")):
+                data = allocate(2 * MIB)
+                del data
+            data = allocate(MIB)
+            del data
+        with memory_profile.stage("latex"):
+            pass
+    assert memory_profile.PROFILE is None
+    assert 2 * MIB <= profile.embeds["Hello.md"] < 3 * MIB
+    assert profile.stages["convert"] >= profile.embeds["Hello.md"]
+    assert profile.stages["latex"] < MIB
+
+
+def test_repeated_embeds_keep_largest_peak():
+    with memory_profile.enabled() as profile:
+        for size in [2 * MIB, MIB]:
+            with memory_profile.embed(Path("Hello.md")):
+                data = allocate(size)
+                del data
+    assert profile.embeds["Hello.md"] >= 2 * MIB
+
+
+def test_record_sites():
+    with memory_profile.enabled() as profile:
+        data = allocate(MIB)
+        memory_profile.record_sites(__file__)
+        del data
+    site, size, count = profile.sites[0]
+    assert site.startswith("test_memory_profile.py:")
+    assert size >= MIB
+    assert count >= 1
+
+
+def test_record_sites_outside_file():
+    with memory_profile.enabled() as profile:
+        data = allocate(MIB)
+        memory_profile.record_sites("elsewhere.py")
+        del data
+    assert not profile.sites
+
+
+def test_embeds_are_named_relative_to_vault(tmp_path):
+    (tmp_path / "notes").mkdir()
+    (tmp_path / "notes/Hello.md").write_text(
+        "# Hello\n![[World]]\n", encoding="UTF-8"
+    )
+    (tmp_path / "notes/World.md").write_text("dolor sit\n", encoding="UTF-8")
+    obsidian_path.VAULT = obsidian_path.Vault(tmp_path)
+    process_markdown.STATE = process_markdown.State.new()
+    process_markdown.STATE.file.append(tmp_path / "root.md")
+    try:
+        with memory_profile.enabled() as profile:
+            process_markdown.obsidian_to_tex("![[Hello]]")
+    finally:
+        obsidian_path.VAULT = None
+        process_markdown.STATE = process_markdown.State.new()
+    assert set(profile.embeds) == {"notes/Hello.md", "notes/World.md"}
+
+
+def test_report():
+    profile = memory_profile.MemoryProfile()
+    profile.stages = {"convert": 2 * MIB, "latex": 100}
+    profile.embeds = {"notes/Hello.md": 3000}
+    profile.sites = [("process_markdown.py:12", 2048, 3)]
+    assert profile.report() == "\n".join(
+        [
+            "Peak memory by stage:",
+            "    convert  2.0 MiB",
+            "    latex    100 B",
+            "Peak memory by embedded file:",
+            "    notes/Hello.md  2.9 KiB",
+            "Top allocation sites at the end of conversion:",
+            "    process_markdown.py:12  2.0 KiB in 3 blocks",
+        ]
+    )
+
+
+def test_report_without_embeds():
+    profile = memory_profile.MemoryProfile()
+    profile.stages = {"convert": 10}
+    assert profile.report() == "Peak memory by stage:\n    convert  10 B"
@@ -0,0 +1,93 @@
+import json
+from unittest import mock
+
+import pytest
+
+from obsidian_to_latex import metrics
+
+
+def test_counters_and_histograms():
+    recorded = metrics.Metrics()
+    recorded.inc("builds_total")
+    recorded.inc("lines_converted_total", 40)
+    for seconds in [0.01, 0.3, 100.0]:
+        recorded.observe("latex_seconds", seconds)
+
+    snapshot = recorded.snapshot()
+
+    assert snapshot["counters"]["builds_total"] == 1
+    assert snapshot["counters"]["lines_converted_total"] == 40
+    latex = snapshot["histograms"]["latex_seconds"]
+    assert latex["buckets"] == [1, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 1]
+    assert latex["sum"] == pytest.approx(100.31)
+    assert latex["count"] == 3
+    assert json.loads(json.dumps(snapshot)) == snapshot
+
+
+def test_snapshot_is_a_copy():
+    recorded = metrics.Metrics()
+    snapshot = recorded.snapshot()
+    recorded.inc("builds_total")
+    recorded.observe("mmdc_seconds", 1.0)
+    assert snapshot == metrics.Metrics().snapshot()
+
+
+def test_merge():
+    worker = metrics.Metrics()
+    worker.inc("notes_embedded_total", 3)
+    worker.observe("mmdc_seconds", 2.0)
+    total = metrics.Metrics()
+    total.inc("notes_embedded_total")
+    total.observe("mmdc_seconds", 0.5)
+
+    total.merge(worker.snapshot())
+    total.merge(worker.snapshot())
+
+    snapshot = total.snapshot()
+    assert snapshot["counters"]["notes_embedded_total"] == 7
+    mmdc = snapshot["histograms"]["mmdc_seconds"]
+    assert mmdc["count"] == 3
+    assert mmdc["sum"] == pytest.approx(4.5)
+
+
+def test_prometheus():
+    recorded = metrics.Metrics()
+    recorded.inc("pdf_cache_hits_total", 2)
+    recorded.observe("build_seconds", 0.2)
+    recorded.observe("build_seconds", 0.5)
+
+    lines = recorded.prometheus().splitlines()
+
+    assert lines[:3] == [
+        "# HELP obsidian_to_latex_lines_converted_total"
+        " Markdown lines converted to TeX",
+        "# TYPE obsidian_to_latex_lines_converted_total counter",
+        "obsidian_to_latex_lines_converted_total 0",
+    ]
+    assert "obsidian_to_latex_pdf_cache_hits_total 2" in lines
+    assert "# TYPE obsidian_to_latex_build_seconds histogram" in lines
+    build = [
+        line for line in lines if line.startswith("obsidian_to_latex_build_s")
+    ]
+    assert build[2:6] == [
+        'obsidian_to_latex_build_seconds_bucket{le="0.1"} 0',
+        'obsidian_to_latex_build_seconds_bucket{le="0.25"} 1',
+        'obsidian_to_latex_build_seconds_bucket{le="0.5"} 2',
+        'obsidian_to_latex_build_seconds_bucket{le="1"} 2',
+    ]
+    assert build[-3:] == [
+        'obsidian_to_latex_build_seconds_bucket{le="+Inf"} 2',
+        "obsidian_to_latex_build_seconds_sum 0.7",
+        "obsidian_to_latex_build_seconds_count 2",
+    ]
+
+
+def test_module_helpers():
+    with mock.patch.object(metrics, "METRICS", metrics.Metrics()):
+        metrics.inc("failures_total")
+        with mock.patch("time.perf_counter", side_effect=[1.0, 3.5]):
+            with metrics.timed("conversion_seconds"):
+                pass
+        snapshot = metrics.METRICS.snapshot()
+    assert snapshot["counters"]["failures_total"] == 1
+    assert snapshot["histograms"]["conversion_seconds"]["sum"] == 2.5
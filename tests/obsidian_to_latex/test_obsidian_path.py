@@ -0,0 +1,280 @@
+import os
+import zipfile
+from pathlib import Path
+from unittest import mock
+
+import pytest
+
+from obsidian_to_latex import metrics, obsidian_path, storage
+
+
+def test_index_vault(tmp_path):
+    (tmp_path / "a").mkdir()
+    (tmp_path / "a/Hello.md").write_text("", encoding="UTF-8")
+    (tmp_path / "b").mkdir()
+    (tmp_path / "b/image.png").write_bytes(b"")
+
+    index = obsidian_path.index_vault(tmp_path)
+
+    assert index == {
+        "Hello.md": tmp_path / "a/Hello.md",
+        "image.png": tmp_path / "b/image.png",
+    }
+
+
+def test_format_path():
+    assert obsidian_path.format_path(Path("a") / "b") == "a/b"
+
+
+ignore_rules_params = [
+    (".git/objects", True, False),
+    (".git", True, True),
+    (".git", False, False),
+    ("notes/temp", True, True),
+    ("notes/output.md", False, False),
+    ("notes/draft.md", False, True),
+    ("notes/keep-draft.md", False, False),
+    ("archive", True, True),
+    ("notes/archive", True, False),
+    ("# not a comment", False, False),
+]
+
+
+@pytest.mark.parametrize(
+    "relative_path, is_dir, expected", ignore_rules_params
+)
+def test_ignore_rules(relative_path, is_dir, expected):
+    patterns = [
+        *obsidian_path.DEFAULT_IGNORES,
+        "# comment",
+        "",
+        "*draft.md",
+        "!keep-*",
+        "/archive/",
+    ]
+    rules = obsidian_path.IgnoreRules(patterns)
+    assert rules.ignored(relative_path, is_dir) == expected
+
+
+ignore_globs_params = [
+    ("drafts/*.md", "drafts/a.md", True),
+    ("drafts/*.md", "drafts/a/b.md", False),
+    ("drafts/**.md", "drafts/a/b.md", True),
+    ("drafts/**/b.md", "drafts/b.md", True),
+    ("drafts/**/b.md", "drafts/a/c/b.md", True),
+    ("**/b.md", "drafts/a/b.md", True),
+    ("drafts/?.md", "drafts/a.md", True),
+    ("drafts?a.md", "drafts/a.md", False),
+    ("[!a]*.md", "b.md", True),
+    ("[!a]*.md", "a.md", False),
+    ("[ab].md", "b.md", True),
+    ("[a.md", "[a.md", True),
+    ("a+b.md", "aab.md", False),
+]
+
+
+@pytest.mark.parametrize(
+    "pattern, relative_path, expected", ignore_globs_params
+)
+def test_ignore_rules_globs(pattern, relative_path, expected):
+    rules = obsidian_path.IgnoreRules([pattern])
+    assert rules.ignored(relative_path, False) == expected
+
+
+def test_load_ignore_rules(tmp_path):
+    rules = obsidian_path.load_ignore_rules(tmp_path, ["extra/"])
+    assert rules.patterns == [*obsidian_path.DEFAULT_IGNORES, "extra/"]
+
+    (tmp_path / obsidian_path.IGNORE_FILE).write_text(
+        "attachments/\n!temp/\n", encoding="UTF-8"
+    )
+    rules = obsidian_path.load_ignore_rules(tmp_path)
+    assert rules.ignored("attachments", True)
+    assert not rules.ignored("temp", True)
+
+
+@pytest.fixture(name="vault")
+def vault_fixture(write_vault):
+    files = [
+        ".git/objects/Hello.md",
+        ".obsidian/app.json",
+        "b/temp/Hello.md",
+        "b/Hello.md",
+        "a/c/Hello.md",
+        "a/image.png",
+        "output/Hello.pdf",
+        "Root.md",
+    ]
+    return write_vault(dict.fromkeys(files, ""))
+
+
+def test_scan_vault_skips_ignored_entries(vault):
+    result = obsidian_path.scan_vault(vault)
+    assert result.paths == {
+        "Root.md": [vault / "Root.md"],
+        "image.png": [vault / "a/image.png"],
+        "Hello.md": [vault / "a/c/Hello.md", vault / "b/Hello.md"],
+    }
+    assert result.skipped == 4
+
+
+def test_scan_vault_with_rules(vault):
+    rules = obsidian_path.IgnoreRules(["a/", "!temp/"])
+    result = obsidian_path.scan_vault(vault, rules, workers=1)
+    assert result.paths["Hello.md"] == [
+        vault / ".git/objects/Hello.md",
+        vault / "b/Hello.md",
+        vault / "b/temp/Hello.md",
+    ]
+    assert result.skipped == 1
+
+
+def test_scan_vault_skips_unreadable_directories(vault):
+    scandir = os.scandir
+
+    def unreadable(path):
+        if Path(path).name == "b":
+            raise PermissionError(path)
+        return scandir(path)
+
+    with mock.patch("os.scandir", side_effect=unreadable):
+        result = obsidian_path.scan_vault(vault)
+    assert result.paths["Hello.md"] == [vault / "a/c/Hello.md"]
+    assert result.skipped == 4
+
+
+@pytest.mark.skipif(os.name == "nt", reason="Symlinks need privileges")
+def test_scan_vault_ignores_broken_links(vault):
+    (vault / "Broken.md").symlink_to(vault / "missing.md")
+    result = obsidian_path.scan_vault(vault)
+    assert "Broken.md" not in result.paths
+
+
+def test_vault_finds_files(vault):
+    opened = obsidian_path.Vault(vault)
+    assert opened.find_file("Hello.md") == vault / "a/c/Hello.md"
+    assert opened.scan().paths.keys() == opened.index().keys()
+
+
+def test_vault_reindexes_moved_files(vault):
+    opened = obsidian_path.Vault(vault)
+    opened.find_file("Root.md")
+    (vault / "Root.md").rename(vault / "a/Root.md")
+    (vault / "New.md").write_text("", encoding="UTF-8")
+
+    assert opened.find_file("Root.md") == vault / "a/Root.md"
+    assert opened.find_file("New.md") == vault / "New.md"
+
+
+def test_vault_missing_file(vault):
+    with pytest.raises(FileNotFoundError, match="Unable to locate `No.md`"):
+        obsidian_path.Vault(vault).find_file("No.md")
+
+
+def test_vault_rebuilds_once_per_generation(vault, monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS", metrics.Metrics())
+    opened = obsidian_path.Vault(vault)
+    for name in ["No.md", "No.md", "Other.md"]:
+        with pytest.raises(FileNotFoundError):
+            opened.find_file(name)
+    (vault / "No.md").write_text("", encoding="UTF-8")
+    (vault / "Root.md").unlink()
+
+    # Until the next generation, misses are remembered
+    with pytest.raises(FileNotFoundError):
+        opened.find_file("No.md")
+    with pytest.raises(FileNotFoundError):
+        opened.find_file("Root.md")
+    builds = metrics.METRICS.snapshot()["counters"]
+    assert builds["vault_index_builds_total"] == 2
+
+    opened.refresh()
+    assert opened.find_file("No.md") == vault / "No.md"
+    builds = metrics.METRICS.snapshot()["counters"]
+    assert builds["vault_index_builds_total"] == 3
+
+
+def test_vault_cache_refreshes_reopened_vaults(vault):
+    vaults = obsidian_path.VaultCache()
+    with pytest.raises(FileNotFoundError):
+        vaults.open(vault).find_file("New.md")
+    (vault / "New.md").write_text("", encoding="UTF-8")
+
+    assert vaults.open(vault).find_file("New.md") == vault / "New.md"
+
+
+def test_find_file_in_current_vault(vault):
+    obsidian_path.VAULT = obsidian_path.Vault(vault)
+    try:
+        assert obsidian_path.find_file("Root.md") == vault / "Root.md"
+        assert obsidian_path.current_root() == vault
+    finally:
+        obsidian_path.VAULT = None
+    assert obsidian_path.current_root() is None
+    with pytest.raises(FileNotFoundError, match="outside a vault"):
+        obsidian_path.find_file("Root.md")
+
+
+def test_vault_cache_reuses_open_vaults(tmp_path):
+    vaults = obsidian_path.VaultCache(max_open=2)
+    a = vaults.open(tmp_path / "a")
+    b = vaults.open(tmp_path / "b")
+
+    assert vaults.open(tmp_path / "a") is a
+    vaults.open(tmp_path / "c")
+
+    assert len(vaults) == 2
+    assert tmp_path / "b" not in vaults
+    assert vaults.open(tmp_path / "a") is a
+    assert vaults.open(tmp_path / "b") is not b
+
+
+def test_vault_cache_reopens_when_ignores_change(tmp_path):
+    vaults = obsidian_path.VaultCache()
+    vault = vaults.open(tmp_path)
+
+    assert vaults.open(tmp_path, []) is vault
+    assert vaults.open(tmp_path, ["drafts/"]) is not vault
+
+
+def test_vault_cache_opens_given_storage(tmp_path):
+    vaults = obsidian_path.VaultCache()
+    on_disk = vaults.open(tmp_path)
+    store = storage.MemoryStorage(tmp_path, {"notes/Root.md": ""})
+
+    vault = vaults.open(tmp_path, store=store)
+
+    assert vault is not on_disk
+    assert vault.store is store
+    assert vaults.open(tmp_path) is vault
+    assert vaults.root_of(tmp_path / "notes/Root.md") == tmp_path
+    assert vaults.root_of(tmp_path.parent / "Root.md") is None
+
+
+def test_vault_cache_finds_roots_only_off_disk(tmp_path):
+    vaults = obsidian_path.VaultCache()
+    vaults.open(tmp_path)
+    assert vaults.root_of(tmp_path / "Root.md") is None
+
+
+def test_vault_cache_closes_evicted_archives(tmp_path):
+    archive = tmp_path / "vault.zip"
+    with zipfile.ZipFile(archive, "w") as f:
+        f.writestr("Root.md", "# Root\n")
+    vaults = obsidian_path.VaultCache(max_open=1)
+    store = vaults.open(archive).store
+
+    vaults.open(tmp_path / "other")
+
+    with pytest.raises(ValueError, match="closed"):
+        store.read_bytes(archive / "Root.md")
+
+
+def test_vault_cache_closes_replaced_storage(tmp_path):
+    vaults = obsidian_path.VaultCache()
+    replaced = storage.MemoryStorage(tmp_path, {})
+    vaults.open(tmp_path, store=replaced)
+
+    with mock.patch.object(replaced, "close") as close:
+        vaults.open(tmp_path, store=storage.MemoryStorage(tmp_path, {}))
+    close.assert_called_once_with()
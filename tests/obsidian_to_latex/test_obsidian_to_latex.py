@@ -0,0 +1,117 @@
+import datetime
+from pathlib import Path
+from unittest import mock
+
+import click
+import pytest
+from click.testing import CliRunner
+
+from obsidian_to_latex import build, cache, obsidian_to_latex
+
+default_command_params = [
+    (["--help"], "Commands:"),
+    (["build", "--help"], "FILENAME"),
+    (["note.md", "--help"], "FILENAME"),
+    (["serve", "--help"], "VAULT"),
+    (["cache", "--help"], "stats"),
+    (["cache", "gc", "--help"], "--max-size"),
+    (["worker", "--help"], "QUEUE_DIR"),
+    (["submit", "--help"], "FILENAMES"),
+]
+
+
+@pytest.mark.parametrize("args, expected", default_command_params)
+def test_default_command(args, expected):
+    result = CliRunner().invoke(obsidian_to_latex.main, args)
+    assert result.exit_code == 0, result.output
+    assert expected in result.output
+
+
+@mock.patch("obsidian_to_latex.obsidian_to_latex.coloredlogs")
+@mock.patch("obsidian_to_latex.obsidian_to_latex.colored_traceback")
+def test_default_command_without_arguments(_traceback, _logs):
+    result = CliRunner().invoke(obsidian_to_latex.main, [])
+    assert result.exit_code == 2
+    assert "Missing argument 'FILENAME'" in result.output
+
+
+scratch_dir_params = [
+    (None, None),
+    (Path("ram"), build.ram_dir()),
+    (Path("scratch"), Path.cwd() / "scratch"),
+]
+
+
+@pytest.mark.parametrize("value, expected", scratch_dir_params)
+def test_scratch_dir(value, expected):
+    assert obsidian_to_latex.scratch_dir(value) == expected
+
+
+def test_parse_size_and_duration():
+    assert obsidian_to_latex.parse_size(None) is None
+    assert obsidian_to_latex.parse_size("1k") == 1024
+    assert obsidian_to_latex.parse_duration(None) is None
+    assert obsidian_to_latex.parse_duration("1h") == 3600
+    with pytest.raises(click.BadParameter):
+        obsidian_to_latex.parse_size("big")
+    with pytest.raises(click.BadParameter):
+        obsidian_to_latex.parse_duration("long")
+
+
+def test_cache_dirs(monkeypatch, tmp_path):
+    monkeypatch.delenv("OBSIDIAN_TO_LATEX_CACHE_DIR", raising=False)
+    assert obsidian_to_latex.cache_dirs([tmp_path]) == [tmp_path]
+    with pytest.raises(click.UsageError):
+        obsidian_to_latex.cache_dirs([])
+    monkeypatch.setenv("OBSIDIAN_TO_LATEX_CACHE_DIR", str(tmp_path))
+    assert obsidian_to_latex.cache_dirs([]) == [tmp_path]
+
+
+def test_describe_entries():
+    used = datetime.datetime(2024, 5, 1, 12, 30).timestamp()
+    entries = [
+        cache.Entry("pdf", [Path("a")], 2048, used),
+        cache.Entry("build", [Path("b")], 10, used + 60),
+    ]
+    assert obsidian_to_latex.describe_entries(entries) == [
+        "kind        entries        size  oldest use",
+        "pdf               1     2.0 KiB  2024-05-01 12:30",
+        "build             1        10 B  2024-05-01 12:31",
+        "total             2     2.0 KiB",
+    ]
+
+
+@pytest.fixture(name="cache_dir")
+def cache_dir_fixture(tmp_path):
+    pdf = tmp_path / "document.pdf"
+    pdf.write_bytes(b"x" * 2048)
+    cache.ContentCache(tmp_path / "cache").put("0" * 64, {"document.pdf": pdf})
+    return tmp_path / "cache"
+
+
+def test_cache_commands(cache_dir):
+    def run(*args):
+        result = CliRunner().invoke(
+            obsidian_to_latex.main, ["cache", *args, str(cache_dir)]
+        )
+        assert result.exit_code == 0, result.output
+        return result.output.splitlines()
+
+    assert run("stats")[-1] == "total             1     2.0 KiB"
+    dry_run = run("gc", "--max-size", "1k", "--dry-run")
+    assert dry_run[-1] == "Would remove 1 entries, 2.0 KiB"
+    assert run("gc", "--max-age", "30d") == ["Removed 0 entries, 0 B"]
+    assert run("gc", "--max-size", "1k") == ["Removed 1 entries, 2.0 KiB"]
+    assert run("clear", "--yes") == ["Removed 0 entries, 0 B"]
+    assert run("stats")[-1] == "total             0         0 B"
+
+
+@pytest.mark.parametrize("args", [["gc"], ["clear", "--yes"]])
+def test_cache_commands_wait_for_builds(cache_dir, args):
+    with cache.locked([cache_dir], shared=True):
+        result = CliRunner().invoke(
+            obsidian_to_latex.main,
+            ["cache", *args, "--wait", "0", str(cache_dir)],
+        )
+    assert result.exit_code == 1
+    assert "Timed out waiting for builds" in result.output
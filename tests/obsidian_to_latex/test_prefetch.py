@@ -0,0 +1,95 @@
+from pathlib import Path
+
+import pytest
+
+from obsidian_to_latex import obsidian_path, prefetch, process_markdown
+
+
+@pytest.fixture(name="vault")
+def vault_fixture(write_vault):
+    vault = write_vault(
+        {
+            "notes/Hello.md": "# Hello\nlorem ipsum\n![[World]]\n",
+            "notes/World.md": "# World\ndolor sit\n",
+            "images/foo.png": b"",
+        },
+        current=True,
+    )
+    process_markdown.STATE = process_markdown.State.new()
+    process_markdown.STATE.file.append(vault / "root.md")
+    return vault
+
+
+embed_targets_params = [
+    ("lorem ipsum", []),
+    ("![[Hello]]", ["Hello.md"]),
+    ("![[foo.png|100x200]]", ["foo.png"]),
+    ("![[Hello]]\ntext\n![[Hello]]\n![[World]]", ["Hello.md", "World.md"]),
+    (" ![[Hello]]", []),
+]
+
+
+@pytest.mark.parametrize("text, expected", embed_targets_params)
+def test_embed_targets(text, expected):
+    assert prefetch.embed_targets(text) == expected
+
+
+def test_prefetch_reads_embeds_transitively(vault):
+    with prefetch.enabled(max_workers=2) as prefetcher:
+        prefetcher.schedule("![[Hello]]\n![[foo.png]]")
+        file, text = prefetcher.take("Hello.md")
+        assert file == vault / "notes/Hello.md"
+        assert text.startswith("# Hello")
+        assert prefetcher.take("foo.png") == vault / "images/foo.png"
+        file, text = prefetcher.take("World.md")
+        assert file == vault / "notes/World.md"
+        assert prefetcher.take("World.md") is None
+
+
+def test_prefetch_is_bounded(vault):
+    with prefetch.enabled(max_workers=1, max_buffered=1) as prefetcher:
+        prefetcher.schedule("![[foo.png]]\n![[World]]")
+        assert prefetcher.take("World.md") is None
+        assert prefetcher.take("foo.png") == vault / "images/foo.png"
+
+
+def test_prefetch_leaves_missing_files_to_converter(vault):
+    with prefetch.enabled(max_workers=1) as prefetcher:
+        prefetcher.schedule("![[Missing]]")
+        assert prefetcher.take("Missing.md") is None
+    with pytest.raises(FileNotFoundError):
+        process_markdown.read_markdown("Missing.md")
+    assert vault
+
+
+def test_prefetch_disabled():
+    with prefetch.enabled(max_workers=0) as prefetcher:
+        assert prefetcher is None
+        prefetch.schedule("![[Hello]]")
+        assert prefetch.take("Hello.md") is None
+
+
+def test_embed_markdown_uses_prefetched_files(vault):
+    with prefetch.enabled(max_workers=2):
+        result = process_markdown.obsidian_to_tex(
+            "# Root\n![[Hello]]\n![[foo.png]]"
+        )
+    image = obsidian_path.format_path(Path(vault / "images/foo"))
+    assert result == (
+        "\n"
+        "\\label{file_Hello_md}\n"
+        "lorem ipsum\n"
+        "\\label{file_World_md}\n"
+        "dolor sit\n"
+        R"\includegraphics[width=\columnwidth,keepaspectratio]"
+        f"{{{image}}}"
+    )
+
+
+def test_prefetch_discards_untaken_files(vault):
+    with prefetch.enabled(max_workers=1) as prefetcher:
+        prefetcher.schedule("![[Hello]]\n![[foo.png]]")
+    assert prefetcher.take("Hello.md") is None
+    prefetcher.schedule("![[Hello]]")
+    assert prefetcher.take("Hello.md") is None
+    assert vault
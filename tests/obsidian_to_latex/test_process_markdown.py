@@ -1,4 +1,4 @@
-# pylint: disable=protected-access
+# pylint: disable=protected-access,too-many-lines
 import inspect
 from pathlib import Path
 from unittest import mock
@@ -116,7 +116,7 @@ def setup_teardown():
             R"\begin{minipage}{\columnwidth}"
             "\n"
             R"\includegraphics[width=\columnwidth,keepaspectratio]"
-            R"{test_file_3}"
+            R"{diagram_b6021ea7cdf1e709}"
             "\n"
             R"\end{minipage}"
             "\n"
@@ -371,6 +371,128 @@ def test_obsidian_to_tex(test_name, input_text, expected):
     assert result == expected, result
 
 
+external_code_params = [
+    (f"{file_line()} Short blocks stay inline", 3, False),
+    (f"{file_line()} Blocks at the threshold are externalised", 2, True),
+    (f"{file_line()} No threshold keeps blocks inline", None, False),
+]
+
+
+@pytest.mark.parametrize(
+    "test_name, threshold, externalised", external_code_params
+)
+def test_external_code_block(test_name, threshold, externalised, tmp_path):
+    process_markdown.STATE.temp_dir = tmp_path
+    process_markdown.STATE.code_external_threshold = threshold
+    input_text = (
+        "```python\nx = 1\nprint(x)\n```\n```python\nx = 1\nprint(x)\n```"
+    )
+
+    result = process_markdown.obsidian_to_tex(input_text)
+
+    devtools.debug(test_name)
+    listings = list(tmp_path.glob("listing_*.python"))
+    if not externalised:
+        assert not listings
+        assert "x = 1\nprint(x)\n" in result
+        return
+    assert len(listings) == 1
+    assert listings[0].read_text(encoding="UTF-8") == "x = 1\nprint(x)\n"
+    block = (
+        "\n"
+        R"\begin{minipage}{\columnwidth}"
+        "\n"
+        R"\inputminted[bgcolor=bg]{python}"
+        f"{{{listings[0].name}}}"
+        "\n"
+        R"\end{minipage}"
+    )
+    assert result == block + "\n" + block
+
+
+def test_assets_outside_temp_dir_use_absolute_paths(tmp_path):
+    process_markdown.STATE.asset_dir = tmp_path / "assets"
+    process_markdown.STATE.code_external_threshold = 1
+    input_text = "```mermaid\ngraph\n```\n```python\nx = 1\n```"
+
+    with mock.patch(
+        "obsidian_to_latex.process_markdown.process_mermaid_diagram"
+    ):
+        result = process_markdown.obsidian_to_tex(input_text)
+
+    listing = next((tmp_path / "assets").glob("listing_*.python"))
+    assets = obsidian_path.format_path(tmp_path / "assets")
+    assert (
+        f"\\includegraphics[width=\\columnwidth,keepaspectratio]{{{assets}/diagram_fd9d63f006fed497}}"
+        in result
+    )
+    assert (
+        f"\\inputminted[bgcolor=bg]{{python}}{{{assets}/{listing.name}}}"
+        in result
+    )
+
+
+def test_mmdc_command():
+    assert process_markdown.mmdc_command(Path("a/diagram_1.mmd")) == [
+        "mmdc",
+        "-i",
+        Path("a/diagram_1.mmd"),
+        "-o",
+        Path("a/diagram_1.pdf"),
+        "--pdfFit",
+    ]
+
+
+def test_draft_uses_placeholders_and_plain_listings():
+    process_markdown.STATE.draft = True
+    process_markdown.STATE.code_external_threshold = 1
+    input_text = (
+        "```mermaid\ngraph\n```\n![[foo_bar.png|300]]\n```python\nx = 1\n```"
+    )
+
+    with mock.patch(
+        "obsidian_to_latex.process_markdown.process_mermaid_diagram",
+        return_value=False,
+    ), mock.patch("obsidian_to_latex.obsidian_path.find_file") as mock_find:
+        result = process_markdown.obsidian_to_tex(input_text)
+
+    mock_find.assert_not_called()
+    assert result == (
+        "\n"
+        R"\begin{minipage}{\columnwidth}"
+        "\n"
+        R"\framebox[\columnwidth]{\rule{0pt}{4em}\texttt{diagram\_fd9d63f006fed497.mmd}}"
+        "\n"
+        R"\end{minipage}"
+        "\n"
+        R"\framebox[150pt]{\rule{0pt}{4em}\texttt{foo\_bar.png}}"
+        "\n\n"
+        R"\begin{minipage}{\columnwidth}"
+        "\n"
+        R"\begin{verbatim}"
+        "\nx = 1\n"
+        R"\end{verbatim}"
+        "\n"
+        R"\end{minipage}"
+    )
+
+
+def test_is_changed(tmp_path):
+    path = tmp_path / "file.mmd"
+    assert process_markdown.is_changed(path, "graph\n")
+    path.write_text("graph\n", encoding="UTF-8")
+    assert not process_markdown.is_changed(path, "graph\n")
+    assert process_markdown.is_changed(path, "graph LR\n")
+
+
+def test_write_if_changed(tmp_path):
+    path = tmp_path / "new/file.mmd"
+    assert process_markdown.write_if_changed(path, "graph\n")
+    assert not process_markdown.write_if_changed(path, "graph\n")
+    assert process_markdown.write_if_changed(path, "graph LR\n")
+    assert path.read_text(encoding="UTF-8") == "graph LR\n"
+
+
 line_to_latex_params = [
     ("A Normal Line", "A Normal Line"),
     ("# A Title", R""),  # Title at top of markdown becomes document title
@@ -403,6 +525,10 @@ def test_obsidian_to_tex(test_name, input_text, expected):
         "Normal text is almost #1, it's #2",
         R"Normal text is almost \#1, it's \#2",
     ),
+    ("-not a list", "-not a list"),
+    ("---", "---"),
+    ("1.5 is not a list either", "1.5 is not a list either"),
+    ("12. twelve", "\\begin{legal}[start=12]\n\\item twelve"),
 ]
 
 
@@ -412,6 +538,22 @@ def test_line_to_tex(input_text, expected):
     assert result == expected
 
 
+line_time_budget_params = [
+    (None, 5.0, False),
+    (1.0, 0.5, False),
+    (1.0, 5.0, True),
+]
+
+
+@pytest.mark.parametrize("budget, elapsed, warned", line_time_budget_params)
+def test_line_time_budget(budget, elapsed, warned, caplog):
+    process_markdown.STATE.line_time_budget = budget
+    with mock.patch("time.perf_counter", side_effect=[0.0, elapsed]):
+        result = process_markdown._line_to_tex(7, "_slow_")
+    assert result == R"\_slow\_"
+    assert ("test_file.md:7` took 5.00s" in caplog.text) == warned
+
+
 is_embedded_params = [
     ("Hello", False),
     ("![[Hello]]", True),
@@ -543,12 +685,19 @@ def test_is_image(input_text, expected):
 ]
 
 
+def embedded_document(file_name: str) -> Path:
+    # Notes get a folder each, so nested embeds are not taken for a cycle
+    if file_name.endswith(".md"):
+        return Path(file_name[:-3], "embedded_document.md").absolute()
+    return Path("embedded_document.md").absolute()
+
+
 @pytest.mark.parametrize(
     "test_name, input_text, open_reads, expected", embed_markdown_params
 )
 def test_embed_markdown(test_name, input_text, open_reads, expected):
     with mock.patch("obsidian_to_latex.obsidian_path.find_file") as mock_find:
-        mock_find.return_value = Path("embedded_document.md").absolute()
+        mock_find.side_effect = embedded_document
         with mock.patch(
             "builtins.open", get_mock_open(open_reads)
         ) as _open_mock:
@@ -560,6 +709,249 @@ def test_embed_markdown(test_name, input_text, open_reads, expected):
     assert result == expected
 
 
+dedupe_embeds_params = [
+    (
+        False,
+        "\\label{file_Hello_md}\n"
+        "\\label{file_World_md}dolor sit\n"
+        "\\label{file_World_md}dolor sit",
+    ),
+    (
+        True,
+        "\\label{file_Hello_md}\n"
+        "\\label{file_World_md}dolor sit\n"
+        "\\hyperref[file_World_md]{World}",
+    ),
+]
+
+
+@pytest.mark.parametrize("dedupe, expected", dedupe_embeds_params)
+def test_dedupe_embeds(dedupe, expected):
+    if dedupe:
+        process_markdown.STATE.embedded = set()
+    reads = ["# Hello\n![[World]]\n![[World]]\n", "dolor sit", "dolor sit"]
+    with mock.patch(
+        "obsidian_to_latex.obsidian_path.find_file",
+        side_effect=lambda name: Path(name).absolute(),
+    ), mock.patch("builtins.open", get_mock_open(reads)):
+        result = process_markdown.embed_markdown("![[Hello]]")
+    assert result == expected
+
+
+@pytest.fixture(name="fragment_vault")
+def fragment_vault_fixture(write_vault):
+    vault = write_vault(
+        {"Hello.md": "# Hello\n![[World]]\n", "World.md": "dolor sit\n"},
+        current=True,
+    )
+    process_markdown.STATE.fragment_dir = vault / "fragments"
+    process_markdown.STATE.converter_version = "1"
+    return vault
+
+
+@pytest.mark.usefixtures("fragment_vault")
+def test_embed_reuses_converted_fragments():
+    expected = "\\label{file_Hello_md}\n\\label{file_World_md}dolor sit"
+    assert process_markdown.embed_markdown("![[Hello]]") == expected
+
+    with mock.patch.object(
+        process_markdown, "obsidian_to_tex", side_effect=AssertionError
+    ):
+        assert process_markdown.embed_markdown("![[Hello]]") == expected
+
+
+def test_embed_converts_changed_fragments(fragment_vault):
+    process_markdown.embed_markdown("![[Hello]]")
+    (fragment_vault / "World.md").write_text("lorem ipsum\n", encoding="UTF-8")
+    # As in a new build
+    process_markdown.STATE.fragment_digests = {}
+
+    result = process_markdown.embed_markdown("![[Hello]]")
+
+    assert result.endswith("\\label{file_World_md}lorem ipsum")
+
+
+def test_embed_fragment_depends_on_depth(fragment_vault):
+    (fragment_vault / "World.md").write_text(
+        "# World\n## Part\n", encoding="UTF-8"
+    )
+    process_markdown.embed_markdown("![[World]]")
+    process_markdown.STATE.depth = 2
+
+    result = process_markdown.embed_markdown("![[World]]")
+
+    assert "\\subsection{Part}" in result
+
+
+def test_embed_fragment_records_assets(fragment_vault):
+    (fragment_vault / "World.md").write_text(
+        "```mermaid\ngraph\n```\n", encoding="UTF-8"
+    )
+    asset = fragment_vault / "diagram_fd9d63f006fed497.mmd"
+    with mock.patch.object(
+        process_markdown,
+        "process_mermaid_diagram",
+        side_effect=lambda name: process_markdown.asset_path(
+            "diagram_fd9d63f006fed497.mmd"
+        )
+        and True,
+    ):
+        process_markdown.STATE.temp_dir = fragment_vault
+        process_markdown.embed_markdown("![[Hello]]")
+        process_markdown.STATE.assets = []
+        asset.write_text("graph\n", encoding="UTF-8")
+        asset.with_suffix(".pdf").write_bytes(b"pdf")
+        with mock.patch.object(
+            process_markdown, "obsidian_to_tex", side_effect=AssertionError
+        ):
+            process_markdown.embed_markdown("![[Hello]]")
+
+    assert process_markdown.STATE.assets == [asset]
+
+
+def test_reuse_assets(tmp_path):
+    made = tmp_path / "job1"
+    made.mkdir()
+    for name in ["listing_1.py", "diagram_1.mmd", "diagram_1.pdf"]:
+        (made / name).write_text(name, encoding="UTF-8")
+    reused = tmp_path / "job2"
+    reused.mkdir()
+    (reused / "diagram_1.mmd").write_text("kept", encoding="UTF-8")
+    process_markdown.STATE.temp_dir = reused
+
+    process_markdown.reuse_assets(
+        [made / "listing_1.py", made / "diagram_1.mmd"]
+    )
+
+    assert process_markdown.STATE.assets == [
+        reused / "listing_1.py",
+        reused / "diagram_1.mmd",
+    ]
+    assert (reused / "listing_1.py").read_text(
+        encoding="UTF-8"
+    ) == "listing_1.py"
+    assert (reused / "diagram_1.mmd").read_text(encoding="UTF-8") == "kept"
+    assert (reused / "diagram_1.pdf").read_text(
+        encoding="UTF-8"
+    ) == "diagram_1.pdf"
+
+
+def test_source_map_follows_embeds(fragment_vault):
+    root = process_markdown.STATE.file[-1]
+    process_markdown.STATE.source_map = []
+    text = "intro\n![[Hello]]\n- item\n- more"
+
+    tex = process_markdown.obsidian_to_tex(text)
+    sources = process_markdown.STATE.converted_map
+    cached = process_markdown.obsidian_to_tex(text)
+
+    assert cached == tex
+    assert process_markdown.STATE.converted_map == sources
+    assert list(zip(tex.split("\n"), sources)) == [
+        ("intro", (root, 1)),
+        ("\\label{file_Hello_md}", (fragment_vault / "Hello.md", 1)),
+        ("\\label{file_World_md}dolor sit", (fragment_vault / "World.md", 1)),
+        ("\\begin{itemize}", (root, 3)),
+        ("\\item item", (root, 3)),
+        ("\\item more", (root, 4)),
+        ("\\end{itemize}", (root, 4)),
+    ]
+
+
+def test_source_map_of_empty_note():
+    process_markdown.STATE.source_map = []
+    assert process_markdown.obsidian_to_tex("") == ""
+    root = process_markdown.STATE.file[-1]
+    assert process_markdown.STATE.converted_map == [(root, 1)]
+
+
+@pytest.fixture(name="embed_vault")
+def embed_vault_fixture(write_vault):
+    vault = write_vault(
+        {
+            "A.md": "a\n![[B]]\n",
+            "B.md": "b\n![[C]]\n",
+            "C.md": "c\n![[A]]\n",
+            "Self.md": "![[Self]]\n",
+            "Deep.md": "![[A]]\n",
+        },
+        current=True,
+    )
+    process_markdown.STATE.file = [vault / "Root.md"]
+    return vault
+
+
+embed_limits_params = [
+    ("![[Self]]", {}, "Embed cycle `Self.md` > `Self.md`$"),
+    ("![[A]]", {}, "Embed cycle `A.md` > `B.md` > `C.md` > `A.md`"),
+    ("![[A]]", {"embedded": set()}, "Embed cycle `A.md` > `B.md`"),
+    (
+        "![[A]]",
+        {"max_embed_depth": 2},
+        "Embedding `C.md` in `B.md` goes beyond 2 levels of embeds",
+    ),
+    ("![[A]]", {"max_lines": 5}, "`.*C.md` takes the document beyond 5 lines"),
+    (
+        "![[A]]",
+        {"max_output_size": 2},
+        "`.*C.md` takes the document beyond 2 characters of TeX",
+    ),
+]
+
+
+@pytest.mark.parametrize("line, limits, message", embed_limits_params)
+@pytest.mark.usefixtures("embed_vault")
+def test_embed_limits(line, limits, message):
+    for name, value in limits.items():
+        setattr(process_markdown.STATE, name, value)
+    with pytest.raises(process_markdown.EmbedError, match=message):
+        process_markdown.embed_markdown(line)
+
+
+def test_embed_within_limits(embed_vault):
+    (embed_vault / "C.md").write_text("c\n", encoding="UTF-8")
+    process_markdown.STATE.max_embed_depth = 3
+    process_markdown.STATE.max_lines = 5
+    process_markdown.STATE.max_output_size = 3
+
+    process_markdown.embed_markdown("![[A]]")
+
+    assert process_markdown.STATE.lines_read == 5
+    assert process_markdown.STATE.output_size == 3
+
+
+cached_fragment_limits_params = [
+    ("max_output_size", lambda state: state.output_size + 1),
+    ("max_lines", lambda state: state.lines_read + 2),
+    ("max_embed_depth", lambda state: 1),
+]
+
+
+@pytest.mark.parametrize("limit, value", cached_fragment_limits_params)
+@pytest.mark.usefixtures("fragment_vault")
+def test_cached_fragments_count_towards_limits(limit, value):
+    process_markdown.embed_markdown("![[Hello]]")
+    setattr(process_markdown.STATE, limit, value(process_markdown.STATE))
+
+    with mock.patch.object(
+        process_markdown, "obsidian_to_tex", side_effect=AssertionError
+    ), pytest.raises(process_markdown.EmbedError):
+        process_markdown.embed_markdown("![[Hello]]")
+
+
+@pytest.mark.usefixtures("fragment_vault")
+def test_cached_fragments_within_limits():
+    process_markdown.STATE.max_embed_depth = 2
+    process_markdown.embed_markdown("![[Hello]]")
+    lines_read = process_markdown.STATE.lines_read
+    process_markdown.STATE.deepest_embed = 0
+
+    process_markdown.embed_markdown("![[Hello]]")
+
+    assert process_markdown.STATE.lines_read == 2 * lines_read
+    assert process_markdown.STATE.deepest_embed == 3
+
+
 @pydantic.validate_arguments
 def get_mock_open(file_contents: list[str]):
     reads = 0
@@ -686,6 +1078,46 @@ def test_embed_image(input_text, found_path, expected):
         "See, [ this is not a link.",
         R"See, \[ this is not a link.",
     ),
+    (
+        f"{file_line()} Link: Unclosed markdown link is text",
+        "See [here](https://www.google.com/",
+        R"See \[here](https://www.google.com/",
+    ),
+    (
+        f"{file_line()} Link: Unclosed document link is text",
+        "See [[Hello",
+        R"See \[\[Hello",
+    ),
+    (
+        f"{file_line()} Link: Brackets that are not a paragraph link",
+        "See [this [and that]]",
+        R"See \[this \[and that]]",
+    ),
+    (
+        f"{file_line()} Code: Unmatched back tick",
+        "It's a `trap",
+        R"It's a \textasciigrave{}trap",
+    ),
+    (
+        f"{file_line()} Format: Bold italic text",
+        "***both***",
+        R"\textbf{\textit{both}}",
+    ),
+    (
+        f"{file_line()} Format: Unmatched bold",
+        "**not bold",
+        "**not bold",
+    ),
+    (
+        f"{file_line()} Format: Unmatched italics",
+        "2 * 3 = 6",
+        "2 * 3 = 6",
+    ),
+    (
+        f"{file_line()} Format: Runs of four or more stars are literal",
+        "Password: ******** (hidden)",
+        "Password: ******** (hidden)",
+    ),
 ]
 
 
@@ -0,0 +1,122 @@
+import threading
+
+import pytest
+
+from obsidian_to_latex import scheduler
+
+
+def test_tasks_receive_dependency_results():
+    graph = scheduler.TaskGraph()
+    graph.add("a", lambda: 2)
+    graph.add("b", lambda: 3)
+    graph.add("product", lambda a, b: a * b, ["a", "b"])
+    graph.add("square", lambda p: p * p, ["product"])
+
+    results = graph.run(jobs=2)
+
+    assert results == {"a": 2, "b": 3, "product": 6, "square": 36}
+
+
+def test_independent_tasks_run_concurrently():
+    barrier = threading.Barrier(2, timeout=5)
+    graph = scheduler.TaskGraph()
+    graph.add("a", barrier.wait)
+    graph.add("b", barrier.wait)
+    graph.run(jobs=2)
+    assert set(graph.times) == {"a", "b"}
+
+
+def test_jobs_limit_concurrency():
+    lock = threading.Lock()
+    running = []
+    overlaps = []
+
+    def task():
+        with lock:
+            running.append(1)
+            overlaps.append(len(running))
+        with lock:
+            running.pop()
+
+    graph = scheduler.TaskGraph()
+    for name in "abcd":
+        graph.add(name, task)
+    graph.run(jobs=1)
+    assert overlaps == [1, 1, 1, 1]
+
+
+def test_tasks_can_add_tasks():
+    graph = scheduler.TaskGraph()
+
+    def expand():
+        for i in range(3):
+            graph.add(f"part {i}", lambda _, i=i: i, ["expand"])
+        graph.add(
+            "total",
+            lambda *parts: sum(parts),
+            [f"part {i}" for i in range(3)],
+        )
+
+    graph.add("expand", expand)
+    results = graph.run(jobs=2)
+    assert results["total"] == 3
+
+
+def test_failure_stops_dependents():
+    def fail():
+        raise RuntimeError("boom")
+
+    graph = scheduler.TaskGraph()
+    graph.add("fail", fail)
+    graph.add("after", lambda _: 1, ["fail"])
+    with pytest.raises(RuntimeError, match="boom"):
+        graph.run(jobs=2)
+    assert "after" not in graph.results
+
+
+add_errors_params = [
+    ("a", [], "already exists"),
+    ("b", ["missing"], "depends on unknown"),
+]
+
+
+@pytest.mark.parametrize("name, deps, message", add_errors_params)
+def test_add_errors(name, deps, message):
+    graph = scheduler.TaskGraph()
+    graph.add("a", lambda: None)
+    with pytest.raises(ValueError, match=message):
+        graph.add(name, lambda: None, deps)
+
+
+def test_critical_path():
+    graph = scheduler.TaskGraph()
+    graph.add("index", lambda: None)
+    graph.add("read", lambda: None)
+    graph.add("convert", lambda _i, _r: None, ["index", "read"])
+    graph.add("diagram", lambda _: None, ["convert"])
+    graph.add("write", lambda _: None, ["convert"])
+    graph.add("compile", lambda _w, _d: None, ["write", "diagram"])
+    graph.add("skipped", lambda _: None, ["compile"])
+    graph.times = {
+        "index": (0.0, 1.0),
+        "read": (0.0, 0.5),
+        "convert": (1.0, 3.0),
+        "diagram": (3.0, 6.0),
+        "write": (3.0, 3.5),
+        "compile": (6.0, 10.0),
+    }
+
+    path, total = graph.critical_path()
+
+    assert path == ["index", "convert", "diagram", "compile"]
+    assert total == pytest.approx(10.0)
+    assert graph.report() == (
+        "Critical path 10.00s: index 1.00s > convert 2.00s"
+        " > diagram 3.00s > compile 4.00s"
+    )
+
+
+def test_critical_path_before_run():
+    graph = scheduler.TaskGraph()
+    graph.add("a", lambda: None)
+    assert graph.critical_path() == ([], 0.0)
@@ -0,0 +1,90 @@
+import pytest
+
+from obsidian_to_latex import section
+
+NOTE = """\
+# Note
+intro
+## Design
+design text
+### Parts
+```python
+# not a heading
+```
+## Testing
+test text
+"""
+
+headings_params = [
+    ("# A\n## B", [(0, 1, "A"), (1, 2, "B")]),
+    ("# A\n```\n# code\n```\n#  B ", [(0, 1, "A"), (4, 1, "B")]),
+    ("text", []),
+]
+
+
+@pytest.mark.parametrize("text, expected", headings_params)
+def test_headings(text, expected):
+    assert list(section.headings(text.splitlines())) == expected
+
+
+select_section_params = [
+    (
+        "Design",
+        "# Design\ndesign text\n## Parts\n```python\n# not a heading\n```",
+    ),
+    ("Parts", "# Parts\n```python\n# not a heading\n```"),
+    ("Testing", "# Testing\ntest text"),
+    ("Note", NOTE.rstrip("\n")),
+]
+
+
+@pytest.mark.parametrize("heading, expected", select_section_params)
+def test_select_section(heading, expected):
+    assert section.select(NOTE, heading=heading) == expected
+
+
+def test_select_section_missing():
+    with pytest.raises(ValueError, match="No heading `Missing`; found `Note`"):
+        section.select(NOTE, heading="Missing")
+
+
+select_lines_params = [
+    ("1:2", "# Note\nintro"),
+    ("3:4", "# Note\n## Design\ndesign text"),
+    (":2", "# Note\nintro"),
+    ("7:", "# Note\n```python\n# not a heading\n```\n## Testing\ntest text"),
+    ("6:7", "# Note\n```python\n# not a heading\n```"),
+    ("2:2", "# Note\nintro"),
+]
+
+
+@pytest.mark.parametrize("line_range, expected", select_lines_params)
+def test_select_lines(line_range, expected):
+    assert section.select(NOTE, line_range=line_range) == expected
+
+
+def test_select_lines_without_title():
+    assert section.select("a\nb\nc", line_range="2:3") == "b\nc"
+
+
+select_lines_errors_params = [
+    ("1-2", "must look like"),
+    ("3:2", "not within 1:10"),
+    ("0:2", "not within"),
+    ("1:11", "not within"),
+]
+
+
+@pytest.mark.parametrize("line_range, message", select_lines_errors_params)
+def test_select_lines_errors(line_range, message):
+    with pytest.raises(ValueError, match=message):
+        section.select(NOTE, line_range=line_range)
+
+
+def test_select_nothing():
+    assert section.select(NOTE) == NOTE
+
+
+def test_select_both():
+    with pytest.raises(ValueError, match="not both"):
+        section.select(NOTE, "Design", "1:2")
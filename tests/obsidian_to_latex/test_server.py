@@ -0,0 +1,269 @@
+import json
+import shutil
+import socket
+import threading
+import urllib.request
+from concurrent import futures
+from pathlib import Path
+
+import pytest
+
+from obsidian_to_latex import build, server
+
+
+@pytest.fixture(name="vault", scope="module")
+def vault_fixture(tmp_path_factory):
+    tmp_path = tmp_path_factory.mktemp("vault")
+    (tmp_path / ".obsidian").mkdir()
+    (tmp_path / "notes").mkdir()
+    (tmp_path / "notes/Hello.md").write_text(
+        "# Hello\nlorem_ipsum\n![[World]]\n", encoding="UTF-8"
+    )
+    (tmp_path / "notes/World.md").write_text(
+        "# World\n## Dolor\nsit\n", encoding="UTF-8"
+    )
+    return tmp_path
+
+
+@pytest.fixture(name="service", scope="module")
+def service_fixture(vault):
+    service = server.ConversionService([vault], workers=1, max_queue=1)
+    service.warm_up()
+    yield service
+    service.close()
+
+
+def serve(httpd):
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    return thread
+
+
+@pytest.fixture(name="url", scope="module")
+def url_fixture(service):
+    httpd = server.make_server(service, port=0)
+    thread = serve(httpd)
+    host, port = httpd.server_address
+    yield f"http://{host}:{port}"
+    httpd.shutdown()
+    httpd.server_close()
+    thread.join()
+
+
+EXPECTED_TEX = "\nlorem\\_ipsum\n\\label{file_World_md}\n\\section{Dolor}\nsit"
+
+
+def test_tex_from_vault_file(url):
+    result = server.request(url, "/tex", {"file": "notes/Hello.md"})
+    assert result.decode("UTF-8") == EXPECTED_TEX
+
+
+def test_tex_from_request_markdown(url):
+    result = server.request(
+        url, "/tex", {"file": "notes/Hello.md", "markdown": "# Hi\n_x_"}
+    )
+    assert result.decode("UTF-8") == "\n\\_x\\_"
+
+
+request_error_params = [
+    ("/tex", {"file": "notes/Missing.md"}, "404"),
+    ("/tex", {}, "400"),
+    ("/tex", {"file": "../outside.md"}, "400"),
+    ("/tex", {"file": "notes/Hello.md", "options": {"bogus": 1}}, "400"),
+    ("/tex", {"vault": "other", "file": "notes/Hello.md"}, "400"),
+    ("/tex", {"file": "notes/Hello.md", "options": {"draft": "x"}}, "400"),
+    ("/tex", {"file": "notes/Hello.md", "options": {"template": "/t"}}, "400"),
+    (
+        "/pdf",
+        {"file": "notes/Hello.md", "options": {"build_root": "/"}},
+        "400",
+    ),
+    ("/nowhere", {"file": "notes/Hello.md"}, "404"),
+]
+
+
+@pytest.mark.parametrize("endpoint, payload, status", request_error_params)
+def test_request_errors(url, endpoint, payload, status):
+    with pytest.raises(Exception, match=f"Server responded {status}"):
+        server.request(url, endpoint, payload)
+
+
+def test_embed_cycle_is_reported(url, vault):
+    (vault / "notes/Loop.md").write_text("![[Loop]]\n", encoding="UTF-8")
+    with pytest.raises(Exception, match="Server responded 422: Embed cycle"):
+        server.request(url, "/tex", {"file": "notes/Loop.md"})
+
+
+def test_conversion_failure_is_reported(url, vault):
+    (vault / "notes/Broken.md").write_text("```\nno end", encoding="UTF-8")
+    with pytest.raises(Exception, match="Server responded 500"):
+        server.request(url, "/tex", {"file": "notes/Broken.md"})
+
+
+def test_health(url):
+    host, port = url.split("//")[1].split(":")
+    with socket.create_connection((host, int(port))) as s:
+        s.sendall(b"GET /health HTTP/1.0\r\n\r\n")
+        assert s.recv(1024).startswith(b"HTTP/1.0 200")
+    with socket.create_connection((host, int(port))) as s:
+        s.sendall(b"GET /nowhere HTTP/1.0\r\n\r\n")
+        assert s.recv(1024).startswith(b"HTTP/1.0 404")
+
+
+def test_metrics(url):
+    def metric(name):
+        response = urllib.request.urlopen(f"{url}/metrics", timeout=10)
+        with response:
+            text = response.read().decode("UTF-8")
+        prefix = f"obsidian_to_latex_{name} "
+        line = next(x for x in text.splitlines() if x.startswith(prefix))
+        return float(line[len(prefix) :])
+
+    lines = metric("lines_converted_total")
+    embeds = metric("notes_embedded_total")
+    failures = metric("failures_total")
+    server.request(url, "/tex", {"file": "notes/Hello.md"})
+    with pytest.raises(Exception, match="Server responded 404"):
+        server.request(url, "/tex", {"file": "notes/Missing.md"})
+
+    assert metric("lines_converted_total") >= lines + 3
+    assert metric("notes_embedded_total") == embeds + 1
+    assert metric("failures_total") == failures + 1
+    assert metric("conversion_seconds_count") >= 1
+
+
+def test_rejects_requests_beyond_queue(service, url):
+    # pylint: disable=protected-access
+    assert service._slots.acquire(blocking=False)
+    assert service._slots.acquire(blocking=False)
+    try:
+        with pytest.raises(server.ServiceBusy):
+            service.tex({"file": "notes/Hello.md"})
+        with pytest.raises(Exception, match="Server responded 503"):
+            server.request(url, "/pdf", {"file": "notes/Hello.md"})
+    finally:
+        service._slots.release()
+        service._slots.release()
+
+
+@pytest.mark.skipif(
+    not hasattr(socket, "AF_UNIX"), reason="Unix sockets unavailable"
+)
+def test_unix_socket(service, tmp_path):
+    # pylint: disable=no-member
+    sock = tmp_path / "service.sock"
+    httpd = server.make_server(service, unix_socket=sock)
+    thread = serve(httpd)
+    try:
+        result = server.request(
+            f"unix://{sock}", "/tex", {"file": "notes/Hello.md"}
+        )
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+        thread.join()
+    assert result.decode("UTF-8") == EXPECTED_TEX
+
+
+def test_serves_several_vaults(vault, tmp_path):
+    team = tmp_path / "team"
+    (team / ".obsidian").mkdir(parents=True)
+    (team / "Plan.md").write_text("# Plan\n![[Goal]]\n", encoding="UTF-8")
+    (team / "Goal.md").write_text("ship it\n", encoding="UTF-8")
+    service = server.ConversionService([vault, team], workers=1, max_vaults=1)
+    try:
+        plan = service.tex({"vault": "team", "file": "Plan.md"})
+        hello = service.tex({"vault": vault.name, "file": "notes/Hello.md"})
+        again = service.tex({"vault": "team", "file": "Plan.md"})
+        with pytest.raises(ValueError, match="Unknown vault `None`"):
+            service.tex({"file": "Plan.md"})
+    finally:
+        service.close()
+    assert plan == again == "\n\\label{file_Goal_md}ship it"
+    assert hello == EXPECTED_TEX
+
+
+def test_serves_vault_archives(vault, tmp_path):
+    archive = Path(shutil.make_archive(tmp_path / "snapshot", "zip", vault))
+    service = server.ConversionService([archive], workers=1)
+    try:
+        hello = service.tex(
+            {"vault": "snapshot.zip", "file": "notes/Hello.md"}
+        )
+    finally:
+        service.close()
+    assert hello == EXPECTED_TEX
+
+
+@pytest.mark.usefixtures("fake_tools")
+def test_concurrent_builds_of_one_note(tmp_path):
+    (tmp_path / ".obsidian").mkdir()
+    (tmp_path / "Note.md").write_text(
+        "# Note\nlatex-pause\n", encoding="UTF-8"
+    )
+    service = server.ConversionService([tmp_path], workers=2)
+    requests = [
+        {"file": "Note.md"},
+        {"file": "Note.md", "options": {"draft": True}},
+    ] * 2
+    try:
+        with futures.ThreadPoolExecutor(len(requests)) as pool:
+            pdfs = list(pool.map(service.pdf, requests))
+    finally:
+        service.close()
+    modes = [pdf.split(b"\n", 1)[0].split()[-1] for pdf in pdfs]
+    assert modes == [b"final", b"draft"] * 2
+    # Requests leave no build directories behind
+    assert not list((tmp_path / "temp").glob("*/*/body.tex"))
+
+
+def test_vault_names_must_differ(tmp_path):
+    (tmp_path / "a/v").mkdir(parents=True)
+    (tmp_path / "b/v").mkdir(parents=True)
+    with pytest.raises(ValueError, match="More than one vault is named"):
+        server.ConversionService([tmp_path / "a/v", tmp_path / "b/v"])
+
+
+def test_vaults_must_be_folders_or_archives(tmp_path):
+    (tmp_path / "notes.txt").write_text("", encoding="UTF-8")
+    with pytest.raises(ValueError, match="neither a folder nor"):
+        server.ConversionService([tmp_path / "notes.txt"])
+
+
+def test_encode_options_round_trips():
+    options = build.BuildOptions(
+        template=Path("/templates/report.tex"), job_id="42"
+    )
+    encoded = server.encode_options(options)
+    assert encoded["template"] == str(Path("/templates/report.tex"))
+    assert json.loads(json.dumps(encoded)) == encoded
+    assert server.decode_options(encoded) == options
+
+
+def test_decode_unknown_options():
+    with pytest.raises(ValueError, match=r"Unknown options \['bogus'\]"):
+        server.decode_options({"draft": True, "bogus": 1})
+
+
+def test_decode_request_options():
+    base = build.BuildOptions(cache_dir=Path("/cache"), jobs=3)
+    options = server.decode_options(
+        {"draft": True}, base, server.REQUEST_OPTIONS
+    )
+    assert options == build.BuildOptions(
+        cache_dir=Path("/cache"), jobs=3, draft=True
+    )
+    with pytest.raises(ValueError, match="cannot be set by requests"):
+        server.decode_options(
+            {"cache_dir": "/tmp"}, base, server.REQUEST_OPTIONS
+        )
+
+
+def test_request_options():
+    options = build.BuildOptions(
+        draft=True, cache_dir=Path("/cache"), template=Path("/t.tex")
+    )
+    encoded = server.request_options(options)
+    assert set(encoded) == server.REQUEST_OPTIONS
+    assert encoded["draft"] is True
+    assert server.decode_options(encoded, allowed=server.REQUEST_OPTIONS)
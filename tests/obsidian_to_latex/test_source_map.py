@@ -0,0 +1,92 @@
+from pathlib import Path
+
+import pytest
+
+from obsidian_to_latex import source_map
+
+ROOT = Path("/vault")
+SOURCES = [
+    (ROOT / "Root.md", 1),
+    (ROOT / "Root.md", 1),
+    (ROOT / "notes/Child.md", 3),
+    (ROOT / "notes/Child.md", 4),
+    (ROOT / "Root.md", 2),
+    (Path("/elsewhere/Other.md"), 7),
+]
+
+
+def test_encode():
+    assert source_map.encode(SOURCES, ROOT) == {
+        "files": ["Root.md", "notes/Child.md", "/elsewhere/Other.md"],
+        "runs": [[1, 0, 1], [3, 1, 3], [4, 1, 4], [5, 0, 2], [6, 2, 7]],
+        "lines": 6,
+    }
+
+
+def test_decode():
+    assert source_map.decode(source_map.encode(SOURCES)) == SOURCES
+    assert not source_map.decode(source_map.encode([]))
+
+
+lookup_params = [
+    (1, ("Root.md", 1)),
+    (2, ("Root.md", 1)),
+    (4, ("notes/Child.md", 4)),
+    (6, ("/elsewhere/Other.md", 7)),
+    (0, None),
+    (7, None),
+]
+
+
+@pytest.mark.parametrize("tex_line, expected", lookup_params)
+def test_lookup(tex_line, expected):
+    encoded = source_map.encode(SOURCES, ROOT)
+    assert source_map.lookup(encoded, tex_line) == expected
+
+
+def test_write_then_load(tmp_path):
+    path = tmp_path / "body.map.json"
+    source_map.write(path, SOURCES, ROOT)
+    assert source_map.load(path) == source_map.encode(SOURCES, ROOT)
+
+
+@pytest.mark.parametrize("content", [None, "{"])
+def test_load_missing_or_corrupt(tmp_path, content):
+    path = tmp_path / "body.map.json"
+    if content is not None:
+        path.write_text(content, encoding="UTF-8")
+    assert source_map.load(path) is None
+
+
+def test_translate_errors():
+    log = (
+        "This is pdfTeX\n"
+        "./body.tex:3: Undefined control sequence.\n"
+        "l.3 \\foo\n"
+        "./document.tex:12: LaTeX Error: File `x.sty' not found.\n"
+        "./body.tex:99: Missing $ inserted.\n"
+    )
+    encoded = source_map.encode(SOURCES, ROOT)
+
+    errors = source_map.translate_errors(log, encoded, "body.tex")
+
+    assert errors == [
+        "notes/Child.md:3: Undefined control sequence. (body.tex:3)",
+        "./document.tex:12: LaTeX Error: File `x.sty' not found.",
+        "./body.tex:99: Missing $ inserted.",
+    ]
+
+
+changed_region_params = [
+    ("a\nb\nc", "a\nb\nc", None),
+    ("a\nb\nc", "a\nB\nc", (2, 2)),
+    ("a\nb\nc", "a\nb\nx\ny\nc", (3, 4)),
+    ("a\nb\nc", "a\nc", (2, 2)),
+    ("a", "b\na", (1, 1)),
+    ("a\nb", "a\nb\nc", (3, 3)),
+]
+
+
+@pytest.mark.parametrize("old, new, expected", changed_region_params)
+def test_changed_region(old, new, expected):
+    assert source_map.changed_region(old, new) == expected
@@ -0,0 +1,178 @@
+import hashlib
+import pickle
+import shutil
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from obsidian_to_latex import obsidian_path, process_markdown, storage
+
+FILES = {
+    "Root.md": "# Root\n![[Hello]]\n![[pic.png]]\n",
+    "notes/Hello.md": "# Hello\nworld\n",
+    "images/pic.png": b"png",
+    "drafts/Hello.md": "# Draft\n",
+    ".obsidian_to_latex_ignore": "drafts/\n",
+}
+
+
+def local_vault(tmp_path):
+    root = tmp_path / "vault"
+    for name, data in FILES.items():
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if isinstance(data, str):
+            data = data.encode("UTF-8")
+        path.write_bytes(data)
+    return root
+
+
+def open_local(tmp_path):
+    return storage.LocalStorage(local_vault(tmp_path))
+
+
+def open_memory(tmp_path):
+    return storage.MemoryStorage(tmp_path / "memory", FILES)
+
+
+def open_zip(tmp_path):
+    root = local_vault(tmp_path)
+    archive = shutil.make_archive(tmp_path / "vault", "zip", root)
+    return storage.ArchiveStorage(Path(archive))
+
+
+def open_tar(tmp_path):
+    root = local_vault(tmp_path)
+    archive = shutil.make_archive(tmp_path / "vault", "gztar", root)
+    return storage.ArchiveStorage(Path(archive))
+
+
+@pytest.fixture(
+    name="store", params=[open_local, open_memory, open_zip, open_tar]
+)
+def store_fixture(request, tmp_path):
+    store = request.param(tmp_path)
+    yield store
+    obsidian_path.VAULT = None
+
+
+def test_list_dir(store):
+    assert store.list_dir("") == [
+        (".obsidian_to_latex_ignore", False),
+        ("Root.md", False),
+        ("drafts", True),
+        ("images", True),
+        ("notes", True),
+    ]
+    assert store.list_dir("notes/") == [("Hello.md", False)]
+    with pytest.raises(OSError):
+        store.list_dir("missing/")
+
+
+def test_read(store):
+    assert store.read_text(store.root / "notes/Hello.md") == "# Hello\nworld\n"
+    assert store.read_bytes(store.root / "images/pic.png") == b"png"
+    assert store.exists(store.root / "Root.md")
+    assert not store.exists(store.root / "Missing.md")
+    assert not store.exists(store.root.parent / "Root.md")
+    with pytest.raises(FileNotFoundError):
+        store.read_bytes(store.root / "Missing.md")
+    with pytest.raises(FileNotFoundError):
+        store.read_bytes(store.root.parent / "Root.md")
+
+
+def test_scan_and_find(store):
+    rules = obsidian_path.load_ignore_rules(store)
+    scan = obsidian_path.scan_vault(store, rules)
+    vault = obsidian_path.Vault(store.root, store=store)
+
+    assert scan.paths == {
+        ".obsidian_to_latex_ignore": [
+            store.root / ".obsidian_to_latex_ignore"
+        ],
+        "Root.md": [store.root / "Root.md"],
+        "pic.png": [store.root / "images/pic.png"],
+        "Hello.md": [store.root / "notes/Hello.md"],
+    }
+    assert vault.find_file("Hello.md") == store.root / "notes/Hello.md"
+    with pytest.raises(FileNotFoundError):
+        vault.find_file("Missing.md")
+
+
+def test_convert(store, tmp_path):
+    obsidian_path.VAULT = obsidian_path.Vault(store.root, store=store)
+    process_markdown.STATE = process_markdown.State.new()
+    process_markdown.STATE.file.append(store.root / "Root.md")
+    process_markdown.STATE.temp_dir = tmp_path / "build"
+
+    text = obsidian_path.read_text(store.root / "Root.md")
+    result = process_markdown.obsidian_to_tex(text)
+    again = process_markdown.obsidian_to_tex(text)
+
+    if store.on_disk:
+        image = store.root / "images/pic"
+    else:
+        digest = hashlib.sha256(b"png").hexdigest()[:16]
+        image = tmp_path / "build" / f"image_{digest}"
+        assert image.with_suffix(".png").read_bytes() == b"png"
+    assert (
+        result
+        == again
+        == (
+            "\n\\label{file_Hello_md}\nworld\n"
+            "\\includegraphics[width=\\columnwidth,keepaspectratio]"
+            f"{{{obsidian_path.format_path(image)}}}"
+        )
+    )
+
+
+def test_local_dir(store):
+    note = store.root / "notes/Hello.md"
+    if store.on_disk:
+        assert store.local_dir(note) == store.root / "notes"
+        return
+    local_dir = store.local_dir(note)
+    assert local_dir.name == "notes"
+    assert local_dir.parent.name.startswith(f"{store.root.name}-")
+    assert Path(tempfile.gettempdir()) in local_dir.parents
+
+
+def test_storage_for_files_outside_the_vault(tmp_path):
+    obsidian_path.VAULT = obsidian_path.Vault(
+        tmp_path / "memory", store=open_memory(tmp_path)
+    )
+    outside = tmp_path / "template.tex"
+    outside.write_text("\\documentclass{article}", encoding="UTF-8")
+    try:
+        assert obsidian_path.storage_for(outside).on_disk
+        assert obsidian_path.read_bytes(outside) == b"\\documentclass{article}"
+        assert obsidian_path.read_text(tmp_path / "memory/Root.md").startswith(
+            "# Root"
+        )
+    finally:
+        obsidian_path.VAULT = None
+
+
+def test_memory_paths_and_line_endings(tmp_path):
+    store = storage.MemoryStorage(
+        tmp_path, {"./a\\b.md": "x\r\ny\rz\n", "/c.md": b"\xc3\xa9"}
+    )
+    assert store.read_text(tmp_path / "a/b.md") == "x\ny\nz\n"
+    assert store.read_text(tmp_path / "c.md") == "é"
+
+
+def test_archive_storage_can_be_pickled(tmp_path):
+    store = open_zip(tmp_path)
+    copy = pickle.loads(pickle.dumps(store))
+    assert copy.root == store.root
+    assert copy.read_text(copy.root / "notes/Hello.md") == "# Hello\nworld\n"
+
+
+def test_open_storage(tmp_path):
+    archive = open_tar(tmp_path).root
+    (tmp_path / "notes.txt").write_text("", encoding="UTF-8")
+    assert isinstance(storage.open_storage(archive), storage.ArchiveStorage)
+    assert isinstance(storage.open_storage(tmp_path), storage.LocalStorage)
+    assert not storage.is_archive(tmp_path / "notes.txt")
+    assert not storage.is_archive(tmp_path / "missing.zip")